@@ -29,8 +29,20 @@ export function override(resources: AmplifyApiRestResourceStackTemplate) {
     },
   });
 
+  // Treat JSON as binary, so API Gateway decodes the base64 bodies of the gzip compressed
+  // responses. JSON request bodies then reach the Lambda base64 encoded too. A wildcard would
+  // also catch the CORS preflight mock integrations and fail their templates.
+  resources.restApi.addPropertyOverride("Body.x-amazon-apigateway-binary-media-types", ["application/json"]);
+
   // For every path in your REST API
   for (const path in resources.restApi.body.paths) {
+    // Keep the CORS preflight mock integrations on text whatever the binary media types
+    if (resources.restApi.body.paths[path].options) {
+      resources.restApi.addPropertyOverride(
+        `Body.paths.${path}.options.x-amazon-apigateway-integration.contentHandling`,
+        "CONVERT_TO_TEXT"
+      );
+    }
     if (path.startsWith('/somepath')) {
        console.log('Skip the path not to use Authorization header', path);
        continue;
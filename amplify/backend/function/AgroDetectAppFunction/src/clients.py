@@ -0,0 +1,126 @@
+import os
+import threading
+from typing import Callable, Dict, Optional
+
+import boto3
+from botocore.config import Config
+
+# Seconds to wait for a TCP connection to any AWS endpoint
+CONNECT_TIMEOUT: float = float(os.environ.get("AWS_CONNECT_TIMEOUT", "2"))
+
+# Size of the urllib3 connection pool kept open per client
+MAX_POOL_CONNECTIONS: int = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", "10"))
+
+# Total attempts (first call included) made by the botocore retry handler
+MAX_ATTEMPTS: int = int(os.environ.get("AWS_MAX_ATTEMPTS", "3"))
+
+# Botocore retry mode, one of "legacy", "standard" or "adaptive"
+RETRY_MODE: str = os.environ.get("AWS_RETRY_MODE", "standard")
+
+# Per service read timeouts, the serverless SageMaker endpoint can cold start
+READ_TIMEOUTS: Dict[str, float] = {
+    "rekognition": float(os.environ.get("REKOGNITION_READ_TIMEOUT", "5")),
+    "sagemaker-runtime": float(os.environ.get("SAGEMAKER_READ_TIMEOUT", "30")),
+    "dynamodb": float(os.environ.get("DYNAMODB_READ_TIMEOUT", "2")),
+}
+
+DEFAULT_READ_TIMEOUT: float = 10
+
+# Per service endpoint overrides, e.g. test/local_endpoint/local_endpoint.py in place of SageMaker
+ENDPOINT_URLS: Dict[str, Optional[str]] = {
+    "rekognition": os.environ.get("REKOGNITION_ENDPOINT_URL"),
+    "sagemaker-runtime": os.environ.get("SAGEMAKER_ENDPOINT_URL"),
+    "dynamodb": os.environ.get("DYNAMODB_ENDPOINT_URL"),
+    "sqs": os.environ.get("SQS_ENDPOINT_URL"),
+    "s3": os.environ.get("S3_ENDPOINT_URL"),
+}
+
+_CLIENTS: Dict[str, boto3.client] = {}
+_LOCK = threading.Lock()
+
+
+def build_config(service_name: str, read_timeout: Optional[float] = None,
+                 max_attempts: Optional[int] = None) -> Config:
+    """ Builds the botocore configuration used for a service client.
+
+    Args:
+        service_name (str): Name of the AWS service.
+        read_timeout (float, optional): Overrides the read timeout of the service.
+        max_attempts (int, optional): Overrides MAX_ATTEMPTS.
+
+    Returns:
+        Config: Botocore client configuration.
+    """
+
+    read_timeout = read_timeout or READ_TIMEOUTS.get(service_name, DEFAULT_READ_TIMEOUT)
+
+    return Config(
+        connect_timeout=min(CONNECT_TIMEOUT, read_timeout),
+        read_timeout=read_timeout,
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        retries={"total_max_attempts": max_attempts or MAX_ATTEMPTS, "mode": RETRY_MODE})
+
+
+def get_client(service_name: str, config: Optional[Config] = None) -> boto3.client:
+    """ Returns the client for a service, creating it on first use.
+
+    Clients are kept at module level so that warm invocations of the same
+    container reuse the open connections instead of handshaking again.
+
+    Args:
+        service_name (str): Name of the AWS service.
+        config (Config, optional): Overrides the default configuration on creation.
+
+    Returns:
+        boto3.client: Client for the service.
+    """
+
+    return _get_or_create(service_name, service_name, lambda: config or build_config(service_name))
+
+
+def get_budget_client(service_name: str, read_timeout: float, max_attempts: int) -> boto3.client:
+    """ Returns the client for a service with a shorter read timeout or fewer attempts.
+
+    Used when the time left in a request is shorter than the defaults allow.
+    Clients are cached per setting, deadline.py rounds the timeouts to a few
+    steps so that only a handful exist.
+
+    Args:
+        service_name (str): Name of the AWS service.
+        read_timeout (float): Read timeout in seconds.
+        max_attempts (int): Total attempts, first call included.
+
+    Returns:
+        boto3.client: Client for the service.
+    """
+
+    if read_timeout == READ_TIMEOUTS.get(service_name, DEFAULT_READ_TIMEOUT) and max_attempts == MAX_ATTEMPTS:
+        return get_client(service_name)
+
+    return _get_or_create("{}:{}:{}".format(service_name, read_timeout, max_attempts), service_name,
+                          lambda: build_config(service_name, read_timeout, max_attempts))
+
+
+def _get_or_create(key: str, service_name: str, build: Callable[[], Config]) -> boto3.client:
+    client = _CLIENTS.get(key)
+
+    if client is None:
+        with _LOCK:
+            client = _CLIENTS.get(key)
+
+            if client is None:
+                endpoint_url = ENDPOINT_URLS.get(service_name)
+                endpoint_params = {"endpoint_url": endpoint_url} if endpoint_url else {}
+
+                client = boto3.client(service_name, config=build(), **endpoint_params)
+                _CLIENTS[key] = client
+
+    return client
+
+
+def reset_clients() -> None:
+    """ Drops every cached client, the next call to get_client creates new ones. """
+
+    with _LOCK:
+        _CLIENTS.clear()
@@ -0,0 +1,250 @@
+import math
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, NamedTuple, Optional, TypeVar
+
+import botocore
+
+try:
+    from .clients import DEFAULT_READ_TIMEOUT, MAX_ATTEMPTS, READ_TIMEOUTS
+    from .metrics import is_abandoned
+    from .resilience import NOT_RETRYABLE_CODES, is_failure
+except ImportError:
+    from clients import DEFAULT_READ_TIMEOUT, MAX_ATTEMPTS, READ_TIMEOUTS
+    from metrics import is_abandoned
+    from resilience import NOT_RETRYABLE_CODES, is_failure
+
+T = TypeVar("T")
+
+# Integration timeout of API Gateway, the client gets a 504 from the gateway after it
+API_GATEWAY_TIMEOUT_MS: float = float(os.environ.get("API_GATEWAY_TIMEOUT_MS", "29000"))
+
+# Time kept aside to build and return the response once the last stage ends
+DEADLINE_RESERVE_MS: float = float(os.environ.get("DEADLINE_RESERVE_MS", "500"))
+
+# Share of the time left a stage may use, the rest is kept for the later stages
+STAGE_SHARES: Dict[str, float] = {
+    "rekognition": float(os.environ.get("REKOGNITION_BUDGET_SHARE", "0.3")),
+    "sagemaker-runtime": float(os.environ.get("SAGEMAKER_BUDGET_SHARE", "0.9")),
+    "dynamodb": float(os.environ.get("DYNAMODB_BUDGET_SHARE", "0.5")),
+}
+
+# Read timeouts are rounded down to these steps, so a few clients per service are reused
+TIMEOUT_STEPS: List[float] = [0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60]
+
+# Base and cap of the exponential backoff between two attempts, in seconds
+RETRY_BASE_DELAY: float = float(os.environ.get("RETRY_BASE_DELAY", "0.05"))
+RETRY_MAX_DELAY: float = float(os.environ.get("RETRY_MAX_DELAY", "1"))
+
+# Errors returned before the read timeout, a timeout already used the time a retry would need
+FAST_RETRY_ERRORS = (botocore.exceptions.EndpointConnectionError, botocore.exceptions.ConnectionClosedError)
+
+
+class DeadlineExceeded(Exception):
+    """ Raised instead of starting a stage when the request has no time left. """
+
+
+class Budget(NamedTuple):
+    """ Time a stage may use and the client settings derived from it.
+
+    max_attempts bounds the attempts made by Deadline.retry, the clients
+    themselves make a single attempt each.
+    """
+
+    seconds: float
+    read_timeout: float
+    max_attempts: int
+
+
+def is_fast_retryable(error: BaseException) -> bool:
+    """ Checks if an error is transient and returned quickly, e.g. throttling or a 5xx.
+
+    Args:
+        error (BaseException): Error raised by the call.
+
+    Returns:
+        bool: True if a retry is worth its time.
+    """
+
+    if isinstance(error, botocore.exceptions.ClientError):
+        return is_failure(error) and error.response.get("Error", {}).get("Code") not in NOT_RETRYABLE_CODES
+
+    return isinstance(error, FAST_RETRY_ERRORS)
+
+
+def round_timeout(seconds: float) -> float:
+    """ Rounds a timeout down to the closest step, never below the first one.
+
+    Args:
+        seconds (float): Timeout.
+
+    Returns:
+        float: Rounded timeout.
+    """
+
+    return max([step for step in TIMEOUT_STEPS if step <= seconds] or TIMEOUT_STEPS[:1])
+
+
+class Deadline:
+    """ Time left in the current request and the budget of each downstream stage.
+
+    The deadline is the earliest of the Lambda timeout and, for API requests,
+    the API Gateway timeout, minus a reserve to return the response. Each
+    stage gets a share of the time left when it starts, which bounds its read
+    timeout. Fast transient errors are retried while the share lasts, rather
+    than reserving a whole read timeout per attempt up front.
+    """
+
+    def __init__(self, reserve_ms: float = DEADLINE_RESERVE_MS, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        """
+        Args:
+            reserve_ms (float): Time kept to return the response.
+            clock (callable): Monotonic clock in seconds.
+            sleep (callable): Waits between two attempts.
+        """
+
+        self.reserve_ms = reserve_ms
+        self.clock = clock
+        self.sleep = sleep
+
+        self._started_at = 0.0
+        self._expires_at = math.inf
+        self._stages: List[dict] = []
+        self._lock = threading.Lock()
+
+    def begin(self, remaining_ms: Optional[float], limit_ms: Optional[float] = None) -> None:
+        """ Starts the deadline of a new request.
+
+        Args:
+            remaining_ms (float, optional): Time left before the platform stops the function, None if unknown.
+            limit_ms (float, optional): Further limit, e.g. the API Gateway timeout.
+        """
+
+        limits = [value for value in (remaining_ms, limit_ms) if value is not None]
+
+        with self._lock:
+            self._started_at = self.clock()
+            self._expires_at = self._started_at + (min(limits) - self.reserve_ms) / 1000 if limits else math.inf
+            self._stages = []
+
+    def remaining(self) -> float:
+        """
+        Returns:
+            float: Seconds left, infinite without a deadline.
+        """
+
+        return self._expires_at - self.clock()
+
+    def budget(self, service_name: str) -> Budget:
+        """ Derives the client settings of a stage from the time left.
+
+        Args:
+            service_name (str): Name of the AWS service called by the stage.
+
+        Raises:
+            DeadlineExceeded: If no time is left.
+
+        Returns:
+            Budget: Budget of the stage.
+        """
+
+        remaining = self.remaining()
+        default_timeout = READ_TIMEOUTS.get(service_name, DEFAULT_READ_TIMEOUT)
+
+        if remaining == math.inf:
+            return Budget(math.inf, default_timeout, MAX_ATTEMPTS)
+
+        if remaining <= 0:
+            raise DeadlineExceeded("No time left for {}".format(service_name))
+
+        seconds = remaining * STAGE_SHARES.get(service_name, 1.0)
+
+        return Budget(seconds, round_timeout(min(default_timeout, seconds)), MAX_ATTEMPTS)
+
+    def retry(self, budget: Budget, call: Callable[[Budget], T]) -> T:
+        """ Runs the call of a stage, retrying fast transient errors while its budget lasts.
+
+        Every attempt gets the part of the budget still left, so a retry never
+        outlives the stage. Timeouts are not retried.
+
+        Args:
+            budget (Budget): Budget of the stage.
+            call (callable): Makes one attempt given the budget left, e.g. with a client of that read timeout.
+
+        Raises:
+            Exception: Error of the last attempt.
+
+        Returns:
+            obj: Result of the first successful attempt.
+        """
+
+        expires_at = self.clock() + budget.seconds
+        attempt = 1
+
+        while True:
+            # pylint: disable=W0703
+            try:
+                return call(budget)
+            except Exception as error:
+                delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+                seconds = expires_at - self.clock() - delay
+
+                # Nothing is gained from an attempt shorter than the smallest read timeout
+                if attempt >= budget.max_attempts or not is_fast_retryable(error) or seconds < TIMEOUT_STEPS[0]:
+                    raise
+
+            self.sleep(delay)
+            attempt += 1
+            budget = Budget(seconds, round_timeout(min(budget.read_timeout, seconds)), budget.max_attempts)
+
+    @contextmanager
+    def stage(self, name: str, service_name: str):
+        """ Computes the budget of a stage and records the time it used.
+
+        Args:
+            name (str): Name of the stage.
+            service_name (str): Name of the AWS service called by the stage.
+
+        Raises:
+            DeadlineExceeded: If no time is left.
+
+        Yields:
+            Budget: Budget of the stage.
+        """
+
+        budget = self.budget(service_name)
+        start = self.clock()
+
+        try:
+            yield budget
+        finally:
+            # A call abandoned by its request would land in the stages of another one
+            if not is_abandoned():
+                with self._lock:
+                    self._stages.append({
+                        "Stage": name,
+                        "BudgetMs": round(budget.seconds * 1000) if budget.seconds != math.inf else None,
+                        "UsedMs": round((self.clock() - start) * 1000),
+                        "ReadTimeout": budget.read_timeout,
+                        "MaxAttempts": budget.max_attempts
+                    })
+
+    def summary(self) -> dict:
+        """ Budget usage of the current request, for the logs.
+
+        Returns:
+            dict: Total time, time left and the usage of every stage.
+        """
+
+        remaining = self.remaining()
+
+        with self._lock:
+            return {
+                "ElapsedMs": round((self.clock() - self._started_at) * 1000),
+                "RemainingMs": round(remaining * 1000) if remaining != math.inf else None,
+                "Stages": list(self._stages)
+            }
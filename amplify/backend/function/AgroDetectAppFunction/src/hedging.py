@@ -0,0 +1,215 @@
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Deque, Optional
+
+logger = logging.getLogger()
+
+# Sends a duplicate of slow inference calls when "true"
+HEDGE_REQUESTS: bool = os.environ.get("HEDGE_REQUESTS", "false").lower() == "true"
+
+# Percentile of the recent latencies after which a call is hedged
+HEDGE_PERCENTILE: float = float(os.environ.get("HEDGE_PERCENTILE", "90"))
+
+# Maximum share of the calls that get a duplicate
+HEDGE_MAX_RATE: float = float(os.environ.get("HEDGE_MAX_RATE", "0.05"))
+
+# Number of recent latencies the percentile is computed on
+HEDGE_WINDOW: int = int(os.environ.get("HEDGE_WINDOW", "200"))
+
+# Latencies needed before any call is hedged
+HEDGE_MIN_SAMPLES: int = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+
+
+class LatencyTracker:
+    """ Rolling window of the latencies of successful calls. """
+
+    def __init__(self, window: int = HEDGE_WINDOW):
+        """
+        Args:
+            window (int): Number of latencies kept.
+        """
+
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, latency_ms: float) -> None:
+        with self._lock:
+            self._latencies.append(latency_ms)
+
+    def percentile(self, q: float) -> float:
+        """ Nearest rank percentile of the window.
+
+        Args:
+            q (float): Percentile, between 0 and 100.
+
+        Returns:
+            float: Latency in milliseconds, NaN on an empty window.
+        """
+
+        with self._lock:
+            latencies = sorted(self._latencies)
+
+        if not latencies:
+            return math.nan
+
+        return latencies[min(len(latencies) - 1, max(0, math.ceil(q / 100 * len(latencies)) - 1))]
+
+    def __len__(self) -> int:
+        return len(self._latencies)
+
+
+class Hedger:
+    """ Sends a duplicate of a call that is slower than most recent calls, the first success wins.
+
+    Slow calls are usually caused by a single slow instance behind the
+    endpoint, so a duplicate sent after the rolling percentile often comes back
+    first. Duplicates are capped to a share of the calls, so an overloaded
+    endpoint never gets much more than its usual load. The losing call
+    cannot be interrupted, its result is passed to the cleanup callback.
+    """
+
+    def __init__(self, percentile: float = HEDGE_PERCENTILE, max_rate: float = HEDGE_MAX_RATE,
+                 window: int = HEDGE_WINDOW, min_samples: int = HEDGE_MIN_SAMPLES, max_workers: int = 4):
+        """
+        Args:
+            percentile (float): Percentile of the recent latencies after which a call is hedged.
+            max_rate (float): Maximum share of the calls that get a duplicate.
+            window (int): Number of recent latencies kept.
+            min_samples (int): Latencies needed before any call is hedged.
+            max_workers (int): Threads running the calls, two per hedged call.
+        """
+
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.min_samples = min_samples
+        self.tracker = LatencyTracker(window)
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+
+    def delay_ms(self) -> Optional[float]:
+        """
+        Returns:
+            float: Time after which a call gets a duplicate, None until enough latencies are known.
+        """
+
+        if len(self.tracker) < self.min_samples:
+            return None
+
+        return self.tracker.percentile(self.percentile)
+
+    def call(self, fn: Callable, cleanup: Optional[Callable] = None,
+             on_outcome: Optional[Callable[[bool, bool], None]] = None):
+        """ Runs a call, with a duplicate if it is slow.
+
+        Args:
+            fn (callable): Call without arguments, run at most twice.
+            cleanup (callable, optional): Called with the result of a losing call.
+            on_outcome (callable, optional): Called with whether the call was hedged and the duplicate won.
+
+        Raises:
+            Exception: Error of the first call if both calls fail.
+
+        Returns:
+            obj: Result of the first successful call.
+        """
+
+        with self._lock:
+            self.calls += 1
+
+        delay = self.delay_ms()
+
+        if delay is None:
+            if on_outcome is not None:
+                on_outcome(False, False)
+
+            return self._timed(fn)
+
+        primary = self._executor.submit(self._timed, fn)
+        done, _ = wait([primary], timeout=delay / 1000)
+
+        if done or not self._claim_hedge():
+            if on_outcome is not None:
+                on_outcome(False, False)
+
+            return primary.result()
+
+        hedge = self._executor.submit(self._timed, fn)
+        winner = self._first_success([primary, hedge])
+
+        for future in (primary, hedge):
+            if future is not winner and cleanup is not None:
+                future.add_done_callback(lambda done_future: self._cleanup(done_future, cleanup))
+
+        hedge_won = winner is hedge
+
+        if hedge_won:
+            with self._lock:
+                self.hedge_wins += 1
+
+        logger.info("Hedged call: %s", {"DelayMs": round(delay, 1), "HedgeWon": hedge_won})
+
+        if on_outcome is not None:
+            on_outcome(True, hedge_won)
+
+        return winner.result()
+
+    def stats(self) -> dict:
+        """ Hedge counters since the container started.
+
+        Returns:
+            dict: Calls, hedges, hedge rate and hedge win rate.
+        """
+
+        with self._lock:
+            return {
+                "Calls": self.calls,
+                "Hedges": self.hedges,
+                "HedgeRate": self.hedges / self.calls if self.calls else 0.0,
+                "HedgeWinRate": self.hedge_wins / self.hedges if self.hedges else 0.0
+            }
+
+    def _claim_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.max_rate * self.calls:
+                return False
+
+            self.hedges += 1
+
+            return True
+
+    def _timed(self, fn: Callable):
+        start = time.perf_counter()
+        result = fn()
+        self.tracker.add((time.perf_counter() - start) * 1000)
+
+        return result
+
+    @staticmethod
+    def _first_success(futures) -> Future:
+        """ Waits for the first call that succeeds, or for every call if all fail. """
+
+        pending = set(futures)
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in futures:
+                if future in done and future.exception() is None:
+                    return future
+
+        # Both failed, the error of the first call is raised
+        return futures[0]
+
+    @staticmethod
+    def _cleanup(future: Future, cleanup: Callable) -> None:
+        if future.exception() is None:
+            cleanup(future.result())
@@ -1,20 +1,208 @@
 import base64
+import binascii
 import json
 import logging
 import os
-from typing import List
+import threading
+import time
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 import boto3
 import botocore
 from aws_xray_sdk.core import patch_all
 
+# Sibling modules are relative under the tests package and top level in the Lambda task root
+try:
+    from .clients import get_budget_client, get_client
+    from .deadline import API_GATEWAY_TIMEOUT_MS, Budget, Deadline, DeadlineExceeded
+    from .hedging import HEDGE_REQUESTS, Hedger
+    from .jobs import RUNNING, JobBackend, complete_job, get_job_id, is_queue_event, new_job
+    from .knowledge_base import KnowledgeBase
+    from .log_utils import Fields, PayloadSampler, summarize_event
+    from .metrics import Metrics, abandonable, carry_abandon
+    from .prediction_cache import (PREDICTION_CACHE_READ_TIMEOUT, PREDICTION_CACHE_TABLE,
+                                   DynamoDBBackend, LRUBackend, PredictionCache, image_key)
+    from .preprocessing import InvalidImage, PreparedImage, prepare_image, validate_image
+    from .resilience import (CircuitBreaker, ConcurrencyLimiter, Dependency,
+                             DependencyUnavailable, retry_after_header)
+    from .responses import RenderedBody, ResponseCache, choose_encoding, etag_matches
+except ImportError:
+    from clients import get_budget_client, get_client
+    from deadline import API_GATEWAY_TIMEOUT_MS, Budget, Deadline, DeadlineExceeded
+    from hedging import HEDGE_REQUESTS, Hedger
+    from jobs import RUNNING, JobBackend, complete_job, get_job_id, is_queue_event, new_job
+    from knowledge_base import KnowledgeBase
+    from log_utils import Fields, PayloadSampler, summarize_event
+    from metrics import Metrics, abandonable, carry_abandon
+    from prediction_cache import (PREDICTION_CACHE_READ_TIMEOUT, PREDICTION_CACHE_TABLE,
+                                  DynamoDBBackend, LRUBackend, PredictionCache, image_key)
+    from preprocessing import InvalidImage, PreparedImage, prepare_image, validate_image
+    from resilience import (CircuitBreaker, ConcurrencyLimiter, Dependency,
+                            DependencyUnavailable, retry_after_header)
+    from responses import RenderedBody, ResponseCache, choose_encoding, etag_matches
+
 logger = logging.getLogger()
 logger.setLevel(logging.getLevelName("INFO"))
 
 patch_all()
 
-# pylint: disable=W0613
+# "sequential" waits for the plant check before paying for inference,
+# "concurrent" overlaps both remote calls to cut latency,
+# "gated" runs inference first and skips the plant check for confident predictions
+PIPELINE_MODE: str = os.environ.get("PIPELINE_MODE", "sequential")
+
+# Minimum top class probability for the gated mode to skip Rekognition
+CONFIDENCE_THRESHOLD: float = float(os.environ.get("CONFIDENCE_THRESHOLD", "0.9"))
+
+# Minimum gap between the two most probable classes for the gated mode to skip Rekognition
+CONFIDENCE_MARGIN: float = float(os.environ.get("CONFIDENCE_MARGIN", "0"))
+
+# Accept type for which the inference output_handler returns the top-k classes
+TOP_K_CONTENT_TYPE: str = "application/x-top-k+json"
+
+# Gated mode decisions since the container started
+GATE_STATS: Dict[str, int] = {"Skipped": 0, "Checked": 0}
+
+# Worker threads for the concurrent pipeline mode, shared across warm invocations
+EXECUTOR = ThreadPoolExecutor(max_workers=int(os.environ.get("PIPELINE_MAX_WORKERS", "2")))
+
+# Stage durations and payload sizes of the current request, see metrics.py
+METRICS = Metrics()
+
+# Time left in the current request and the budget of its stages, see deadline.py
+DEADLINE = Deadline()
+
+# Errors of a stage that ran out of time, answered with a 504
+TIMEOUT_ERRORS = (DeadlineExceeded, botocore.exceptions.ReadTimeoutError, botocore.exceptions.ConnectTimeoutError)
+
+# Durations above which a successful call counts as slow for the circuit breakers
+REKOGNITION_SLOW_CALL_MS: float = float(os.environ.get("REKOGNITION_SLOW_CALL_MS", "3000"))
+SAGEMAKER_SLOW_CALL_MS: float = float(os.environ.get("SAGEMAKER_SLOW_CALL_MS", "8000"))
+
+
+def record_rejection(error: DependencyUnavailable) -> None:
+    """ Logs a call rejected by a circuit breaker or a concurrency limit.
+
+    Args:
+        error (DependencyUnavailable): Rejection.
+    """
+
+    logger.warning("Rejected call: %s", Fields(Dependency=error.dependency, Reason=error.reason))
+    METRICS.put_metric(error.dependency + error.reason, 1)
+
+
+# Shared across warm invocations, see resilience.py
+REKOGNITION_DEPENDENCY = Dependency(
+    CircuitBreaker("Rekognition", REKOGNITION_SLOW_CALL_MS), ConcurrencyLimiter("Rekognition"), record_rejection)
+SAGEMAKER_DEPENDENCY = Dependency(
+    CircuitBreaker("SageMaker", SAGEMAKER_SLOW_CALL_MS), ConcurrencyLimiter("SageMaker"), record_rejection)
+
+# Duplicates slow single image inferences when HEDGE_REQUESTS is set, see hedging.py
+HEDGER: Optional[Hedger] = Hedger() if HEDGE_REQUESTS else None
+
+
+def record_hedge(hedged: bool, hedge_won: bool) -> None:
+    """ Records whether an inference was hedged and which call won, for the hedge and win rates.
+
+    Args:
+        hedged (bool): True if a duplicate was sent.
+        hedge_won (bool): True if the duplicate answered first.
+    """
+
+    METRICS.put_metric("Hedged", int(hedged))
+
+    if hedged:
+        METRICS.put_metric("HedgeWon", int(hedge_won))
+
+
+# Highest "SchemaVersion" of the compact item layout written by custom_resources/dynamodb/upload_data.py
+COMPACT_SCHEMA_VERSION: int = 2
+
+# Maximum number of images accepted in a batch request
+BATCH_MAX_IMAGES: int = int(os.environ.get("BATCH_MAX_IMAGES", "25"))
+
+# Attempts made to fetch the unprocessed keys of a BatchGetItem call
+BATCH_GET_MAX_ATTEMPTS: int = 3
+
+NOT_PLANT_MESSAGE: str = "Uploaded image is not a plant/leaf. Please use a different image."
+
+ERROR_MESSAGE: str = "Request could not be processed"
+
+UNAVAILABLE_MESSAGE: str = "Service is overloaded, please retry later"
+
+JOBS_UNAVAILABLE_MESSAGE: str = "Asynchronous jobs are not available"
+
+TIMEOUT_MESSAGE: str = "Request took too long to process, please retry"
+
+INVALID_BODY_MESSAGE: str = "Request body must be a base64 encoded image"
+
+INVALID_BATCH_MESSAGE: str = "A batch must be a JSON list of base64 encoded images"
+
+HEADERS: dict = {
+    "Access-Control-Allow-Headers": "*",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "OPTIONS,POST,GET"
+}
+
+# Extra headers of the pre-rendered responses, the browser reads the ETag only if it is exposed
+RENDERED_HEADERS: dict = {
+    "Content-Type": "application/json",
+    "Access-Control-Expose-Headers": "ETag",
+    "Vary": "Accept-Encoding"
+}
+
+# Cache key of the rendered "not a plant" body, labels never start with "#"
+NOT_PLANT_KEY: str = "#not-plant"
+
 def handler(event, context):
-    logger.info("Handling event: %s", json.dumps(event))
+    # One EMF line per invocation, whatever the outcome
+    METRICS.begin()
+
+    # Jobs are not bound by the API Gateway timeout, only by the Lambda one
+    queue_event = is_queue_event(event)
+    DEADLINE.begin(get_remaining_time_ms(context), None if queue_event else API_GATEWAY_TIMEOUT_MS)
+
+    try:
+        if queue_event:
+            return handle_queue_event(event, context)
+
+        job_route = get_job_route(event)
+
+        if job_route is not None:
+            response = handle_job_request(event, *job_route)
+        else:
+            response = handle_request(event, context)
+
+        METRICS.put_property("StatusCode", response["statusCode"])
+
+        return response
+    finally:
+        logger.info("Deadline budget: %s", Fields(**DEADLINE.summary()))
+        METRICS.emit()
+
+
+def get_remaining_time_ms(context) -> Optional[float]:
+    """ Reads the time left before the platform stops the invocation.
+
+    Args:
+        context (obj): Lambda context, None when called outside of Lambda.
+
+    Returns:
+        float: Milliseconds left, None if unknown.
+    """
+
+    get_remaining_time = getattr(context, "get_remaining_time_in_millis", None)
+
+    return get_remaining_time() if get_remaining_time is not None else None
+
+
+# pylint: disable=W0613
+def handle_request(event, context):
+    # Request bodies carry the whole image, only sampled requests log them
+    logger.info("Handling event: %s", summarize_event(event))
+    SAMPLER.next_request()
+    SAMPLER.capture(logger, "event", event)
 
     # Env vars
     # pylint: disable=C0103
@@ -23,83 +211,665 @@ def handler(event, context):
     # pylint: disable=C0103
     SAGEMAKER_ENDPOINT_NAME: str = os.environ["SAGEMAKER_INFERENCE_ENDPOINT"]
 
-    # Gets the inference image as bytes
-    image_bytes = get_image_bytes(event)
+    if is_batch_request(event):
+        return handle_batch(event, TABLE_NAME, SAGEMAKER_ENDPOINT_NAME)
 
+    # Gets the inference image as bytes, a missing or undecodable body is rejected like the batch items
     try:
-        # Sanity checks the input image
-        detected_labels = detect_labels(image_bytes)
+        image_bytes: Optional[bytes] = get_image_bytes(event)
+    except (KeyError, ValueError, UnicodeError, AttributeError, TypeError):
+        image_bytes = None
+
+    # Rejects unusable uploads from their header, before any remote call
+    rejection = check_image(image_bytes)
+
+    if rejection is not None:
+        return build_response(rejection.status_code, str(rejection))
+
+    # Looks up earlier predictions of the same image
+    image_hash = image_key(image_bytes)
+    logger.info("Decoded image: %s", Fields(ImageSha256=image_hash, ImageBytes=len(image_bytes)))
+    METRICS.put_metric("ImageBytes", len(image_bytes), "Bytes")
+
+    prediction = PREDICTION_CACHE.get(image_hash)
+    METRICS.put_metric("PredictionCacheHit", int(prediction is not None))
+
+    if prediction is None:
+        # Decodes the image once and downsizes the payloads of the remote calls
+        prepared_image = prepare_image(image_bytes)
+        put_payload_metrics(prepared_image)
+
+        try:
+            prediction = predict(prepared_image, SAGEMAKER_ENDPOINT_NAME)
+        except botocore.exceptions.ClientError:
+            return build_response(502, ERROR_MESSAGE)
+        except DependencyUnavailable as error:
+            return build_unavailable_response(error)
+        except TIMEOUT_ERRORS as error:
+            logger.warning("Request ran out of time: %s", error)
+            return build_response(504, TIMEOUT_MESSAGE)
+
+        PREDICTION_CACHE.put(image_hash, prediction)
+
+    logger.info("Prediction cache stats: %s", PREDICTION_CACHE.stats())
+
+    # Checks if the input image is a plant
+    if not prediction["IsPlant"]:
+        rendered = RESPONSE_CACHE.get(NOT_PLANT_KEY, NOT_PLANT_MESSAGE, KNOWLEDGE_BASE.version)
+        return build_rendered_response(event, rendered)
+
+    label = prediction["Label"]
+
+    # Loads the knowledge base on cold start and once its TTL expires
+    with METRICS.stage("KnowledgeBaseRefresh"):
+        refresh_knowledge_base(TABLE_NAME)
+
+    # Gets API response object from the in-memory knowledge base
+    api_response = KNOWLEDGE_BASE.get(label)
+
+    if api_response is None:
+        try:
+            # Falls back to DynamoDB for labels missing from the knowledge base
+            dynamodb_item = get_dynamodb_response_object(label, TABLE_NAME)
+        except botocore.exceptions.ClientError as error:
+            logger.warning("Error during DynamoDB call: %s", error)
+            return build_response(502, ERROR_MESSAGE)
+        except TIMEOUT_ERRORS as error:
+            logger.warning("Request ran out of time: %s", error)
+            return build_response(504, TIMEOUT_MESSAGE)
+
+        # Parses the response from DynamoDB
+        api_response = parse_dynamodb_response(dynamodb_item)
+        KNOWLEDGE_BASE.put(label, api_response)
+
+    # The body of a label only changes with the knowledge base, it is serialized and compressed once
+    return build_rendered_response(event, RESPONSE_CACHE.get(label, api_response, KNOWLEDGE_BASE.version))
+
+
+def get_job_route(event: dict) -> Optional[Tuple[str, Optional[str]]]:
+    """ Matches the asynchronous API, POST /jobs submits and GET /jobs/{id} polls.
+
+    Args:
+        event (dict): Invoking event dictionary.
+
+    Returns:
+        tuple: HTTP method and job id, None for the synchronous API.
+    """
+
+    # REST APIs set "path", HTTP APIs "rawPath"
+    method = get_method(event)
+    path = (event.get("path") or event.get("rawPath") or "").rstrip("/")
+
+    if method == "POST" and path.endswith("/jobs"):
+        return method, None
+
+    if method == "GET" and "/jobs/" in path:
+        return method, path.rsplit("/", 1)[1]
+
+    return None
+
+
+def handle_job_request(event: dict, method: str, job_id: Optional[str]) -> dict:
+    """ Submits a job or returns its status, without waiting for the pipeline.
+
+    Args:
+        event (dict): Invoking event dictionary.
+        method (str): HTTP method.
+        job_id (str, optional): Polled job id.
+
+    Returns:
+        dict: Response object, 202 with the job id on submission.
+    """
+
+    try:
+        jobs = JOBS.build()
+    except RuntimeError as error:
+        logger.error("Asynchronous API is not configured: %s", error)
+        return build_response(503, JOBS_UNAVAILABLE_MESSAGE)
+
+    if method == "POST":
+        if not event.get("body"):
+            return build_response(400, "Request has no image")
+
+        # Rejects bodies the worker could never decode, before queueing them
+        try:
+            body = get_body(event)
+
+            if is_batch_request(event):
+                get_batch_image_bytes(event)
+            else:
+                base64.b64decode(body.encode("utf-8"))
+        except (ValueError, UnicodeError):
+            return build_response(400, INVALID_BODY_MESSAGE)
+
+        if jobs.store.max_request_bytes is not None and len(body) > jobs.store.max_request_bytes:
+            return build_response(413, "Request body must be at most {} bytes".format(jobs.store.max_request_bytes))
+
+        job = new_job(body)
+
+        try:
+            jobs.store.put(job)
+            jobs.queue.send(job["JobId"])
+        except botocore.exceptions.ClientError as error:
+            logger.warning("Could not submit job: %s", error)
+            return build_response(502, ERROR_MESSAGE)
+
+        if jobs.worker is not None:
+            jobs.worker.start()
+
+        logger.info("Submitted job: %s", Fields(JobId=job["JobId"], Queue=jobs.queue.name))
+        METRICS.put_metric("JobsSubmitted", 1)
+
+        response = build_response(202, {"JobId": job["JobId"], "Status": job["Status"]})
+        response["headers"]["Location"] = "jobs/{}".format(job["JobId"])
+
+        return response
+
+    try:
+        job = jobs.store.get(job_id)
     except botocore.exceptions.ClientError as error:
+        logger.warning("Could not read job %s: %s", job_id, error)
+        return build_response(502, ERROR_MESSAGE)
+
+    if job is None:
+        return build_response(404, "Unknown job {}".format(job_id))
+
+    return build_response(200, {key: value for key, value in job.items() if key != "Request"})
+
+
+def process_job(job_id: str, context=None) -> None:
+    """ Runs the synchronous pipeline on a submitted job and stores the result.
+
+    Queues deliver at least once, a job that already completed is skipped. A
+    request that cannot be decoded completes with a 400. Any other error
+    stores a 500 that keeps the request, so a redelivery runs the job again.
+
+    Args:
+        job_id (str): Job id.
+        context (obj): Lambda context of the worker invocation.
+
+    Raises:
+        RuntimeError: If the job queue or store is not configured.
+        Exception: Error of the pipeline, after the failed job is stored.
+    """
+
+    job_store = JOBS.build().store
+    job = job_store.get(job_id)
+
+    if job is None or "Request" not in job:
+        logger.info("Skipping job %s, it expired or already completed", job_id)
+        return
+
+    job_store.put(dict(job, Status=RUNNING))
+
+    # pylint: disable=W0703
+    try:
+        response = handle_request({"body": job["Request"]}, context)
+    except Exception:
+        job_store.put(complete_job(job, build_response(500, ERROR_MESSAGE), keep_request=True))
+        raise
+
+    job_store.put(complete_job(job, response))
+
+    METRICS.put_metric("JobLatencyMs", (time.time() - job["CreatedAt"]) * 1000, "Milliseconds")
+
+
+def handle_queue_event(event: dict, context) -> dict:
+    """ Processes the jobs delivered by SQS.
+
+    Args:
+        event (dict): SQS event.
+        context (obj): Lambda context.
+
+    Returns:
+        dict: Partial batch response, the failed messages are delivered again.
+    """
+
+    failures = []
+
+    for record in event["Records"]:
+        try:
+            job_id = get_job_id(record)
+        except (ValueError, KeyError, TypeError) as error:
+            # Would fail the same way on every delivery
+            logger.warning("Dropping malformed message %s: %s", record.get("messageId"), error)
+            continue
+
+        # pylint: disable=W0703
+        try:
+            process_job(job_id, context)
+        except Exception:
+            logger.exception("Job %s failed", job_id)
+            failures.append({"itemIdentifier": record["messageId"]})
+
+    return {"batchItemFailures": failures}
+
+
+# pylint: disable=C0103
+def predict(image: PreparedImage, ENDPOINT_NAME: str) -> dict:
+    """ Runs the plant check and the inference on the input image.
+
+    Args:
+        image (PreparedImage): Rekognition and SageMaker payloads of the input image.
+        ENDPOINT_NAME (str): Name of the SageMaker Endpoint on which to run the inference.
+
+    Raises:
+        botocore.exceptions.ClientError: If the Rekognition or the SageMaker call fails.
+        DependencyUnavailable: If Rekognition or SageMaker is failing or saturated.
+        DeadlineExceeded: If the request has no time left for a call.
+
+    Returns:
+        dict: Prediction with the "IsPlant" verdict and the detected "Label".
+    """
+
+    if PIPELINE_MODE == "gated":
+        return predict_gated(image, ENDPOINT_NAME)
+
+    inference_future: Optional[Future] = None
+    abandoned = threading.Event()
+
+    if PIPELINE_MODE == "concurrent":
+        # Starts the inference while Rekognition checks the image
+        inference_future = EXECUTOR.submit(abandonable(run_inference, abandoned), image.inference_bytes, ENDPOINT_NAME)
+
+    try:
+        # Sanity checks the input image
+        detected_labels = detect_labels(image.rekognition_bytes)
+    except (botocore.exceptions.ClientError, DependencyUnavailable, *TIMEOUT_ERRORS) as error:
         logger.warning("Error during Rekognition call: %s", error)
-        return {
-            "statusCode": 502,
-            "headers": {
-            "Access-Control-Allow-Headers": "*",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "OPTIONS,POST,GET"
-            },
-        "body": json.dumps("Request could not be processed")
-        }
+        discard(inference_future, abandoned)
+        raise
 
-    # Checks if the input image is a plant
     if is_not_plant(detected_labels):
-        return {
-        "statusCode": 200,
-        "headers": {
-            "Access-Control-Allow-Headers": "*",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "OPTIONS,POST,GET"
-        },
-        "body": json.dumps("Uploaded image is not a plant/leaf. Please use a different image.")
-        }
+        discard(inference_future, abandoned)
+        return {"IsPlant": False, "Label": None}
 
     try:
         # Runs inference on the input image
-        sagemaker_response = run_inference(image_bytes, SAGEMAKER_ENDPOINT_NAME)
+        if inference_future is not None:
+            sagemaker_response = inference_future.result()
+        else:
+            sagemaker_response = run_inference(image.inference_bytes, ENDPOINT_NAME)
     except botocore.exceptions.ClientError as error:
         logger.warning("Error during SageMaker call: %s", error)
-        return {
-            "statusCode": 502,
-            "headers": {
-            "Access-Control-Allow-Headers": "*",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "OPTIONS,POST,GET"
-            },
-        "body": json.dumps("Request could not be processed")
-        }
+        raise
 
     # Parses the response from SageMaker
-    label = parse_inference_response(sagemaker_response)
+    return {"IsPlant": True, "Label": parse_inference_response(sagemaker_response)}
+
+
+# pylint: disable=C0103
+def predict_gated(image: PreparedImage, ENDPOINT_NAME: str) -> dict:
+    """ Runs the inference first and the plant check only for unsure predictions.
+
+    Args:
+        image (PreparedImage): Rekognition and SageMaker payloads of the input image.
+        ENDPOINT_NAME (str): Name of the SageMaker Endpoint on which to run the inference.
+
+    Raises:
+        botocore.exceptions.ClientError: If the Rekognition or the SageMaker call fails.
+        DependencyUnavailable: If Rekognition or SageMaker is failing or saturated.
+        DeadlineExceeded: If the request has no time left for a call.
+
+    Returns:
+        dict: Prediction with the "IsPlant" verdict and the detected "Label".
+    """
+
+    try:
+        sagemaker_response = run_inference(image.inference_bytes, ENDPOINT_NAME, accept=TOP_K_CONTENT_TYPE)
+    except botocore.exceptions.ClientError as error:
+        logger.warning("Error during SageMaker call: %s", error)
+        raise
+
+    scores = parse_inference_scores(sagemaker_response)
+    skip = is_confident(scores)
+
+    GATE_STATS["Skipped" if skip else "Checked"] += 1
+    # Per request, so the skip rate can be graphed and alarmed on across containers
+    METRICS.put_metric("RekognitionSkipped", int(skip))
+    logger.info("Confidence gate: %s", {
+        "Skipped": skip,
+        "TopProbability": scores["top_k"][0]["probability"],
+        "Stats": GATE_STATS
+    })
+
+    if skip:
+        return {"IsPlant": True, "Label": scores["label"]}
 
     try:
-        # Gets API response object from DynamoDB
-        dynamodb_item = get_dynamodb_response_object(label, TABLE_NAME)
+        detected_labels = detect_labels(image.rekognition_bytes)
     except botocore.exceptions.ClientError as error:
-        logger.warning("Error during DynamoDB call: %s", error)
-        return {
-            "statusCode": 502,
-            "headers": {
-            "Access-Control-Allow-Headers": "*",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "OPTIONS,POST,GET"
-            },
-        "body": json.dumps("Request could not be processed")
-        }
-
-    # Parses the response from DynamoDB
-    api_response = parse_dynamodb_response(dynamodb_item)
+        logger.warning("Error during Rekognition call: %s", error)
+        raise
+
+    if is_not_plant(detected_labels):
+        return {"IsPlant": False, "Label": None}
+
+    return {"IsPlant": True, "Label": scores["label"]}
+
+
+def is_confident(scores: dict) -> bool:
+    """ Checks if a prediction is confident enough to skip the plant check.
+
+    Args:
+        scores (dict): Top-k classes returned by the inference output_handler.
+
+    Returns:
+        bool: True if both the top probability and the margin clear their thresholds.
+    """
+
+    probabilities = [top["probability"] for top in scores["top_k"]] + [0.0]
+
+    return probabilities[0] >= CONFIDENCE_THRESHOLD and probabilities[0] - probabilities[1] >= CONFIDENCE_MARGIN
+
+
+# pylint: disable=C0103
+def handle_batch(event: dict, TABLE_NAME: str, ENDPOINT_NAME: str) -> dict:
+    """ Handles a batch request, a JSON list of base64 encoded images.
+
+    Every image gets its own plant check, the plants share a single SageMaker
+    call and the labels missing from the knowledge base a single BatchGetItem.
+
+    Args:
+        event (dict): Invoking event dictionary.
+        TABLE_NAME (str): Name of the DynamoDB table.
+        ENDPOINT_NAME (str): Name of the SageMaker Endpoint on which to run the inference.
+
+    Returns:
+        dict: Response object with one result per image, in request order.
+    """
+
+    try:
+        images_bytes = get_batch_image_bytes(event)
+    except (ValueError, UnicodeError):
+        return build_response(400, INVALID_BATCH_MESSAGE)
+
+    if not images_bytes or len(images_bytes) > BATCH_MAX_IMAGES:
+        return build_response(400, "A batch must contain between 1 and {} images".format(BATCH_MAX_IMAGES))
+
+    rejections = [check_image(image_bytes) for image_bytes in images_bytes]
+    image_hashes = [image_key(image_bytes) if rejection is None else None
+                    for image_bytes, rejection in zip(images_bytes, rejections)]
+    # One lookup per backend for the whole batch rather than one per image
+    cached_predictions = PREDICTION_CACHE.get_many([key for key in image_hashes if key is not None])
+    predictions: List[Optional[dict]] = [cached_predictions.get(image_hash) if image_hash is not None else None
+                                         for image_hash in image_hashes]
+
+    pending = [index for index, prediction in enumerate(predictions)
+               if prediction is None and rejections[index] is None]
+    prepared_images = {index: prepare_image(images_bytes[index]) for index in pending}
+
+    METRICS.put_metric("BatchImages", len(images_bytes))
+    METRICS.put_metric("PredictionCacheHit", len(images_bytes) - len(pending))
+
+    for prepared_image in prepared_images.values():
+        put_payload_metrics(prepared_image)
+
+    # Rekognition has no batch API, the plant checks run on the shared pool
+    plant_checks = EXECUTOR.map(lambda index: check_plant(prepared_images[index].rekognition_bytes), pending)
+
+    plants = []
+
+    for index, is_plant in zip(pending, list(plant_checks)):
+        if is_plant:
+            plants.append(index)
+        elif is_plant is not None:
+            predictions[index] = {"IsPlant": False, "Label": None}
+            PREDICTION_CACHE.put(image_hashes[index], predictions[index])
+
+    if plants:
+        try:
+            sagemaker_response = run_batch_inference(
+                [prepared_images[index].inference_bytes for index in plants], ENDPOINT_NAME)
+        except botocore.exceptions.ClientError as error:
+            logger.warning("Error during SageMaker call: %s", error)
+            return build_response(502, ERROR_MESSAGE)
+        except DependencyUnavailable as error:
+            return build_unavailable_response(error)
+        except TIMEOUT_ERRORS as error:
+            logger.warning("Request ran out of time: %s", error)
+            return build_response(504, TIMEOUT_MESSAGE)
+
+        for index, label in zip(plants, parse_batch_inference_response(sagemaker_response)):
+            predictions[index] = {"IsPlant": True, "Label": label}
+            PREDICTION_CACHE.put(image_hashes[index], predictions[index])
+
+    logger.info("Prediction cache stats: %s", PREDICTION_CACHE.stats())
+
+    with METRICS.stage("KnowledgeBaseRefresh"):
+        refresh_knowledge_base(TABLE_NAME)
+
+    missing_labels = sorted({prediction["Label"] for prediction in predictions
+                             if prediction is not None and prediction["IsPlant"]
+                             and KNOWLEDGE_BASE.get(prediction["Label"]) is None})
+
+    if missing_labels:
+        try:
+            dynamodb_items = get_dynamodb_response_objects(missing_labels, TABLE_NAME)
+        except botocore.exceptions.ClientError as error:
+            logger.warning("Error during DynamoDB call: %s", error)
+            return build_response(502, ERROR_MESSAGE)
+        except TIMEOUT_ERRORS as error:
+            logger.warning("Request ran out of time: %s", error)
+            return build_response(504, TIMEOUT_MESSAGE)
+
+        for label, dynamodb_item in dynamodb_items.items():
+            KNOWLEDGE_BASE.put(label, parse_dynamodb_response(dynamodb_item))
+
+    results = []
+
+    for prediction, rejection in zip(predictions, rejections):
+        if rejection is not None:
+            results.append({"Error": str(rejection)})
+        elif prediction is None:
+            results.append({"Error": ERROR_MESSAGE})
+        elif not prediction["IsPlant"]:
+            results.append({"Error": NOT_PLANT_MESSAGE})
+        else:
+            results.append(KNOWLEDGE_BASE.get(prediction["Label"]) or {"Error": ERROR_MESSAGE})
+
+    return build_response(200, results)
+
+
+def check_plant(image_bytes: bytes, rekognition_client: Optional[boto3.client] = None) -> Optional[bool]:
+    """ Runs the plant check of a single batch image.
+
+    Args:
+        image_bytes (bytes): Input image as bytes.
+        rekognition_client (boto3.client, optional): Rekognition client, defaults to one fitting the deadline.
+
+    Returns:
+        bool: Whether the image is a plant/leaf, None if Rekognition failed.
+    """
+
+    try:
+        return not is_not_plant(detect_labels(image_bytes, rekognition_client))
+    except (botocore.exceptions.ClientError, DependencyUnavailable, *TIMEOUT_ERRORS) as error:
+        logger.warning("Error during Rekognition call: %s", error)
+        return None
+
+
+@METRICS.timed("ValidateImage")
+def check_image(image_bytes: Optional[bytes]) -> Optional[InvalidImage]:
+    """ Validates an upload from its header and records the reason of a rejection.
+
+    Args:
+        image_bytes (bytes, optional): Input image as bytes, None if it could not be decoded.
+
+    Returns:
+        InvalidImage: Rejection, None for a valid image.
+    """
+
+    try:
+        if image_bytes is None:
+            raise InvalidImage("NotBase64", 400, "Image must be base64 encoded")
+
+        header = validate_image(image_bytes)
+    except InvalidImage as error:
+        logger.warning("Rejected image: %s", Fields(Reason=error.reason, ImageBytes=len(image_bytes or b"")))
+        METRICS.put_metric("ImageRejected" + error.reason, 1)
+        return error
+
+    logger.info("Image header: %s", Fields(Format=header.format, Width=header.width, Height=header.height))
+
+    return None
+
+
+def put_payload_metrics(image: PreparedImage) -> None:
+    """ Records the payload sizes and the preprocessing time of an image.
+
+    Args:
+        image (PreparedImage): Rekognition and SageMaker payloads of the input image.
+    """
+
+    for name in ("OriginalBytes", "RekognitionBytes", "InferenceBytes"):
+        METRICS.put_metric(name, image.stats[name], "Bytes")
+
+    METRICS.put_metric("PreprocessMs", image.stats["PreprocessMs"], "Milliseconds")
+
+
+def build_response(status_code: int, body) -> dict:
+    """ Builds the API Gateway proxy response.
+
+    Args:
+        status_code (int): HTTP status code.
+        body (obj): JSON-serializable response body.
+
+    Returns:
+        dict: Response object.
+    """
+
+    return {
+        "statusCode": status_code,
+        "headers": dict(HEADERS),
+        "body": json.dumps(body)
+    }
+
+
+def build_unavailable_response(error: DependencyUnavailable) -> dict:
+    """ Builds the 503 response of a request shed or rejected by an open circuit.
+
+    Args:
+        error (DependencyUnavailable): Rejection.
+
+    Returns:
+        dict: Response object with a Retry-After header.
+    """
+
+    response = build_response(503, UNAVAILABLE_MESSAGE)
+    response["headers"]["Retry-After"] = retry_after_header(error)
+    response["headers"]["Access-Control-Expose-Headers"] = "Retry-After"
+
+    return response
+
+
+def get_header(event: dict, name: str) -> Optional[str]:
+    """ Reads a request header, REST APIs keep the client casing and HTTP APIs lowercase it.
+
+    Args:
+        event (dict): Invoking event dictionary.
+        name (str): Header name.
+
+    Returns:
+        str: Header value, None if missing.
+    """
+
+    name = name.lower()
+
+    for key, value in (event.get("headers") or {}).items():
+        if key.lower() == name:
+            return value
+
+    return None
+
+
+def get_method(event: dict) -> Optional[str]:
+    """ Reads the HTTP method, REST APIs set "httpMethod" and HTTP APIs "requestContext.http.method".
+
+    Args:
+        event (dict): Invoking event dictionary.
+
+    Returns:
+        str: HTTP method, None outside of API Gateway.
+    """
+
+    return event.get("httpMethod") or ((event.get("requestContext") or {}).get("http") or {}).get("method")
+
+
+def build_rendered_response(event: dict, rendered: RenderedBody) -> dict:
+    """ Builds the API Gateway proxy response of a pre-rendered body.
+
+    When the client already has the body, GET and HEAD requests get a 304 and
+    any other method a 412, as required by RFC 7232. Otherwise the variant
+    allowed by the Accept-Encoding header is sent. The REST API lists JSON
+    as a binary media type, see override.ts, so API Gateway decodes the
+    base64 body of the compressed variants.
+
+    Args:
+        event (dict): Invoking event dictionary.
+        rendered (RenderedBody): Pre-rendered body.
+
+    Returns:
+        dict: Response object.
+    """
+
+    coding = choose_encoding(rendered, get_header(event, "Accept-Encoding"))
+    headers = dict(HEADERS, **RENDERED_HEADERS, ETag=rendered.etag_for(coding))
+
+    if etag_matches(get_header(event, "If-None-Match"), rendered):
+        METRICS.put_metric("NotModified", 1)
+        return {"statusCode": 304 if get_method(event) in ("GET", "HEAD") else 412, "headers": headers, "body": ""}
+
+    METRICS.put_metric("NotModified", 0)
+
+    if coding is None:
+        METRICS.put_metric("ResponseBytes", len(rendered.text), "Bytes")
+        return {"statusCode": 200, "headers": headers, "body": rendered.text}
+
+    headers["Content-Encoding"] = coding
+    METRICS.put_metric("ResponseBytes", len(rendered.encodings[coding]), "Bytes")
 
     return {
         "statusCode": 200,
-        "headers": {
-            "Access-Control-Allow-Headers": "*",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "OPTIONS,POST,GET"
-        },
-        "body": json.dumps(api_response)
+        "headers": headers,
+        "body": base64.b64encode(rendered.encodings[coding]).decode("utf-8"),
+        "isBase64Encoded": True
     }
 
 
+def discard(future: Optional[Future], abandoned: threading.Event) -> None:
+    """ Drops an inference that is no longer needed.
+
+    A call that already started cannot be interrupted. It records nothing
+    into the requests served after this one, any error it raises is ignored
+    and the body of its response is closed once it returns.
+
+    Args:
+        future (Future, optional): Pending inference.
+        abandoned (threading.Event): Abandon flag the inference was started with.
+    """
+
+    if future is None:
+        return
+
+    abandoned.set()
+
+    if not future.cancel():
+        future.add_done_callback(close_discarded)
+
+
+def close_discarded(future: Future) -> None:
+    """ Closes the response body of a discarded inference, once it returns.
+
+    Args:
+        future (Future): Discarded inference.
+    """
+
+    if future.exception() is None:
+        close_response_body(future.result())
+
+
+@METRICS.timed("GetImageBytes")
 def get_image_bytes(event: dict) -> bytes:
     """ Function to get the image from the event payload.
 
@@ -110,35 +880,121 @@ def get_image_bytes(event: dict) -> bytes:
         bytes: Image bytes.
     """
 
-    event_body: str = event["body"].encode("utf-8")
+    event_body: str = get_body(event).encode("utf-8")
 
     image_bytes: bytes = base64.b64decode(event_body)
 
     return image_bytes
 
 
-def detect_labels(image_bytes: bytes) -> List[str]:
+def get_body(event: dict) -> str:
+    """ Reads the request body as text.
+
+    JSON is a binary media type for the REST API, so API Gateway hands such
+    bodies over base64 encoded, with "isBase64Encoded" set.
+
+    Args:
+        event (dict): Invoking event dictionary.
+
+    Returns:
+        str: Request body.
+    """
+
+    body: str = event["body"]
+
+    if body and event.get("isBase64Encoded"):
+        return base64.b64decode(body).decode("utf-8")
+
+    return body
+
+
+def is_batch_request(event: dict) -> bool:
+    """ Checks if the event carries a batch of images.
+
+    A single image body is plain base64, which can never start with "[".
+
+    Args:
+        event (dict): Invoking event dictionary.
+
+    Returns:
+        bool: True for a JSON list of images.
+    """
+
+    try:
+        return bool(event.get("body")) and get_body(event).lstrip().startswith("[")
+    except (ValueError, UnicodeError):
+        # Not a JSON list either, the single image path rejects it
+        return False
+
+
+def get_batch_image_bytes(event: dict) -> List[Optional[bytes]]:
+    """ Function to get the images from a batch event payload.
+
+    Args:
+        event (dict): Invoking event dictionary.
+
+    Raises:
+        ValueError: If the body is not a JSON list.
+
+    Returns:
+        list: Bytes of every image in request order, None for the items that are not base64 strings.
+    """
+
+    b64_images = json.loads(get_body(event))
+
+    if not isinstance(b64_images, list):
+        raise ValueError("Batch body is not a list")
+
+    return [decode_batch_image(b64_image) for b64_image in b64_images]
+
+
+def decode_batch_image(b64_image) -> Optional[bytes]:
+    """ Decodes an item of a batch, so a bad item fails alone rather than the whole batch.
+
+    Args:
+        b64_image (obj): Item of the batch, expected to be a base64 string.
+
+    Returns:
+        bytes: Image bytes, None if the item is not a base64 string.
+    """
+
+    if not isinstance(b64_image, str):
+        return None
+
+    try:
+        return base64.b64decode(b64_image.encode("utf-8"))
+    except (binascii.Error, UnicodeError):
+        return None
+
+
+@METRICS.timed("Rekognition")
+def detect_labels(image_bytes: bytes, rekognition_client: Optional[boto3.client] = None) -> List[str]:
     """ Use AWS Rekognition to sanity check the input image.
 
     Args:
         image_bytes (bytes): Input image as bytes.
+        rekognition_client (boto3.client, optional): Rekognition client, defaults to one fitting the deadline.
 
     Returns:
         list: List of detected labels for the input image.
     """
 
-    rekognition_client: boto3.client = boto3.client("rekognition")
+    def call(budget: Budget) -> dict:
+        client = rekognition_client or get_budget_client("rekognition", budget.read_timeout, 1)
 
-    rekognition_response: dict = rekognition_client.detect_labels(
-    Image={
-        "Bytes": image_bytes
-    },
-    MaxLabels = 10)
+        return client.detect_labels(
+        Image={
+            "Bytes": image_bytes
+        },
+        MaxLabels = 10)
+
+    with DEADLINE.stage("Rekognition", "rekognition") as budget, REKOGNITION_DEPENDENCY.guard():
+        rekognition_response: dict = DEADLINE.retry(budget, call)
 
     detected_labels: List[dict] = rekognition_response["Labels"]
 
     detected_labels_list: List[str] = [label["Name"] for label in detected_labels]
-    logger.info("Detected labels by Rekognition: %s", detected_labels)
+    logger.info("Detected labels by Rekognition: %s", detected_labels_list)
 
     return detected_labels_list
 
@@ -170,29 +1026,110 @@ def return_sanity_check_response() -> dict:
 
 
 # pylint: disable=C0103
-def run_inference(image_bytes: bytes, ENDPOINT_NAME: str) -> dict:
+@METRICS.timed("SageMaker")
+def run_inference(image_bytes: bytes, ENDPOINT_NAME: str,
+                  sagemaker_runtime_client: Optional[boto3.client] = None, accept: Optional[str] = None) -> dict:
     """ Function to run inference on the input image.
 
     Args:
         image_bytes (bytes): Input image as bytes.
         ENDPOINT_NAME (str): Name of the SageMaker Endpoint on which to run the inference.
+        sagemaker_runtime_client (boto3.client, optional): SageMaker Runtime client, fitting the deadline if not set.
+        accept (str, optional): Requested response type, the plain label if not set.
+
+    Returns:
+        dict: Response from the SageMaker Endpoint.
+    """
+
+    accept_params: dict = {"Accept": accept} if accept else {}
+
+    def call(budget: Budget) -> dict:
+        client = sagemaker_runtime_client or get_budget_client("sagemaker-runtime", budget.read_timeout, 1)
+
+        return client.invoke_endpoint(
+        EndpointName=ENDPOINT_NAME,
+        Body=image_bytes,
+        ContentType="application/x-image",
+        **accept_params
+        )
+
+    with DEADLINE.stage("SageMaker", "sagemaker-runtime") as budget:
+        def invoke_endpoint() -> dict:
+            # Each call of a hedged pair goes through the circuit breaker on its own
+            with SAGEMAKER_DEPENDENCY.guard():
+                return DEADLINE.retry(budget, call)
+
+        if HEDGER is None:
+            sagemaker_response: dict = invoke_endpoint()
+        else:
+            # Hedged calls run on threads of their own
+            sagemaker_response = HEDGER.call(carry_abandon(invoke_endpoint), close_response_body, record_hedge)
+
+    logger.info("Sagemaker response: %s", summarize_sagemaker_response(sagemaker_response))
+
+    return sagemaker_response
+
+
+# pylint: disable=C0103
+@METRICS.timed("SageMakerBatch")
+def run_batch_inference(images_bytes: List[bytes], ENDPOINT_NAME: str,
+                        sagemaker_runtime_client: Optional[boto3.client] = None) -> dict:
+    """ Function to run inference on several images with a single call.
+
+    Args:
+        images_bytes (list): Input images as bytes.
+        ENDPOINT_NAME (str): Name of the SageMaker Endpoint on which to run the inference.
+        sagemaker_runtime_client (boto3.client, optional): SageMaker Runtime client, fitting the deadline if not set.
 
     Returns:
         dict: Response from the SageMaker Endpoint.
     """
 
-    sagemaker_runtime_client: boto3.client = boto3.client("sagemaker-runtime")
+    body = json.dumps({"images": [base64.b64encode(image_bytes).decode("utf-8") for image_bytes in images_bytes]})
+
+    def call(budget: Budget) -> dict:
+        client = sagemaker_runtime_client or get_budget_client("sagemaker-runtime", budget.read_timeout, 1)
+
+        return client.invoke_endpoint(
+        EndpointName=ENDPOINT_NAME,
+        Body=body,
+        ContentType="application/json",
+        Accept="application/json"
+        )
 
-    sagemaker_response: dict = sagemaker_runtime_client.invoke_endpoint(
-    EndpointName=ENDPOINT_NAME,
-    Body=image_bytes,
-    ContentType="application/x-image"
-    )
-    logger.info("Sagemaker response: %s", sagemaker_response)
+    with DEADLINE.stage("SageMakerBatch", "sagemaker-runtime") as budget, SAGEMAKER_DEPENDENCY.guard():
+        sagemaker_response: dict = DEADLINE.retry(budget, call)
+    logger.info("Sagemaker response: %s", summarize_sagemaker_response(sagemaker_response))
 
     return sagemaker_response
 
 
+def close_response_body(sagemaker_response: dict) -> None:
+    """ Releases the connection of a SageMaker response that is not read.
+
+    Args:
+        sagemaker_response (dict): SageMaker response dictionary.
+    """
+
+    sagemaker_response["Body"].close()
+
+
+def summarize_sagemaker_response(sagemaker_response: dict) -> Fields:
+    """ Describes a SageMaker response without reading its body.
+
+    Args:
+        sagemaker_response (dict): SageMaker response dictionary.
+
+    Returns:
+        Fields: Request id, content type and invoked variant.
+    """
+
+    return Fields(
+        RequestId=sagemaker_response.get("ResponseMetadata", {}).get("RequestId"),
+        ContentType=sagemaker_response.get("ContentType"),
+        InvokedProductionVariant=sagemaker_response.get("InvokedProductionVariant"))
+
+
 def parse_inference_response(sagemaker_response: dict) -> str:
     """ Function to parse the response from SageMaker.
 
@@ -211,47 +1148,173 @@ def parse_inference_response(sagemaker_response: dict) -> str:
     return label_
 
 
+def parse_inference_scores(sagemaker_response: dict) -> dict:
+    """ Function to parse the top-k response from SageMaker.
+
+    Args:
+        sagemaker_response (dict): SageMaker response dictionary.
+
+    Returns:
+        dict: Detected "label" and the "top_k" classes with their "probability".
+    """
+
+    scores: dict = json.loads(sagemaker_response["Body"].read())
+    logger.info("Detected scores from SageMaker: %s", scores)
+
+    return scores
+
+
+# pylint: disable=C0103
+def refresh_knowledge_base(TABLE_NAME: str) -> None:
+    """ Reloads the knowledge base if it is stale, scanning the table with a client fitting the deadline.
+
+    A request without time left keeps the items already loaded, labels
+    missing from them fail on the lookup that follows.
+
+    Args:
+        TABLE_NAME (str): Name of the DynamoDB table.
+    """
+
+    if not KNOWLEDGE_BASE.is_stale():
+        return
+
+    try:
+        with DEADLINE.stage("KnowledgeBase", "dynamodb") as budget:
+            KNOWLEDGE_BASE.refresh(TABLE_NAME, get_budget_client("dynamodb", budget.read_timeout, 1))
+    except DeadlineExceeded as error:
+        logger.warning("Knowledge base not refreshed: %s", error)
+
+
 # pylint: disable=C0103
-def get_dynamodb_response_object(label: str, TABLE_NAME: str) ->dict:
+@METRICS.timed("DynamoDB")
+def get_dynamodb_response_object(label: str, TABLE_NAME: str,
+                                 dynamodb_client: Optional[boto3.client] = None) ->dict:
     """ Function to get the API response object from DynamoDB.
 
     Args:
         label (str): Detected label.
         TABLE_NAME (str): Name of the DynamoDB table.
+        dynamodb_client (boto3.client, optional): DynamoDB client, defaults to one fitting the deadline.
 
     Returns:
         dict: Response from DynamoDB.
     """
 
-    dynamodb_client: boto3.client = boto3.client("dynamodb")
+    def call(budget: Budget) -> dict:
+        client = dynamodb_client or get_budget_client("dynamodb", budget.read_timeout, 1)
+
+        return client.get_item(TableName=TABLE_NAME, Key={"Name": {"S": label}})
 
-    dynamodb_response: dict = dynamodb_client.get_item(TableName=TABLE_NAME, Key={"Name": {"S": label}})
-    logger.info("DynamoDB response: %s", dynamodb_response)
+    with DEADLINE.stage("DynamoDB", "dynamodb") as budget:
+        dynamodb_response: dict = DEADLINE.retry(budget, call)
+
+    logger.info("DynamoDB response: %s", Fields(
+        RequestId=dynamodb_response.get("ResponseMetadata", {}).get("RequestId"),
+        Label=label, Found="Item" in dynamodb_response))
 
     dynamodb_item: dict = dynamodb_response["Item"]
-    logger.info("DynamoDb response item: %s", dynamodb_item)
+    SAMPLER.capture(logger, "dynamodb_item", dynamodb_item)
 
     return dynamodb_item
 
 
+# pylint: disable=C0103
+@METRICS.timed("DynamoDBBatch")
+def get_dynamodb_response_objects(labels: List[str], TABLE_NAME: str,
+                                  dynamodb_client: Optional[boto3.client] = None) -> Dict[str, dict]:
+    """ Function to get the API response objects of several labels with BatchGetItem.
+
+    Args:
+        labels (list): Distinct detected labels, at most 100.
+        TABLE_NAME (str): Name of the DynamoDB table.
+        dynamodb_client (boto3.client, optional): DynamoDB client, defaults to one fitting the deadline.
+
+    Returns:
+        dict: DynamoDB items keyed by label, labels without an item are left out.
+    """
+
+    request_items: dict = {TABLE_NAME: {"Keys": [{"Name": {"S": label}} for label in labels]}}
+    dynamodb_items: Dict[str, dict] = {}
+
+    for attempt in range(BATCH_GET_MAX_ATTEMPTS):
+        if attempt:
+            # Backs off before asking again for the keys DynamoDB did not process
+            time.sleep(0.05 * 2 ** attempt)
+
+        def call(budget: Budget, request_items: dict = request_items) -> dict:
+            client = dynamodb_client or get_budget_client("dynamodb", budget.read_timeout, 1)
+
+            return client.batch_get_item(RequestItems=request_items)
+
+        with DEADLINE.stage("DynamoDBBatch", "dynamodb") as budget:
+            dynamodb_response: dict = DEADLINE.retry(budget, call)
+
+        for dynamodb_item in dynamodb_response["Responses"].get(TABLE_NAME, []):
+            dynamodb_items[dynamodb_item["Name"]["S"]] = dynamodb_item
+
+        request_items = dynamodb_response.get("UnprocessedKeys")
+
+        if not request_items:
+            break
+
+    logger.info("DynamoDB batch items: %s", list(dynamodb_items))
+
+    return dynamodb_items
+
+
+def parse_batch_inference_response(sagemaker_response: dict) -> List[str]:
+    """ Function to parse the response from SageMaker to a batch request.
+
+    Args:
+        sagemaker_response (dict): SageMaker response dictionary.
+
+    Returns:
+        list: Detected labels, in request order.
+    """
+
+    labels: List[str] = json.loads(sagemaker_response["Body"].read())
+    logger.info("Detected labels from SageMaker: %s", labels)
+
+    return labels
+
+
+@METRICS.timed("ParseDynamoDB")
 def parse_dynamodb_response(response: dict) -> dict:
     """ Helper function to deserialize the DynamoDB response to standard json object.
 
+    Reads both the compact layout, a single compressed JSON "Payload", and the
+    legacy layout with one typed attribute per field.
+
     Args:
         response (dict): DynamoDB response dictionary.
 
+    Raises:
+        ValueError: If the item has a compact layout newer than COMPACT_SCHEMA_VERSION.
+
     Returns:
         dict: API response object.
     """
 
     api_response: dict = {}
 
-    api_response["Name"] = list(response["Name"].values())[0]
-    api_response["Description"] = list(response["Description"].values())[0]
-    api_response["isDisease"] = list(response["isDisease"].values())[0]
-    api_response["Treatments"] = beautify(response["Treatments"])
-    api_response["Products"] = beautify(response["Products"])
-    logger.info("Returning API response: %s", api_response)
+    if "Payload" in response:
+        schema_version = int(response["SchemaVersion"]["N"])
+
+        if schema_version > COMPACT_SCHEMA_VERSION:
+            raise ValueError("Unsupported knowledge base schema version {}".format(schema_version))
+
+        api_response = json.loads(zlib.decompress(response["Payload"]["B"]))
+    else:
+        api_response["Name"] = list(response["Name"].values())[0]
+        api_response["Description"] = list(response["Description"].values())[0]
+        api_response["isDisease"] = list(response["isDisease"].values())[0]
+        api_response["Treatments"] = beautify(response["Treatments"])
+        api_response["Products"] = beautify(response["Products"])
+
+    logger.info("Returning API response: %s", Fields(
+        Name=api_response["Name"], Treatments=len(api_response["Treatments"]),
+        Products=len(api_response["Products"])))
+    SAMPLER.capture(logger, "api_response", api_response)
 
     return api_response
 
@@ -278,3 +1341,22 @@ def beautify(data: dict) -> List[dict]:
         response.append(data_dict)
 
     return response
+
+
+# Sampling decision of the current request, see log_utils.py
+SAMPLER = PayloadSampler()
+
+# Shared across warm invocations, see knowledge_base.py
+KNOWLEDGE_BASE = KnowledgeBase(parse_dynamodb_response)
+
+# Rendered bodies of the single image responses
+RESPONSE_CACHE = ResponseCache()
+
+# Shared across warm invocations, see prediction_cache.py. The shared tier gets a single short attempt.
+PREDICTION_CACHE = PredictionCache(
+    [LRUBackend()] +
+    ([DynamoDBBackend(PREDICTION_CACHE_TABLE, get_budget_client("dynamodb", PREDICTION_CACHE_READ_TIMEOUT, 1))]
+     if PREDICTION_CACHE_TABLE else []))
+
+# Asynchronous API, see jobs.py. Built on the first job, a missing setting only fails the job routes.
+JOBS = JobBackend(lambda: get_client("sqs"), lambda: get_client("dynamodb"), process_job, lambda: get_client("s3"))
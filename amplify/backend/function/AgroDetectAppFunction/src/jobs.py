@@ -0,0 +1,553 @@
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+import boto3
+
+logger = logging.getLogger()
+
+# Optional SQS queue delivering the job ids to the worker invocations of the Lambda
+JOB_QUEUE_URL: Optional[str] = os.environ.get("JOB_QUEUE_URL")
+
+# Optional DynamoDB table keyed by "JobId" holding the requests and the results
+JOB_TABLE_NAME: Optional[str] = os.environ.get("JOB_TABLE_NAME")
+
+# Optional S3 bucket holding the requests too large for a job item, expired by a lifecycle rule
+JOB_BUCKET_NAME: Optional[str] = os.environ.get("JOB_BUCKET_NAME")
+
+# Optional SQLite file used for both the queue and the store when there is no SQS queue or table
+JOB_DB_PATH: Optional[str] = os.environ.get("JOB_DB_PATH")
+
+# Seconds a job and its result are kept
+JOB_TTL: float = float(os.environ.get("JOB_TTL", "86400"))
+
+# Set by the Lambda runtime, where every container has its own memory, /tmp and frozen threads
+IN_LAMBDA: bool = bool(os.environ.get("AWS_LAMBDA_FUNCTION_NAME"))
+
+QUEUED: str = "QUEUED"
+RUNNING: str = "RUNNING"
+SUCCEEDED: str = "SUCCEEDED"
+FAILED: str = "FAILED"
+
+
+def new_job(request_body: str, ttl: float = JOB_TTL) -> dict:
+    """ Creates the record of a submitted job.
+
+    Args:
+        request_body (str): Body of the submitting request, the base64 image.
+        ttl (float): Seconds the job is kept.
+
+    Returns:
+        dict: Job record.
+    """
+
+    now = time.time()
+
+    return {
+        "JobId": uuid.uuid4().hex,
+        "Status": QUEUED,
+        "Request": request_body,
+        "CreatedAt": now,
+        "ExpiresAt": int(now + ttl)
+    }
+
+
+def complete_job(job: dict, response: dict, keep_request: bool = False) -> dict:
+    """ Records the proxy response of a processed job and drops its request.
+
+    Args:
+        job (dict): Job record.
+        response (dict): API Gateway proxy response returned by the pipeline.
+        keep_request (bool): Keeps the request, so a redelivery of the job runs it again.
+
+    Returns:
+        dict: Updated job record.
+    """
+
+    job = {key: value for key, value in job.items() if key != "Request" or keep_request}
+    job.update({
+        "Status": SUCCEEDED if response["statusCode"] < 400 else FAILED,
+        "StatusCode": response["statusCode"],
+        "Result": json.loads(response["body"]),
+        "CompletedAt": time.time()
+    })
+
+    return job
+
+
+class MemoryJobStore:
+    """ In-process job store, for tests and local runs only. """
+
+    name = "memory"
+    max_request_bytes: Optional[int] = None
+
+    def __init__(self):
+        self._jobs: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def put(self, job: dict) -> None:
+        """ Creates or replaces a job.
+
+        Args:
+            job (dict): Job record.
+        """
+
+        with self._lock:
+            self._jobs[job["JobId"]] = dict(job)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """ Looks up a job, dropping it if it expired.
+
+        Args:
+            job_id (str): Job id.
+
+        Returns:
+            dict: Job record, None if unknown.
+        """
+
+        with self._lock:
+            job = self._jobs.get(job_id)
+
+            if job is not None and job["ExpiresAt"] < time.time():
+                del self._jobs[job_id]
+                return None
+
+            return dict(job) if job is not None else None
+
+    def clear(self) -> None:
+        """ Drops every job. """
+
+        with self._lock:
+            self._jobs.clear()
+
+
+class SQLiteJobStore:
+    """ Job store in a SQLite file, shared by the local processes using the same path. """
+
+    name = "sqlite"
+    max_request_bytes: Optional[int] = None
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): SQLite database path, ":memory:" for a private database.
+        """
+
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, expires_at REAL, record TEXT)")
+
+    def put(self, job: dict) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?)", (job["JobId"], job["ExpiresAt"], json.dumps(job)))
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT record FROM jobs WHERE job_id = ? AND expires_at >= ?", (job_id, time.time())).fetchone()
+
+        return json.loads(row[0]) if row is not None else None
+
+    def clear(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM jobs")
+
+
+class DynamoDBJobStore:
+    """ Job store in a DynamoDB table with TTL on "ExpiresAt".
+
+    The request is kept until the job completes. Requests fitting in the
+    400 KB item are kept as a string attribute, larger ones go to the S3
+    bucket and the item only holds their key. Without a bucket, images are
+    bounded by the item size.
+    """
+
+    name = "dynamodb"
+
+    # Item size limit, less the room taken by the other attributes
+    max_item_request_bytes: int = 400 * 1024 - 8 * 1024
+
+    def __init__(self, table_name: str, dynamodb_client: boto3.client, bucket_name: Optional[str] = None,
+                 s3_client: Optional[boto3.client] = None):
+        """
+        Args:
+            table_name (str): Name of the job table.
+            dynamodb_client (boto3.client): DynamoDB client.
+            bucket_name (str, optional): Bucket of the large requests.
+            s3_client (boto3.client, optional): S3 client, required with a bucket.
+        """
+
+        self.table_name = table_name
+        self.dynamodb_client = dynamodb_client
+        self.bucket_name = bucket_name
+        self.s3_client = s3_client
+
+        # Beyond the item, the 6 MB Lambda payload limit bounds the requests
+        self.max_request_bytes: Optional[int] = None if bucket_name else self.max_item_request_bytes
+
+    def put(self, job: dict) -> None:
+        item = {
+            "JobId": {"S": job["JobId"]},
+            "ExpiresAt": {"N": str(job["ExpiresAt"])},
+            "Record": {"S": json.dumps({key: value for key, value in job.items() if key != "Request"})}
+        }
+
+        if "Request" in job:
+            if self.bucket_name and len(job["Request"]) > self.max_item_request_bytes:
+                request_key = "jobs/{}".format(job["JobId"])
+                self.s3_client.put_object(
+                    Bucket=self.bucket_name, Key=request_key, Body=job["Request"].encode("utf-8"))
+                item["RequestKey"] = {"S": request_key}
+            else:
+                item["Request"] = {"S": job["Request"]}
+
+        self.dynamodb_client.put_item(TableName=self.table_name, Item=item)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        item = self.dynamodb_client.get_item(
+            TableName=self.table_name, Key={"JobId": {"S": job_id}}, ConsistentRead=True).get("Item")
+
+        # Expired items are deleted by DynamoDB within a few days
+        if item is None or float(item["ExpiresAt"]["N"]) < time.time():
+            return None
+
+        job = json.loads(item["Record"]["S"])
+
+        if "Request" in item:
+            job["Request"] = item["Request"]["S"]
+        elif "RequestKey" in item:
+            job["Request"] = self.s3_client.get_object(
+                Bucket=self.bucket_name, Key=item["RequestKey"]["S"])["Body"].read().decode("utf-8")
+
+        return job
+
+
+class MemoryQueue:
+    """ In-process queue of job ids, consumed by a LocalWorker. """
+
+    name = "memory"
+    local = True
+
+    def __init__(self):
+        self._queue: "queue.Queue[str]" = queue.Queue()
+
+    def send(self, job_id: str) -> None:
+        """ Enqueues a job.
+
+        Args:
+            job_id (str): Job id.
+        """
+
+        self._queue.put(job_id)
+
+    def receive(self, wait: float) -> Optional[str]:
+        """ Dequeues a job, waiting for one to arrive.
+
+        Args:
+            wait (float): Seconds to wait on an empty queue.
+
+        Returns:
+            str: Job id, None if the queue stayed empty.
+        """
+
+        try:
+            return self._queue.get(timeout=wait)
+        except queue.Empty:
+            return None
+
+
+class SQLiteQueue:
+    """ Queue of job ids in a SQLite file, consumed by a LocalWorker of any local process. """
+
+    name = "sqlite"
+    local = True
+
+    def __init__(self, path: str, poll_interval: float = 0.05):
+        """
+        Args:
+            path (str): SQLite database path.
+            poll_interval (float): Seconds between two reads of an empty queue.
+        """
+
+        self.poll_interval = poll_interval
+
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+
+        with self._lock:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS job_queue (id INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT)")
+
+    def send(self, job_id: str) -> None:
+        with self._lock:
+            self._connection.execute("INSERT INTO job_queue (job_id) VALUES (?)", (job_id,))
+
+    def receive(self, wait: float) -> Optional[str]:
+        deadline = time.monotonic() + wait
+
+        while True:
+            with self._lock:
+                # The write lock makes the read and delete atomic across processes
+                self._connection.execute("BEGIN IMMEDIATE")
+
+                try:
+                    row = self._connection.execute("SELECT id, job_id FROM job_queue ORDER BY id LIMIT 1").fetchone()
+
+                    if row is not None:
+                        self._connection.execute("DELETE FROM job_queue WHERE id = ?", (row[0],))
+                finally:
+                    self._connection.execute("COMMIT")
+
+            if row is not None:
+                return row[1]
+
+            if time.monotonic() >= deadline:
+                return None
+
+            time.sleep(self.poll_interval)
+
+
+class SQSQueue:
+    """ SQS queue of job ids, delivered to the Lambda by an event source mapping. """
+
+    name = "sqs"
+    local = False
+
+    def __init__(self, queue_url: str, sqs_client: boto3.client):
+        """
+        Args:
+            queue_url (str): URL of the queue.
+            sqs_client (boto3.client): SQS client.
+        """
+
+        self.queue_url = queue_url
+        self.sqs_client = sqs_client
+
+    def send(self, job_id: str) -> None:
+        self.sqs_client.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps({"JobId": job_id}))
+
+
+def get_job_id(record: dict) -> str:
+    """ Reads the job id of an SQS message.
+
+    Args:
+        record (dict): SQS record delivered by the event source mapping.
+
+    Raises:
+        ValueError: If the message body is not JSON.
+        KeyError: If the message has no job id.
+
+    Returns:
+        str: Job id.
+    """
+
+    return json.loads(record["body"])["JobId"]
+
+
+def get_job_ids(event: dict) -> List[str]:
+    """ Reads the job ids of an SQS event.
+
+    Args:
+        event (dict): SQS event delivered by the event source mapping.
+
+    Returns:
+        list: Job ids, in delivery order.
+    """
+
+    return [get_job_id(record) for record in event["Records"]]
+
+
+def is_queue_event(event: dict) -> bool:
+    """ Checks if the Lambda was invoked by the job queue rather than API Gateway.
+
+    Args:
+        event (dict): Invoking event dictionary.
+
+    Returns:
+        bool: True for an SQS event.
+    """
+
+    records = event.get("Records")
+
+    return bool(records) and records[0].get("eventSource") == "aws:sqs"
+
+
+class LocalWorker:
+    """ Daemon threads processing the jobs of a local queue.
+
+    Lambda freezes background threads between invocations, so deployed
+    functions use an SQSQueue and process jobs in their own invocations.
+    """
+
+    def __init__(self, job_queue, process: Callable[[str], None], threads: int = 1, wait: float = 1.0):
+        """
+        Args:
+            job_queue (obj): Local queue exposing receive(wait).
+            process (callable): Runs a job given its id.
+            threads (int): Number of worker threads.
+            wait (float): Seconds a thread waits on an empty queue before checking for stop.
+        """
+
+        self.job_queue = job_queue
+        self.process = process
+        self.threads = threads
+        self.wait = wait
+
+        self._stop = threading.Event()
+        self._workers: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """ Starts the threads, once. """
+
+        with self._lock:
+            if self._workers:
+                return
+
+            self._stop.clear()
+            self._workers = [threading.Thread(target=self._run, name="job-worker-{}".format(index), daemon=True)
+                             for index in range(self.threads)]
+
+            for worker in self._workers:
+                worker.start()
+
+    def stop(self) -> None:
+        """ Stops the threads after their current job. """
+
+        with self._lock:
+            self._stop.set()
+
+            for worker in self._workers:
+                worker.join()
+
+            self._workers = []
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            job_id = self.job_queue.receive(self.wait)
+
+            if job_id is None:
+                continue
+
+            # pylint: disable=W0703
+            try:
+                self.process(job_id)
+            except Exception:
+                logger.exception("Job %s failed", job_id)
+
+
+class JobBackend:
+    """ Queue, store and local worker of the asynchronous API, built on first use.
+
+    A missing job setting then only fails the job routes, the synchronous API
+    served by the same function keeps working.
+    """
+
+    def __init__(self, sqs_client_factory: Callable[[], boto3.client],
+                 dynamodb_client_factory: Callable[[], boto3.client], process: Callable[[str], None],
+                 s3_client_factory: Optional[Callable[[], boto3.client]] = None):
+        """
+        Args:
+            sqs_client_factory (callable): Returns the SQS client, only called for an SQS queue.
+            dynamodb_client_factory (callable): Returns the DynamoDB client, only called for a table.
+            process (callable): Runs a job given its id, in the worker of a local queue.
+            s3_client_factory (callable, optional): Returns the S3 client, only called for a bucket.
+        """
+
+        self.sqs_client_factory = sqs_client_factory
+        self.dynamodb_client_factory = dynamodb_client_factory
+        self.s3_client_factory = s3_client_factory
+        self.process = process
+
+        self.queue = None
+        self.store = None
+        self.worker: Optional[LocalWorker] = None
+        self._lock = threading.Lock()
+
+    def build(self) -> "JobBackend":
+        """ Builds the queue, the store and the worker of a local queue, once.
+
+        Raises:
+            RuntimeError: If running in Lambda without an SQS queue or a DynamoDB table.
+
+        Returns:
+            JobBackend: This backend, ready to use.
+        """
+
+        with self._lock:
+            if self.store is None:
+                job_queue = build_job_queue(self.sqs_client_factory)
+                job_store = build_job_store(self.dynamodb_client_factory, self.s3_client_factory)
+
+                # Only local queues are consumed in process, SQS delivers the jobs to separate invocations
+                self.worker = LocalWorker(job_queue, self.process) if job_queue.local else None
+                self.queue, self.store = job_queue, job_store
+
+        return self
+
+
+def build_job_queue(sqs_client_factory: Callable[[], boto3.client]):
+    """ Picks the queue from the environment, SQS, then SQLite, then in-process.
+
+    Args:
+        sqs_client_factory (callable): Returns the SQS client, only called for an SQS queue.
+
+    Raises:
+        RuntimeError: If running in Lambda without an SQS queue.
+
+    Returns:
+        obj: Queue exposing send, and receive for local queues.
+    """
+
+    if JOB_QUEUE_URL:
+        return SQSQueue(JOB_QUEUE_URL, sqs_client_factory())
+
+    # A local queue would only be seen by the container that received the job
+    if IN_LAMBDA:
+        raise RuntimeError("JOB_QUEUE_URL must be set in Lambda")
+
+    if JOB_DB_PATH:
+        return SQLiteQueue(JOB_DB_PATH)
+
+    return MemoryQueue()
+
+
+def build_job_store(dynamodb_client_factory: Callable[[], boto3.client],
+                    s3_client_factory: Optional[Callable[[], boto3.client]] = None):
+    """ Picks the store from the environment, DynamoDB, then SQLite, then in-process.
+
+    Args:
+        dynamodb_client_factory (callable): Returns the DynamoDB client, only called for a table.
+        s3_client_factory (callable, optional): Returns the S3 client, only called for a bucket.
+
+    Raises:
+        RuntimeError: If running in Lambda without a DynamoDB table.
+
+    Returns:
+        obj: Store exposing put and get.
+    """
+
+    if JOB_TABLE_NAME:
+        if JOB_BUCKET_NAME and s3_client_factory is not None:
+            return DynamoDBJobStore(JOB_TABLE_NAME, dynamodb_client_factory(), JOB_BUCKET_NAME, s3_client_factory())
+
+        return DynamoDBJobStore(JOB_TABLE_NAME, dynamodb_client_factory())
+
+    # A local store would answer 404 to the polls landing on other containers
+    if IN_LAMBDA:
+        raise RuntimeError("JOB_TABLE_NAME must be set in Lambda")
+
+    if JOB_DB_PATH:
+        return SQLiteJobStore(JOB_DB_PATH)
+
+    return MemoryJobStore()
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import boto3
+import botocore
+
+logger = logging.getLogger()
+
+# Seconds after which the in-memory items are reloaded from the table
+KNOWLEDGE_BASE_TTL: float = float(os.environ.get("KNOWLEDGE_BASE_TTL", "3600"))
+
+# Snapshot built from the data/ directory by custom_resources/dynamodb/upload_data.py
+KNOWLEDGE_BASE_SNAPSHOT: str = os.environ.get(
+    "KNOWLEDGE_BASE_SNAPSHOT",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge_base.json"))
+
+
+class KnowledgeBase:
+    """ In-memory index of the API response objects, keyed by label.
+
+    The whole table is small, so it is loaded at once on first use, either from
+    the bundled snapshot or with a single Scan, and kept deserialized between
+    warm invocations. The snapshot only spares the cold start a Scan, once the
+    TTL expires the index is reloaded from the table, which may have changed
+    since the deployment. Labels missing from the index are resolved by the
+    caller and added with put.
+    """
+
+    def __init__(self, deserialize: Callable[[dict], dict], ttl: float = KNOWLEDGE_BASE_TTL,
+                 snapshot_path: Optional[str] = KNOWLEDGE_BASE_SNAPSHOT):
+        """
+        Args:
+            deserialize (callable): Turns a DynamoDB item into an API response object.
+            ttl (float): Seconds after which the index is reloaded.
+            snapshot_path (str, optional): Path of the bundled snapshot, scanned from DynamoDB if missing.
+        """
+
+        self.deserialize = deserialize
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self.version: Optional[str] = None
+
+        self._items: Dict[str, dict] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def is_stale(self) -> bool:
+        """ Checks if the index was never loaded or outlived its TTL.
+
+        Returns:
+            bool: True if the index has to be reloaded.
+        """
+
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+    def load(self, table_name: str, dynamodb_client: boto3.client) -> None:
+        """ Replaces the index with the items from the snapshot on first load, from the table afterwards.
+
+        Args:
+            table_name (str): Name of the DynamoDB table.
+            dynamodb_client (boto3.client): DynamoDB client used when the snapshot is not.
+        """
+
+        if self.version is None and self.snapshot_path and os.path.isfile(self.snapshot_path):
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+
+            items = snapshot["Items"]
+            version = snapshot["Version"]
+        else:
+            items = {}
+
+            for page in dynamodb_client.get_paginator("scan").paginate(TableName=table_name):
+                for dynamodb_item in page["Items"]:
+                    api_response = self.deserialize(dynamodb_item)
+                    items[api_response["Name"]] = api_response
+
+            version = compute_version(items)
+
+        with self._lock:
+            if version != self.version:
+                logger.info("Loaded knowledge base version %s with %d items", version, len(items))
+
+            self._items = items
+            self.version = version
+            self._loaded_at = time.monotonic()
+
+    def refresh(self, table_name: str, dynamodb_client: boto3.client) -> None:
+        """ Reloads the index if it is stale, keeping the old items on failure.
+
+        Args:
+            table_name (str): Name of the DynamoDB table.
+            dynamodb_client (boto3.client): DynamoDB client used when the snapshot is not.
+        """
+
+        if not self.is_stale():
+            return
+
+        try:
+            self.load(table_name, dynamodb_client)
+        except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError,
+                OSError, KeyError, ValueError) as error:
+            logger.warning("Could not load the knowledge base: %s", error)
+
+            # Retries only after another TTL instead of on every request
+            with self._lock:
+                self._loaded_at = time.monotonic()
+
+    def get(self, label: str) -> Optional[dict]:
+        """ Looks up the API response object of a label.
+
+        Args:
+            label (str): Detected label.
+
+        Returns:
+            dict: API response object, None on a miss.
+        """
+
+        return self._items.get(label)
+
+    def put(self, label: str, api_response: dict) -> None:
+        """ Adds an API response object resolved outside of the index.
+
+        Args:
+            label (str): Detected label.
+            api_response (dict): API response object.
+        """
+
+        with self._lock:
+            self._items[label] = api_response
+
+    def clear(self) -> None:
+        """ Empties the index, the next refresh reloads it. """
+
+        with self._lock:
+            self._items = {}
+            self.version = None
+            self._loaded_at = None
+
+
+def compute_version(items: Dict[str, dict]) -> str:
+    """ Computes a stable version stamp for a set of API response objects.
+
+    Args:
+        items (dict): API response objects keyed by label.
+
+    Returns:
+        str: Hex digest of the items.
+    """
+
+    return hashlib.sha256(json.dumps(items, sort_keys=True).encode("utf-8")).hexdigest()
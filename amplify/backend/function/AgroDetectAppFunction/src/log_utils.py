@@ -0,0 +1,75 @@
+import json
+import logging
+import os
+import random
+from typing import Callable
+
+# Full payloads are logged for one in this many requests, 0 never logs them
+DEBUG_SAMPLE_RATE: int = int(os.environ.get("DEBUG_SAMPLE_RATE", "0"))
+
+
+class Fields:
+    """ Log message arguments serialized to JSON only when the record is emitted. """
+
+    def __init__(self, **fields):
+        self.fields = fields
+
+    def __str__(self) -> str:
+        return json.dumps(self.fields, default=str)
+
+
+class PayloadSampler:
+    """ Decides once per request whether its full payloads are logged. """
+
+    def __init__(self, rate: int = DEBUG_SAMPLE_RATE, draw: Callable[[], float] = random.random):
+        """
+        Args:
+            rate (int): One in this many requests is sampled, 0 disables sampling.
+            draw (callable): Source of uniform numbers in [0, 1).
+        """
+
+        self.rate = rate
+        self.draw = draw
+        self.sampled = False
+
+    def next_request(self) -> bool:
+        """ Draws the sampling decision of a new request.
+
+        Returns:
+            bool: True if the payloads of this request are logged.
+        """
+
+        self.sampled = self.rate > 0 and self.draw() < 1 / self.rate
+
+        return self.sampled
+
+    def capture(self, logger: logging.Logger, name: str, payload) -> None:
+        """ Logs a full payload, only for sampled requests.
+
+        Args:
+            logger (logging.Logger): Logger to write to.
+            name (str): Name of the payload.
+            payload (obj): JSON-serializable payload.
+        """
+
+        if self.sampled:
+            logger.info("Sampled payload %s: %s", name, Fields(payload=payload))
+
+
+def summarize_event(event: dict) -> Fields:
+    """ Describes an API Gateway event without its body.
+
+    Args:
+        event (dict): Invoking event dictionary.
+
+    Returns:
+        Fields: Request id, path and body size.
+    """
+
+    request_context = event.get("requestContext") or {}
+
+    return Fields(
+        RequestId=request_context.get("requestId"),
+        Method=event.get("httpMethod"),
+        Path=event.get("path"),
+        BodyBytes=len(event.get("body") or ""))
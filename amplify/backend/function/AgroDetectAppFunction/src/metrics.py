@@ -0,0 +1,194 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+# CloudWatch namespace of the embedded metrics
+METRICS_NAMESPACE: str = os.environ.get("METRICS_NAMESPACE", "AgroDetect")
+
+FUNCTION_NAME: str = os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "local")
+
+# Abandon flag of the call running on the current thread, see abandonable
+_CALL = threading.local()
+
+
+def abandonable(function: Callable, abandoned: threading.Event) -> Callable:
+    """ Wraps a call run on a worker thread, which records nothing once its request abandons it.
+
+    A running call cannot be interrupted. Without the flag, it would record
+    its metrics, deadline stage and circuit breaker result into whichever
+    request the container serves when it returns.
+
+    Args:
+        function (callable): Call to run on the worker thread.
+        abandoned (threading.Event): Set by the request once it no longer waits for the call.
+
+    Returns:
+        callable: Wrapped call.
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        _CALL.abandoned = abandoned
+
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _CALL.abandoned = None
+
+    return wrapper
+
+
+def carry_abandon(function: Callable) -> Callable:
+    """ Wraps a call handed to another thread, so it keeps the abandon flag of the current one.
+
+    Args:
+        function (callable): Call to run on another thread.
+
+    Returns:
+        callable: Wrapped call, the call itself outside of an abandonable one.
+    """
+
+    abandoned = getattr(_CALL, "abandoned", None)
+
+    return function if abandoned is None else abandonable(function, abandoned)
+
+
+def is_abandoned() -> bool:
+    """ Checks if the call running on the current thread was abandoned by its request.
+
+    Returns:
+        bool: True if nothing must be recorded.
+    """
+
+    abandoned = getattr(_CALL, "abandoned", None)
+
+    return abandoned is not None and abandoned.is_set()
+
+
+class Metrics:
+    """ Per invocation metrics, written as one CloudWatch Embedded Metric Format line.
+
+    Values are collected between begin and emit. A metric recorded several
+    times, for example a stage of a batch request, keeps every value.
+    """
+
+    def __init__(self, namespace: str = METRICS_NAMESPACE, function_name: str = FUNCTION_NAME,
+                 write: Callable[[str], None] = print):
+        """
+        Args:
+            namespace (str): CloudWatch namespace.
+            function_name (str): Value of the FunctionName dimension.
+            write (callable): Writes a line to the function log, stdout in Lambda.
+        """
+
+        self.namespace = namespace
+        self.function_name = function_name
+        self.write = write
+        self.cold_start = True
+
+        self._values: Dict[str, Tuple[str, List[float]]] = {}
+        self._properties: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def begin(self) -> None:
+        """ Drops the values of the previous invocation. """
+
+        with self._lock:
+            self._values = {}
+            self._properties = {}
+
+    def put_metric(self, name: str, value: float, unit: str = "Count") -> None:
+        """ Records a metric value.
+
+        Args:
+            name (str): Metric name.
+            value (float): Metric value.
+            unit (str): CloudWatch unit.
+        """
+
+        if is_abandoned():
+            return
+
+        with self._lock:
+            self._values.setdefault(name, (unit, []))[1].append(value)
+
+    def put_property(self, name: str, value) -> None:
+        """ Records a searchable value that is not a metric.
+
+        Args:
+            name (str): Property name.
+            value (obj): JSON-serializable value.
+        """
+
+        if is_abandoned():
+            return
+
+        with self._lock:
+            self._properties[name] = value
+
+    @contextmanager
+    def stage(self, name: str):
+        """ Times a block, recorded as the "<name>Ms" metric even if the block raises.
+
+        Args:
+            name (str): Stage name.
+        """
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.put_metric(name + "Ms", round((time.perf_counter() - start) * 1000, 3), "Milliseconds")
+
+    def timed(self, name: str) -> Callable:
+        """ Decorator timing every call of a function as a stage.
+
+        Args:
+            name (str): Stage name.
+        """
+
+        def decorator(function: Callable) -> Callable:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def emit(self) -> dict:
+        """ Writes the collected values as a single EMF log line.
+
+        Returns:
+            dict: Emitted EMF document.
+        """
+
+        with self._lock:
+            values, properties = self._values, self._properties
+            self._values, self._properties = {}, {}
+
+        document: dict = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [["FunctionName", "ColdStart"]],
+                    "Metrics": [{"Name": name, "Unit": unit} for name, (unit, _) in values.items()]
+                }]
+            },
+            "FunctionName": self.function_name,
+            "ColdStart": str(self.cold_start).lower()
+        }
+        document.update(properties)
+        document.update({name: points[0] if len(points) == 1 else points for name, (_, points) in values.items()})
+
+        self.cold_start = False
+        self.write(json.dumps(document))
+
+        return document
@@ -0,0 +1,347 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import boto3
+import botocore
+
+logger = logging.getLogger()
+
+# Maximum number of predictions kept in memory per container
+PREDICTION_CACHE_SIZE: int = int(os.environ.get("PREDICTION_CACHE_SIZE", "1024"))
+
+# Seconds a cached prediction stays valid
+PREDICTION_CACHE_TTL: float = float(os.environ.get("PREDICTION_CACHE_TTL", "86400"))
+
+# Optional DynamoDB table shared by all containers, keyed by "ImageHash"
+PREDICTION_CACHE_TABLE: Optional[str] = os.environ.get("PREDICTION_CACHE_TABLE")
+
+# Read timeout of the shared cache client, a slow lookup costs more than the miss it avoids
+PREDICTION_CACHE_READ_TIMEOUT: float = float(os.environ.get("PREDICTION_CACHE_READ_TIMEOUT", "0.5"))
+
+# Maximum number of keys of a BatchGetItem call
+BATCH_GET_MAX_KEYS: int = 100
+
+
+def image_key(image_bytes: bytes) -> str:
+    """ Computes the content address of an image.
+
+    Args:
+        image_bytes (bytes): Decoded image bytes.
+
+    Returns:
+        str: SHA-256 hex digest of the image.
+    """
+
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class LRUBackend:
+    """ Bounded in-process cache evicting the least recently used and expired entries. """
+
+    name = "memory"
+
+    def __init__(self, max_size: int = PREDICTION_CACHE_SIZE, ttl: float = PREDICTION_CACHE_TTL):
+        """
+        Args:
+            max_size (int): Maximum number of entries.
+            ttl (float): Seconds an entry stays valid.
+        """
+
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        """ Looks up an entry, dropping it if it expired.
+
+        Args:
+            key (str): Image hash.
+
+        Returns:
+            dict: Cached prediction, None on a miss.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return None
+
+            expires_at, prediction = entry
+
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+
+            return prediction
+
+    def get_many(self, keys: List[str]) -> Dict[str, dict]:
+        """ Looks up several entries.
+
+        Args:
+            keys (list): Distinct image hashes.
+
+        Returns:
+            dict: Cached predictions of the hits, keyed by image hash.
+        """
+
+        predictions = {key: self.get(key) for key in keys}
+
+        return {key: prediction for key, prediction in predictions.items() if prediction is not None}
+
+    def put(self, key: str, prediction: dict) -> None:
+        """ Stores an entry, evicting the oldest ones above the size bound.
+
+        Args:
+            key (str): Image hash.
+            prediction (dict): Prediction to be cached.
+        """
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, prediction)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        """ Drops every entry. """
+
+        with self._lock:
+            self._entries.clear()
+
+
+class DynamoDBBackend:
+    """ Cache shared across containers, stored in a DynamoDB table with TTL on "ExpiresAt".
+
+    The cache is best effort, any error or timeout of the table is a miss.
+    """
+
+    name = "dynamodb"
+
+    def __init__(self, table_name: str, dynamodb_client: boto3.client, ttl: float = PREDICTION_CACHE_TTL):
+        """
+        Args:
+            table_name (str): Name of the cache table.
+            dynamodb_client (boto3.client): DynamoDB client.
+            ttl (float): Seconds an entry stays valid.
+        """
+
+        self.table_name = table_name
+        self.dynamodb_client = dynamodb_client
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[dict]:
+        """ Looks up an entry, ignoring expired items not yet deleted by DynamoDB.
+
+        Args:
+            key (str): Image hash.
+
+        Returns:
+            dict: Cached prediction, None on a miss or error.
+        """
+
+        try:
+            response = self.dynamodb_client.get_item(TableName=self.table_name, Key={"ImageHash": {"S": key}})
+        except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as error:
+            logger.warning("Error reading the prediction cache: %s", error)
+            return None
+
+        item = response.get("Item")
+
+        return None if item is None else parse_item(item)
+
+    def get_many(self, keys: List[str]) -> Dict[str, dict]:
+        """ Looks up several entries with one BatchGetItem per 100 keys.
+
+        Keys left unprocessed by a throttled table are misses, the cache is not
+        worth a second round trip.
+
+        Args:
+            keys (list): Distinct image hashes.
+
+        Returns:
+            dict: Cached predictions of the hits, keyed by image hash.
+        """
+
+        predictions: Dict[str, Optional[dict]] = {}
+
+        for start in range(0, len(keys), BATCH_GET_MAX_KEYS):
+            try:
+                response = self.dynamodb_client.batch_get_item(RequestItems={self.table_name: {
+                    "Keys": [{"ImageHash": {"S": key}} for key in keys[start:start + BATCH_GET_MAX_KEYS]]
+                }})
+            except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as error:
+                logger.warning("Error reading the prediction cache: %s", error)
+                break
+
+            predictions.update((item["ImageHash"]["S"], parse_item(item))
+                               for item in response.get("Responses", {}).get(self.table_name, []))
+
+        return {key: prediction for key, prediction in predictions.items() if prediction is not None}
+
+    def put(self, key: str, prediction: dict) -> None:
+        """ Stores an entry, errors are logged and ignored.
+
+        Args:
+            key (str): Image hash.
+            prediction (dict): Prediction to be cached.
+        """
+
+        item = {
+            "ImageHash": {"S": key},
+            "IsPlant": {"BOOL": prediction["IsPlant"]},
+            "ExpiresAt": {"N": str(int(time.time() + self.ttl))}
+        }
+
+        if prediction["Label"] is not None:
+            item["Label"] = {"S": prediction["Label"]}
+
+        try:
+            self.dynamodb_client.put_item(TableName=self.table_name, Item=item)
+        except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as error:
+            logger.warning("Error writing the prediction cache: %s", error)
+
+
+def parse_item(item: dict) -> Optional[dict]:
+    """ Turns a cache table item into a prediction, ignoring items expired but not yet deleted by DynamoDB.
+
+    Args:
+        item (dict): DynamoDB item.
+
+    Returns:
+        dict: Cached prediction, None if expired.
+    """
+
+    if float(item["ExpiresAt"]["N"]) < time.time():
+        return None
+
+    return {
+        "IsPlant": item["IsPlant"]["BOOL"],
+        "Label": item["Label"]["S"] if "Label" in item else None
+    }
+
+
+class PredictionCache:
+    """ Content addressed cache of plant check verdicts and labels.
+
+    Backends are tried in order, a hit in a later backend is copied into the
+    earlier ones. Predictions are dicts with an "IsPlant" flag and a "Label",
+    which is None for images that failed the plant check.
+    """
+
+    def __init__(self, backends: List):
+        """
+        Args:
+            backends (list): Backends exposing get, get_many, put and name, fastest first.
+        """
+
+        self.backends = backends
+        self.hits: Dict[str, int] = {backend.name: 0 for backend in backends}
+        self.misses: int = 0
+
+    def get(self, key: str) -> Optional[dict]:
+        """ Looks up a prediction in every backend.
+
+        Args:
+            key (str): Image hash.
+
+        Returns:
+            dict: Cached prediction, None on a miss.
+        """
+
+        for index, backend in enumerate(self.backends):
+            prediction = backend.get(key)
+
+            if prediction is not None:
+                self.hits[backend.name] += 1
+
+                for faster_backend in self.backends[:index]:
+                    faster_backend.put(key, prediction)
+
+                return prediction
+
+        self.misses += 1
+
+        return None
+
+    def get_many(self, keys: List[str]) -> Dict[str, dict]:
+        """ Looks up several predictions, with one call per backend for the keys still missing.
+
+        Args:
+            keys (list): Image hashes, duplicates are looked up once.
+
+        Returns:
+            dict: Cached predictions of the hits, keyed by image hash.
+        """
+
+        missing = list(dict.fromkeys(keys))
+        found: Dict[str, dict] = {}
+
+        for index, backend in enumerate(self.backends):
+            if not missing:
+                break
+
+            hits = backend.get_many(missing)
+
+            for key, prediction in hits.items():
+                self.hits[backend.name] += 1
+
+                for faster_backend in self.backends[:index]:
+                    faster_backend.put(key, prediction)
+
+            found.update(hits)
+            missing = [key for key in missing if key not in hits]
+
+        self.misses += len(missing)
+
+        return found
+
+    def put(self, key: str, prediction: dict) -> None:
+        """ Stores a prediction in every backend.
+
+        Args:
+            key (str): Image hash.
+            prediction (dict): Prediction with the "IsPlant" verdict and the "Label".
+        """
+
+        for backend in self.backends:
+            backend.put(key, prediction)
+
+    def clear(self) -> None:
+        """ Empties the in-process backends and resets the counters. """
+
+        for backend in self.backends:
+            if isinstance(backend, LRUBackend):
+                backend.clear()
+
+        self.hits = {backend.name: 0 for backend in self.backends}
+        self.misses = 0
+
+    def stats(self) -> dict:
+        """ Hit and miss counters since the container started.
+
+        Returns:
+            dict: Counters per backend and the overall hit ratio.
+        """
+
+        hits = sum(self.hits.values())
+        lookups = hits + self.misses
+
+        return {
+            "Hits": dict(self.hits),
+            "Misses": self.misses,
+            "HitRatio": hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,177 @@
+import logging
+import os
+import time
+from collections import namedtuple
+from io import BytesIO
+from typing import Tuple
+
+from PIL import Image
+
+logger = logging.getLogger()
+
+# Longest side of the image sent to Rekognition, larger uploads are downscaled
+REKOGNITION_MAX_SIDE: int = int(os.environ.get("REKOGNITION_MAX_SIDE", "1024"))
+
+# Quality of the JPEG re-encoded for Rekognition
+REKOGNITION_JPEG_QUALITY: int = int(os.environ.get("REKOGNITION_JPEG_QUALITY", "90"))
+
+# Must match IMAGE_SIZE in model/code/consts.py
+INFERENCE_IMAGE_SIZE: Tuple[int, int] = (150, 150)
+
+# Formats accepted, small uploads reach Rekognition unchanged and it only reads JPEG and PNG
+ALLOWED_IMAGE_FORMATS: Tuple[str, ...] = tuple(os.environ.get("ALLOWED_IMAGE_FORMATS", "JPEG,PNG").split(","))
+
+# Largest upload accepted
+MAX_IMAGE_BYTES: int = int(os.environ.get("MAX_IMAGE_BYTES", str(5 * 1024 * 1024)))
+
+# Largest decoded image accepted, bounds the memory of decompression bombs
+MAX_IMAGE_PIXELS: int = int(os.environ.get("MAX_IMAGE_PIXELS", "40000000"))
+
+# Bounds on the sides of the image
+MIN_IMAGE_SIDE: int = int(os.environ.get("MIN_IMAGE_SIDE", "32"))
+MAX_IMAGE_SIDE: int = int(os.environ.get("MAX_IMAGE_SIDE", "10000"))
+
+PreparedImage = namedtuple("PreparedImage", "rekognition_bytes, inference_bytes, stats")
+
+ImageHeader = namedtuple("ImageHeader", "format, width, height")
+
+
+class InvalidImage(ValueError):
+    """ Raised for an upload that is rejected before any remote call. """
+
+    def __init__(self, reason: str, status_code: int, message: str):
+        """
+        Args:
+            reason (str): Short reason, used in metrics.
+            status_code (int): HTTP status code of the rejection.
+            message (str): Message returned to the client.
+        """
+
+        super().__init__(message)
+
+        self.reason = reason
+        self.status_code = status_code
+
+
+def validate_image(image_bytes: bytes) -> ImageHeader:
+    """ Checks the size, format and dimensions of an upload from its header only.
+
+    PIL opens images lazily, the pixels are not decoded here, so even a
+    decompression bomb is rejected in microseconds.
+
+    Args:
+        image_bytes (bytes): Input image as bytes.
+
+    Raises:
+        InvalidImage: If the upload cannot be processed.
+
+    Returns:
+        ImageHeader: Format and dimensions of the image.
+    """
+
+    if len(image_bytes) > MAX_IMAGE_BYTES:
+        raise InvalidImage("TooLarge", 413, "Image must be at most {} bytes".format(MAX_IMAGE_BYTES))
+
+    try:
+        with Image.open(BytesIO(image_bytes)) as image:
+            header = ImageHeader(image.format, *image.size)
+    except Image.DecompressionBombError as error:
+        raise InvalidImage("TooManyPixels", 413,
+                           "Image must have at most {} pixels".format(MAX_IMAGE_PIXELS)) from error
+    except (OSError, SyntaxError, ValueError) as error:
+        raise InvalidImage("Unreadable", 400, "Uploaded file is not a readable image") from error
+
+    if header.format not in ALLOWED_IMAGE_FORMATS:
+        raise InvalidImage("UnsupportedFormat", 415,
+                           "Image must be one of {}".format(", ".join(ALLOWED_IMAGE_FORMATS)))
+
+    if header.width * header.height > MAX_IMAGE_PIXELS:
+        raise InvalidImage("TooManyPixels", 413, "Image must have at most {} pixels".format(MAX_IMAGE_PIXELS))
+
+    if min(header.width, header.height) < MIN_IMAGE_SIDE or max(header.width, header.height) > MAX_IMAGE_SIDE:
+        raise InvalidImage("BadDimensions", 400, "Image sides must be between {} and {} pixels".format(
+            MIN_IMAGE_SIDE, MAX_IMAGE_SIDE))
+
+    return header
+
+
+def prepare_image(image_bytes: bytes) -> PreparedImage:
+    """ Decodes the upload once and builds the payloads of the remote calls.
+
+    Rekognition gets a JPEG bounded to REKOGNITION_MAX_SIDE and SageMaker gets
+    the image already resized to the model input as a lossless PNG, so the
+    input_handler resize becomes a no-op. Each payload falls back to the
+    original bytes when those are smaller or the image cannot be decoded.
+
+    Args:
+        image_bytes (bytes): Input image as bytes.
+
+    Returns:
+        PreparedImage: Rekognition and SageMaker payloads with their size statistics.
+    """
+
+    start = time.perf_counter()
+
+    try:
+        image = Image.open(BytesIO(image_bytes))
+        original_size = image.size
+
+        # Lets libjpeg decode directly at a reduced scale, never below the Rekognition bound
+        if image.format == "JPEG":
+            image.draft("RGB", (REKOGNITION_MAX_SIDE, REKOGNITION_MAX_SIDE))
+
+        rgb_image = image.convert("RGB")
+    except (OSError, Image.DecompressionBombError) as error:
+        logger.warning("Could not decode the input image, sending it unchanged: %s", error)
+        rekognition_bytes = inference_bytes = image_bytes
+    else:
+        rekognition_bytes = image_bytes
+
+        if max(original_size) > REKOGNITION_MAX_SIDE:
+            bounded_image = rgb_image.copy()
+            bounded_image.thumbnail((REKOGNITION_MAX_SIDE, REKOGNITION_MAX_SIDE))
+            rekognition_bytes = smallest(image_bytes, encode(bounded_image, "JPEG", quality=REKOGNITION_JPEG_QUALITY))
+
+        inference_bytes = smallest(image_bytes, encode(rgb_image.resize(INFERENCE_IMAGE_SIZE), "PNG"))
+
+    stats = {
+        "OriginalBytes": len(image_bytes),
+        "RekognitionBytes": len(rekognition_bytes),
+        "InferenceBytes": len(inference_bytes),
+        "BytesSaved": 2 * len(image_bytes) - len(rekognition_bytes) - len(inference_bytes),
+        "PreprocessMs": round((time.perf_counter() - start) * 1000, 3)
+    }
+    logger.info("Prepared image payloads: %s", stats)
+
+    return PreparedImage(rekognition_bytes, inference_bytes, stats)
+
+
+def encode(image: Image.Image, image_format: str, **params) -> bytes:
+    """ Encodes an image in memory.
+
+    Args:
+        image (Image.Image): Image to be encoded.
+        image_format (str): PIL format name.
+
+    Returns:
+        bytes: Encoded image.
+    """
+
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, **params)
+
+    return buffer.getvalue()
+
+
+def smallest(original: bytes, encoded: bytes) -> bytes:
+    """ Picks the smaller of two payloads, preferring the original on a tie.
+
+    Args:
+        original (bytes): Uploaded image.
+        encoded (bytes): Re-encoded image.
+
+    Returns:
+        bytes: Smaller payload.
+    """
+
+    return encoded if len(encoded) < len(original) else original
@@ -0,0 +1,329 @@
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Optional, Tuple
+
+import botocore
+
+try:
+    from .metrics import is_abandoned
+except ImportError:
+    from metrics import is_abandoned
+
+logger = logging.getLogger()
+
+# The state below is per container. A Lambda container serves one request at a time and the
+# failures worth tripping on take a whole read timeout, so it sees a few calls per minute at most.
+
+# Number of latest calls the error and slow call rates are computed on
+CIRCUIT_WINDOW_CALLS: int = int(os.environ.get("CIRCUIT_WINDOW_CALLS", "5"))
+
+# Age after which a call leaves the window, whatever the number of later calls
+CIRCUIT_WINDOW_SECONDS: float = float(os.environ.get("CIRCUIT_WINDOW_SECONDS", "300"))
+
+# Calls needed in the window before the circuit can open, three timeouts take about a minute
+CIRCUIT_MIN_CALLS: int = int(os.environ.get("CIRCUIT_MIN_CALLS", "3"))
+
+# Share of failed calls in the window that opens the circuit
+CIRCUIT_ERROR_RATE: float = float(os.environ.get("CIRCUIT_ERROR_RATE", "0.5"))
+
+# Share of slow calls in the window that opens the circuit
+CIRCUIT_SLOW_CALL_RATE: float = float(os.environ.get("CIRCUIT_SLOW_CALL_RATE", "0.8"))
+
+# Seconds the circuit stays open before letting a probe through
+CIRCUIT_OPEN_SECONDS: float = float(os.environ.get("CIRCUIT_OPEN_SECONDS", "15"))
+
+# Calls in flight per dependency above which new calls are shed, 0 disables the limit. Only hosts
+# serving concurrent requests in one process can reach it, Lambda sheds through the reserved
+# concurrency of the function instead, see its CloudFormation template.
+MAX_IN_FLIGHT: int = int(os.environ.get("MAX_IN_FLIGHT", "0"))
+
+# Error codes of overloaded or failing services, any 5xx status counts as well. ModelError is the
+# 424 of a SageMaker model container that crashed or ran out of memory.
+FAILURE_CODES: Tuple[str, ...] = ("ThrottlingException", "ProvisionedThroughputExceededException",
+                                  "ServiceUnavailable", "InternalFailure", "ModelNotReadyException", "ModelError")
+
+# Failure codes not worth retrying, the container fails the same way on the same input
+NOT_RETRYABLE_CODES: Tuple[str, ...] = ("ModelError",)
+
+CLOSED: str = "CLOSED"
+OPEN: str = "OPEN"
+HALF_OPEN: str = "HALF_OPEN"
+
+
+class DependencyUnavailable(Exception):
+    """ Raised instead of calling a dependency that is known to be failing or saturated. """
+
+    def __init__(self, dependency: str, reason: str, retry_after: float):
+        """
+        Args:
+            dependency (str): Name of the dependency.
+            reason (str): "CircuitOpen" or "Shed".
+            retry_after (float): Seconds after which the client may retry.
+        """
+
+        super().__init__("{} unavailable: {}".format(dependency, reason))
+
+        self.dependency = dependency
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def is_failure(error: BaseException) -> bool:
+    """ Checks if an error says the dependency is unhealthy rather than the request invalid.
+
+    Args:
+        error (BaseException): Error raised by the call.
+
+    Returns:
+        bool: True for timeouts, connection errors, throttling and 5xx responses.
+    """
+
+    if isinstance(error, botocore.exceptions.ClientError):
+        code = error.response.get("Error", {}).get("Code")
+        status_code = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+
+        return code in FAILURE_CODES or status_code >= 500 or status_code == 429
+
+    return isinstance(error, botocore.exceptions.BotoCoreError)
+
+
+class CircuitBreaker:
+    """ Per dependency circuit breaker over the latest calls of the container.
+
+    The circuit opens when the share of failed or slow calls in the window
+    crosses its threshold. While open, calls fail fast. After open_seconds a
+    single probe goes through, which closes the circuit on success and opens
+    it again otherwise.
+
+    The window counts calls rather than seconds, because a container making
+    one call at a time records too few calls per second for a time window to
+    ever reach min_calls. Each container trips on its own failures.
+    """
+
+    def __init__(self, name: str, slow_call_ms: float, window: float = CIRCUIT_WINDOW_SECONDS,
+                 min_calls: int = CIRCUIT_MIN_CALLS, error_rate: float = CIRCUIT_ERROR_RATE,
+                 slow_call_rate: float = CIRCUIT_SLOW_CALL_RATE, open_seconds: float = CIRCUIT_OPEN_SECONDS,
+                 clock: Callable[[], float] = time.monotonic, window_calls: int = CIRCUIT_WINDOW_CALLS):
+        """
+        Args:
+            name (str): Name of the dependency, used in logs and metrics.
+            slow_call_ms (float): Duration above which a successful call counts as slow.
+            window (float): Age in seconds after which a call leaves the window.
+            min_calls (int): Calls needed in the window before the circuit can open.
+            error_rate (float): Share of failed calls that opens the circuit.
+            slow_call_rate (float): Share of slow calls that opens the circuit.
+            open_seconds (float): Seconds before a probe is let through.
+            clock (callable): Monotonic clock in seconds.
+            window_calls (int): Number of latest calls kept, at least min_calls.
+        """
+
+        self.name = name
+        self.slow_call_ms = slow_call_ms
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.clock = clock
+        self.state = CLOSED
+
+        # (time, failed, slow) of every call in the window
+        self._calls: Deque[Tuple[float, bool, bool]] = deque(maxlen=max(window_calls, min_calls))
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """ Checks if a call may go through, claiming the probe of a half-open circuit.
+
+        Raises:
+            DependencyUnavailable: If the circuit is open or its probe is in flight.
+
+        Returns:
+            bool: True if the call is the probe of a half-open circuit.
+        """
+
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self._opened_at + self.open_seconds - self.clock()
+
+                if remaining > 0:
+                    raise DependencyUnavailable(self.name, "CircuitOpen", remaining)
+
+                self._transition(HALF_OPEN)
+
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    raise DependencyUnavailable(self.name, "CircuitOpen", 1)
+
+                self._probing = True
+                return True
+
+            return False
+
+    def record(self, duration_ms: float, failed: bool, probe: bool = False) -> None:
+        """ Records the outcome of a call and updates the state.
+
+        Args:
+            duration_ms (float): Duration of the call.
+            failed (bool): True if the call failed because of the dependency.
+            probe (bool): True for the probe of a half-open circuit.
+        """
+
+        slow = not failed and duration_ms > self.slow_call_ms
+        now = self.clock()
+
+        with self._lock:
+            if probe:
+                self._probing = False
+                self._calls.clear()
+
+                if failed or slow:
+                    self._open(now)
+                else:
+                    self._transition(CLOSED)
+
+                return
+
+            self._calls.append((now, failed, slow))
+
+            while self._calls and self._calls[0][0] < now - self.window:
+                self._calls.popleft()
+
+            if self.state == CLOSED and len(self._calls) >= self.min_calls:
+                failures = sum(1 for _, call_failed, _ in self._calls if call_failed)
+                slow_calls = sum(1 for _, _, call_slow in self._calls if call_slow)
+
+                if failures >= self.error_rate * len(self._calls) or \
+                        slow_calls >= self.slow_call_rate * len(self._calls):
+                    self._open(now)
+
+    def reset(self) -> None:
+        """ Closes the circuit and forgets every call. """
+
+        with self._lock:
+            self._calls.clear()
+            self._probing = False
+            self.state = CLOSED
+
+    def _open(self, now: float) -> None:
+        self._opened_at = now
+        self._calls.clear()
+        self._transition(OPEN)
+
+    def _transition(self, state: str) -> None:
+        if state != self.state:
+            logger.warning("Circuit of %s is now %s", self.name, state)
+            self.state = state
+
+
+class ConcurrencyLimiter:
+    """ Bound on the calls in flight to a dependency, excess calls are shed instead of queued. """
+
+    def __init__(self, name: str, max_in_flight: int = MAX_IN_FLIGHT):
+        """
+        Args:
+            name (str): Name of the dependency.
+            max_in_flight (int): Maximum concurrent calls, 0 for no limit.
+        """
+
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """ Claims a slot.
+
+        Raises:
+            DependencyUnavailable: If every slot is taken.
+        """
+
+        with self._lock:
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                raise DependencyUnavailable(self.name, "Shed", 1)
+
+            self.in_flight += 1
+
+    def release(self) -> None:
+        """ Frees a slot. """
+
+        with self._lock:
+            self.in_flight -= 1
+
+
+class Dependency:
+    """ Circuit breaker and concurrency limit guarding the calls to a remote service. """
+
+    def __init__(self, breaker: CircuitBreaker, limiter: Optional[ConcurrencyLimiter] = None,
+                 on_reject: Optional[Callable[[DependencyUnavailable], None]] = None):
+        """
+        Args:
+            breaker (CircuitBreaker): Circuit breaker of the service.
+            limiter (ConcurrencyLimiter, optional): Concurrency limit of the service.
+            on_reject (callable, optional): Called with the error of every rejected call.
+        """
+
+        self.breaker = breaker
+        self.limiter = limiter
+        self.on_reject = on_reject
+
+    @contextmanager
+    def guard(self):
+        """ Wraps a call, failing fast while the service is failing or saturated.
+
+        Raises:
+            DependencyUnavailable: If the call is rejected.
+        """
+
+        try:
+            if self.limiter is not None:
+                self.limiter.acquire()
+
+            try:
+                probe = self.breaker.allow()
+            except DependencyUnavailable:
+                if self.limiter is not None:
+                    self.limiter.release()
+                raise
+        except DependencyUnavailable as error:
+            if self.on_reject is not None:
+                self.on_reject(error)
+            raise
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        except Exception as error:
+            self._record(start, is_failure(error), probe)
+            raise
+        else:
+            self._record(start, False, probe)
+        finally:
+            if self.limiter is not None:
+                self.limiter.release()
+
+    def _record(self, start: float, failed: bool, probe: bool) -> None:
+        # An abandoned call says nothing about the request that is being served, a probe must still settle
+        if probe or not is_abandoned():
+            self.breaker.record((time.perf_counter() - start) * 1000, failed, probe)
+
+
+def retry_after_header(error: DependencyUnavailable) -> str:
+    """ Formats the Retry-After header of a rejected request.
+
+    Args:
+        error (DependencyUnavailable): Rejection.
+
+    Returns:
+        str: Whole seconds, at least one.
+    """
+
+    return str(max(1, math.ceil(error.retry_after)))
@@ -0,0 +1,203 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, NamedTuple, Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies shorter than this are always sent as is, compressing them does not pay off
+COMPRESSION_MIN_BYTES: int = int(os.environ.get("COMPRESSION_MIN_BYTES", "256"))
+
+# Codings offered to the client, the first accepted one wins on equal quality
+SUPPORTED_ENCODINGS: List[str] = ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+class RenderedBody(NamedTuple):
+    """ JSON response body with its compressed variants and entity tag. """
+
+    text: str
+    etag: str
+    encodings: Dict[str, bytes]
+
+    def etag_for(self, coding: Optional[str]) -> str:
+        """ Entity tag of a variant, each content coding gets its own strong tag.
+
+        Args:
+            coding (str, optional): Content coding, None for the uncompressed body.
+
+        Returns:
+            str: Quoted entity tag.
+        """
+
+        return self.etag if coding is None else '{}-{}"'.format(self.etag[:-1], coding)
+
+
+def render_body(body) -> RenderedBody:
+    """ Serializes a response body once, along with its compressed variants.
+
+    Args:
+        body (obj): JSON-serializable response body.
+
+    Returns:
+        RenderedBody: Body text, strong ETag and compressed bytes per coding.
+    """
+
+    text = json.dumps(body)
+    data = text.encode("utf-8")
+
+    # Derived from the content only, so every container sends the same tag
+    etag = '"{}"'.format(hashlib.sha256(data).hexdigest()[:32])
+
+    encodings: Dict[str, bytes] = {}
+
+    if len(data) >= COMPRESSION_MIN_BYTES:
+        # mtime=0 keeps the gzip bytes identical between containers
+        encodings["gzip"] = gzip.compress(data, 9, mtime=0)
+
+        if brotli is not None:
+            encodings["br"] = brotli.compress(data)
+
+    return RenderedBody(text, etag, encodings)
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """ Parses an Accept-Encoding header.
+
+    Args:
+        header (str, optional): Header value, e.g. "gzip, deflate;q=0.5, *;q=0".
+
+    Returns:
+        dict: Quality of every listed coding, lowercase.
+    """
+
+    qualities: Dict[str, float] = {}
+
+    for entry in (header or "").split(","):
+        coding, _, params = entry.strip().partition(";")
+
+        if not coding:
+            continue
+
+        quality = 1.0
+        name, _, value = params.strip().partition("=")
+
+        if name.strip().lower() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+
+        qualities[coding.strip().lower()] = quality
+
+    return qualities
+
+
+def choose_encoding(rendered: RenderedBody, accept_encoding: Optional[str]) -> Optional[str]:
+    """ Picks the compressed variant to send.
+
+    Args:
+        rendered (RenderedBody): Rendered body.
+        accept_encoding (str, optional): Accept-Encoding header of the request.
+
+    Returns:
+        str: Content coding, None to send the body uncompressed.
+    """
+
+    qualities = parse_accept_encoding(accept_encoding)
+    wildcard = qualities.get("*", 0.0)
+
+    best, best_quality = None, 0.0
+
+    for coding in SUPPORTED_ENCODINGS:
+        quality = qualities.get(coding, wildcard)
+
+        if coding in rendered.encodings and quality > best_quality:
+            best, best_quality = coding, quality
+
+    return best
+
+
+def etag_matches(if_none_match: Optional[str], rendered: RenderedBody) -> bool:
+    """ Checks an If-None-Match header with the weak comparison of RFC 7232.
+
+    Args:
+        if_none_match (str, optional): If-None-Match header of the request.
+        rendered (RenderedBody): Current body, any of its variants matches.
+
+    Returns:
+        bool: True if the client copy is still current.
+    """
+
+    if not if_none_match:
+        return False
+
+    if if_none_match.strip() == "*":
+        return True
+
+    etags = {rendered.etag_for(coding) for coding in [None, *rendered.encodings]}
+
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+
+        # Weak comparison, intermediaries may weaken the tag of a compressed body
+        if tag.startswith("W/"):
+            tag = tag[2:]
+
+        if tag in etags:
+            return True
+
+    return False
+
+
+class ResponseCache:
+    """ Rendered bodies of the per label responses, kept between warm invocations.
+
+    Entries are keyed by label and dropped together when the knowledge base
+    loads a new version, so a changed item is never served from an old render.
+    """
+
+    def __init__(self):
+        self.version: Optional[str] = None
+
+        self._bodies: Dict[str, RenderedBody] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str, body, version: Optional[str] = None) -> RenderedBody:
+        """ Returns the rendered body of a key, rendering it on first use.
+
+        Args:
+            key (str): Label or any other name of a constant body.
+            body (obj): JSON-serializable body, rendered on a miss.
+            version (str, optional): Knowledge base version the body was read from.
+
+        Returns:
+            RenderedBody: Rendered body.
+        """
+
+        with self._lock:
+            if version != self.version:
+                self._bodies = {}
+                self.version = version
+
+            rendered = self._bodies.get(key)
+
+        if rendered is None:
+            rendered = render_body(body)
+
+            with self._lock:
+                if version == self.version:
+                    self._bodies[key] = rendered
+
+        return rendered
+
+    def clear(self) -> None:
+        """ Drops every rendered body. """
+
+        with self._lock:
+            self._bodies = {}
+            self.version = None
@@ -0,0 +1,65 @@
+from unittest import mock
+
+# pylint: disable=E0402
+from .. import clients
+from ..clients import build_config, get_budget_client, get_client, reset_clients
+
+
+class TestClients:
+    def setup_method(self):
+        reset_clients()
+
+    def teardown_method(self):
+        reset_clients()
+
+    @mock.patch("boto3.client")
+    def test_get_client_reuses_client(self, boto3_client):
+        first = get_client("rekognition")
+        second = get_client("rekognition")
+
+        assert first is second
+        boto3_client.assert_called_once()
+
+    @mock.patch("boto3.client")
+    def test_get_client_per_service(self, boto3_client):
+        boto3_client.side_effect = lambda service_name, **kwargs: mock.Mock(name=service_name)
+
+        assert get_client("rekognition") is not get_client("dynamodb")
+        assert boto3_client.call_count == 2
+
+    @mock.patch("boto3.client")
+    def test_reset_clients(self, boto3_client):
+        get_client("dynamodb")
+        reset_clients()
+        get_client("dynamodb")
+
+        assert boto3_client.call_count == 2
+
+    @mock.patch("boto3.client")
+    def test_get_client_endpoint_override(self, boto3_client):
+        with mock.patch.dict(clients.ENDPOINT_URLS, {"sagemaker-runtime": "http://localhost:8080"}):
+            get_client("sagemaker-runtime")
+            get_client("rekognition")
+
+        assert boto3_client.call_args_list[0][1]["endpoint_url"] == "http://localhost:8080"
+        assert "endpoint_url" not in boto3_client.call_args_list[1][1]
+
+    def test_build_config(self):
+        config = build_config("sagemaker-runtime")
+
+        assert config.tcp_keepalive is True
+        assert config.read_timeout > build_config("dynamodb").read_timeout
+        assert config.retries["mode"] == "standard"
+
+    @mock.patch("boto3.client")
+    def test_get_budget_client(self, boto3_client):
+        boto3_client.side_effect = lambda service_name, **kwargs: mock.Mock(name=service_name)
+
+        default = get_budget_client("rekognition", clients.READ_TIMEOUTS["rekognition"], clients.MAX_ATTEMPTS)
+        short = get_budget_client("rekognition", 1, 1)
+
+        assert default is get_client("rekognition")
+        assert short is get_budget_client("rekognition", 1, 1)
+        assert short is not default
+        assert boto3_client.call_args_list[1][1]["config"].read_timeout == 1
+        assert boto3_client.call_args_list[1][1]["config"].retries["total_max_attempts"] == 1
@@ -0,0 +1,142 @@
+import math
+
+import botocore
+import pytest
+
+# pylint: disable=E0402
+from .. import deadline as deadline_module
+from ..clients import MAX_ATTEMPTS, READ_TIMEOUTS
+from ..deadline import Budget, Deadline, DeadlineExceeded, is_fast_retryable, round_timeout
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestDeadline:
+    def test_no_deadline_keeps_defaults(self):
+        deadline = Deadline()
+        deadline.begin(None)
+
+        assert deadline.remaining() == math.inf
+        assert deadline.budget("sagemaker-runtime") == (math.inf, READ_TIMEOUTS["sagemaker-runtime"], MAX_ATTEMPTS)
+
+    def test_deadline_is_the_earliest_limit(self):
+        clock = Clock()
+        deadline = Deadline(reserve_ms=500, clock=clock)
+        deadline.begin(120000, 29000)
+
+        assert deadline.remaining() == pytest.approx(28.5)
+
+        clock.now = 10
+
+        assert deadline.remaining() == pytest.approx(18.5)
+
+    def test_budget_bounds_timeout_and_attempts(self):
+        clock = Clock()
+        deadline = Deadline(reserve_ms=0, clock=clock)
+        deadline.begin(6000)
+
+        # A third of the 6 s left, the attempts are bounded by time rather than by count
+        rekognition = deadline.budget("rekognition")
+
+        assert rekognition.read_timeout == 1
+        assert rekognition.max_attempts == MAX_ATTEMPTS
+
+        sagemaker = deadline.budget("sagemaker-runtime")
+
+        assert sagemaker.read_timeout == 5
+        assert sagemaker.max_attempts == MAX_ATTEMPTS
+
+        clock.now = 6
+
+        with pytest.raises(DeadlineExceeded):
+            deadline.budget("dynamodb")
+
+    def test_round_timeout(self):
+        assert round_timeout(4.9) == 3
+        assert round_timeout(30) == 30
+        assert round_timeout(0.01) == 0.25
+
+    def test_stage_usage(self):
+        clock = Clock()
+        deadline = Deadline(reserve_ms=0, clock=clock)
+        deadline.begin(10000)
+
+        with deadline.stage("SageMaker", "sagemaker-runtime"):
+            clock.now = 2
+
+        summary = deadline.summary()
+
+        assert summary["ElapsedMs"] == 2000
+        assert summary["RemainingMs"] == 8000
+        assert summary["Stages"][0]["Stage"] == "SageMaker"
+        assert summary["Stages"][0]["BudgetMs"] == 9000
+        assert summary["Stages"][0]["UsedMs"] == 2000
+
+    def test_retry_fast_errors(self, monkeypatch):
+        # Longest backoff, 0.1 s then 0.2 s
+        monkeypatch.setattr(deadline_module.random, "uniform", lambda low, high: high)
+        clock = Clock()
+        deadline = Deadline(reserve_ms=0, clock=clock, sleep=lambda delay: None)
+        budgets = []
+
+        def call(budget):
+            budgets.append(budget)
+            clock.now += 2
+
+            if len(budgets) < 3:
+                raise throttling()
+
+            return "result"
+
+        assert deadline.retry(Budget(10, 5, 3), call) == "result"
+        assert [budget.read_timeout for budget in budgets] == [5, 5, 5]
+
+        # The last attempt only gets the time left in the stage
+        budgets.clear()
+
+        assert deadline.retry(Budget(5, 5, 3), call) == "result"
+        assert [budget.read_timeout for budget in budgets] == [5, 2, 0.5]
+
+    def test_retry_stops(self):
+        clock = Clock()
+        deadline = Deadline(reserve_ms=0, clock=clock, sleep=lambda delay: None)
+        attempts = []
+
+        def timeout(budget):
+            attempts.append(budget)
+            raise botocore.exceptions.ReadTimeoutError(endpoint_url="http://localhost")
+
+        with pytest.raises(botocore.exceptions.ReadTimeoutError):
+            deadline.retry(Budget(30, 5, 3), timeout)
+
+        # A timeout used the time a retry would need
+        assert len(attempts) == 1
+
+        def slow_throttling(budget):
+            attempts.append(budget)
+            clock.now += 5
+            raise throttling()
+
+        with pytest.raises(botocore.exceptions.ClientError):
+            deadline.retry(Budget(5, 5, 3), slow_throttling)
+
+        assert len(attempts) == 2
+
+    def test_is_fast_retryable(self):
+        assert is_fast_retryable(throttling())
+        assert is_fast_retryable(botocore.exceptions.EndpointConnectionError(endpoint_url="http://localhost"))
+        assert not is_fast_retryable(botocore.exceptions.ReadTimeoutError(endpoint_url="http://localhost"))
+        assert not is_fast_retryable(ValueError())
+        assert not is_fast_retryable(botocore.exceptions.ClientError(
+            {"Error": {"Code": "ModelError"}, "ResponseMetadata": {"HTTPStatusCode": 424}}, "InvokeEndpoint"))
+
+
+def throttling() -> botocore.exceptions.ClientError:
+    return botocore.exceptions.ClientError(
+        {"Error": {"Code": "ThrottlingException"}, "ResponseMetadata": {"HTTPStatusCode": 400}}, "DetectLabels")
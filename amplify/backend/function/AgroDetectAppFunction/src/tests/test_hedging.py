@@ -0,0 +1,106 @@
+import math
+import threading
+import time
+
+import pytest
+
+# pylint: disable=E0402
+from ..hedging import Hedger, LatencyTracker
+
+
+def warm_up(hedger: Hedger, latency_ms: float) -> None:
+    for _ in range(hedger.min_samples):
+        hedger.tracker.add(latency_ms)
+
+
+class TestHedging:
+    def test_percentile(self):
+        tracker = LatencyTracker(window=4)
+
+        assert math.isnan(tracker.percentile(90))
+
+        for latency in (50, 10, 40, 20, 30):
+            tracker.add(latency)
+
+        assert len(tracker) == 4
+        assert tracker.percentile(50) == 20
+        assert tracker.percentile(90) == 40
+        assert tracker.percentile(0) == 10
+
+    def test_no_hedge_before_min_samples(self):
+        hedger = Hedger(min_samples=3, max_rate=1)
+        outcomes = []
+
+        for _ in range(3):
+            assert hedger.call(lambda: "result", on_outcome=lambda *outcome: outcomes.append(outcome)) == "result"
+
+        assert outcomes == [(False, False)] * 3
+        assert hedger.stats()["Hedges"] == 0
+        assert hedger.delay_ms() is not None
+
+    def test_hedge_wins(self):
+        hedger = Hedger(min_samples=5, max_rate=1)
+        warm_up(hedger, 10)
+        release = threading.Event()
+        attempts = []
+        cleaned = []
+        outcomes = []
+
+        def slow_then_fast():
+            attempts.append(1)
+
+            if len(attempts) == 1:
+                release.wait(2)
+                return "primary"
+
+            return "hedge"
+
+        assert hedger.call(slow_then_fast, cleaned.append, lambda *outcome: outcomes.append(outcome)) == "hedge"
+
+        release.set()
+        time.sleep(0.1)
+
+        assert cleaned == ["primary"]
+        assert outcomes == [(True, True)]
+        assert hedger.stats()["HedgeWinRate"] == 1.0
+
+    def test_fast_call_not_hedged(self):
+        hedger = Hedger(min_samples=5, max_rate=1)
+        warm_up(hedger, 500)
+        outcomes = []
+
+        assert hedger.call(lambda: "result", on_outcome=lambda *outcome: outcomes.append(outcome)) == "result"
+        assert outcomes == [(False, False)]
+
+    def test_rate_cap(self):
+        hedger = Hedger(min_samples=5, max_rate=0.5)
+        warm_up(hedger, 1)
+        outcomes = []
+
+        def slow():
+            time.sleep(0.05)
+            return "result"
+
+        for _ in range(4):
+            hedger.call(slow, on_outcome=lambda hedged, _: outcomes.append(hedged))
+
+        # The first call may never be hedged, as a single hedge would be all the traffic
+        assert outcomes[0] is False
+        assert hedger.stats()["Hedges"] <= 2
+        assert hedger.stats()["HedgeRate"] <= 0.5
+
+    def test_both_fail(self):
+        hedger = Hedger(min_samples=5, max_rate=1)
+        warm_up(hedger, 1)
+        attempts = []
+
+        def failing():
+            attempt = len(attempts) + 1
+            attempts.append(attempt)
+            time.sleep(0.05)
+            raise ValueError("attempt {}".format(attempt))
+
+        with pytest.raises(ValueError, match="attempt 1"):
+            hedger.call(failing)
+
+        assert len(attempts) == 2
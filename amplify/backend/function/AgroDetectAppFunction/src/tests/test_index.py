@@ -1,18 +1,28 @@
 import base64
+import gzip
 import json
 import os
+import threading
 import unittest
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from unittest import mock
 
 import boto3
 import pytest
-from botocore.stub import Stubber
+from botocore.stub import ANY, Stubber
+from PIL import Image
 
 # pylint: disable=E0402
-from ..index import (beautify, get_image_bytes, handler, is_not_plant,
+from .. import index, jobs, responses
+from ..clients import reset_clients
+from ..index import (KNOWLEDGE_BASE, PREDICTION_CACHE, RESPONSE_CACHE, beautify,
+                     detect_labels, get_batch_image_bytes, get_body, get_image_bytes, handler,
+                     is_batch_request, is_confident, is_not_plant,
                      parse_dynamodb_response, parse_inference_response,
                      return_sanity_check_response)
+from ..jobs import JobBackend, new_job
 from .payload import ENV_VARS, EVENT, SAGEMAKER, DYNAMODB, REKOGNITION
 
 
@@ -49,6 +59,33 @@ class TestFunctions:
         with pytest.raises(KeyError):
             get_image_bytes(event)
 
+    def test_get_body_base64_encoded(self):
+        # API Gateway encodes the body again when its media type is binary
+        event = {"body": base64.b64encode(EVENT["body"].encode("utf-8")).decode("utf-8"), "isBase64Encoded": True}
+
+        assert get_body(event) == EVENT["body"]
+        assert get_image_bytes(event) == get_image_bytes(EVENT)
+
+    def test_is_batch_request(self):
+        assert is_batch_request({"body": json.dumps(["VGVzdA=="])}) is True
+        assert is_batch_request({"body": "VGVzdA=="}) is False
+        assert is_batch_request({"body": None}) is False
+
+    def test_get_batch_image_bytes(self):
+        event = {
+            "body": json.dumps(["VGhpcyBpcyBhIHN0cmluZyBtZXNzYWdl", ""])
+        }
+        expected_output = [b"This is a string message", b""]
+        assert get_batch_image_bytes(event) == expected_output
+
+    def test_get_batch_image_bytes_invalid_items(self):
+        assert get_batch_image_bytes({"body": json.dumps(["abc", 1, None])}) == [None, None, None]
+
+    @pytest.mark.parametrize("body", ["[not json", "{\"images\": []}", "\"VGVzdA==\""])
+    def test_get_batch_image_bytes_invalid_body(self, body):
+        with pytest.raises(ValueError):
+            get_batch_image_bytes({"body": body})
+
     def test_is_not_plant(self):
         # Test case 1: No plant-related labels detected
         detected_labels = ["Cat", "Dog", "Car"]
@@ -98,6 +135,17 @@ class TestFunctions:
 
         assert parse_inference_response(sagemaker_response) == expected_label
 
+    @mock.patch.object(index, "CONFIDENCE_THRESHOLD", 0.9)
+    @mock.patch.object(index, "CONFIDENCE_MARGIN", 0.5)
+    def test_is_confident(self):
+        def scores(*probabilities):
+            return {"top_k": [{"label": "Test", "probability": probability} for probability in probabilities]}
+
+        assert is_confident(scores(0.95, 0.01)) is True
+        assert is_confident(scores(0.95)) is True
+        assert is_confident(scores(0.8, 0.1)) is False
+        assert is_confident(scores(0.9, 0.45)) is False
+
     def test_parse_dynamodb_response_disease(self):
         # Test case 1: Valid response with all fields
         response = {
@@ -155,6 +203,32 @@ class TestFunctions:
 
         assert parse_dynamodb_response(response) == expected_response
 
+    def test_parse_dynamodb_response_compact(self):
+        expected_response = {
+            "Name": "Test Disease",
+            "Description": "Test Description",
+            "isDisease": True,
+            "Treatments": [{"Test Treatment Key": "Test Treatment Value"}],
+            "Products": []
+        }
+        response = {
+            "Name": {"S": "Test Disease"},
+            "SchemaVersion": {"N": "2"},
+            "Payload": {"B": zlib.compress(json.dumps(expected_response).encode("utf-8"))}
+        }
+
+        assert parse_dynamodb_response(response) == expected_response
+
+    def test_parse_dynamodb_response_unsupported_schema(self):
+        response = {
+            "Name": {"S": "Test Disease"},
+            "SchemaVersion": {"N": "3"},
+            "Payload": {"B": zlib.compress(b"{}")}
+        }
+
+        with pytest.raises(ValueError):
+            parse_dynamodb_response(response)
+
     def test_beautify_valid_single(self):
         # Test case 1: Valid input dictionary with a single item
         data = {
@@ -208,8 +282,22 @@ CLIENT_STUB_DICT = {
 def client_stub(service_name, **kwargs):
     return CLIENT_STUB_DICT[service_name]
 
+def encoded_image(color, image_format="PNG"):
+    buffer = BytesIO()
+    Image.new("RGB", (64, 64), color).save(buffer, format=image_format)
+
+    return buffer.getvalue()
+
+
 class TestBotoFunctions(unittest.TestCase):
     def setup_class(self):
+        reset_clients()
+        PREDICTION_CACHE.clear()
+        KNOWLEDGE_BASE.clear()
+        KNOWLEDGE_BASE.snapshot_path = None
+        RESPONSE_CACHE.clear()
+        index.REKOGNITION_DEPENDENCY.breaker.reset()
+        index.SAGEMAKER_DEPENDENCY.breaker.reset()
         rekognition_client_stubber.activate()
         sagemaker_client_stubber.activate()
         dynamodb_client_stubber.activate()
@@ -232,6 +320,11 @@ class TestBotoFunctions(unittest.TestCase):
         service_response=SAGEMAKER["RESPONSE"],
         expected_params=SAGEMAKER["EXPECTED_PARAMS"])
 
+        dynamodb_client_stubber.add_response(
+        method="scan",
+        service_response={"Items": []},
+        expected_params={"TableName": ENV_VARS["DYNAMODB_TABLE_NAME"]})
+
         dynamodb_client_stubber.add_response(
         method="get_item",
         service_response=DYNAMODB["RESPONSE"],
@@ -239,6 +332,45 @@ class TestBotoFunctions(unittest.TestCase):
 
         handler(EVENT, None)
 
+    @mock.patch("boto3.client", client_stub)
+    @mock.patch.dict(os.environ, ENV_VARS)
+    def test_handler_emits_stage_metrics(self):
+        self.setup_class()
+        rekognition_client_stubber.add_response(
+        method="detect_labels",
+        service_response=REKOGNITION["RESPONSE"],
+        expected_params=REKOGNITION["EXPECTED_PARAMS"])
+
+        sagemaker_client_stubber.add_response(
+        method="invoke_endpoint",
+        service_response={"Body": BytesIO(b"Test Healthy")},
+        expected_params=SAGEMAKER["EXPECTED_PARAMS"])
+
+        dynamodb_client_stubber.add_response(
+        method="scan",
+        service_response={"Items": []},
+        expected_params={"TableName": ENV_VARS["DYNAMODB_TABLE_NAME"]})
+
+        dynamodb_client_stubber.add_response(
+        method="get_item",
+        service_response=DYNAMODB["RESPONSE"],
+        expected_params=DYNAMODB["EXPECTED_PARAMS"])
+
+        with mock.patch.object(index.METRICS, "write") as write:
+            handler(EVENT, None)
+
+        write.assert_called_once()
+        document = json.loads(write.call_args[0][0])
+        metric_names = {metric["Name"] for metric in document["_aws"]["CloudWatchMetrics"][0]["Metrics"]}
+
+        assert {"GetImageBytesMs", "RekognitionMs", "SageMakerMs", "DynamoDBMs", "ParseDynamoDBMs",
+                "ImageBytes", "InferenceBytes", "PredictionCacheHit"} <= metric_names
+        assert document["StatusCode"] == 200
+        assert document["PredictionCacheHit"] == 0
+
+        # The next test expects a cold knowledge base
+        self.setup_class()
+
     @mock.patch("boto3.client", client_stub)
     @mock.patch.dict(os.environ, ENV_VARS)
     def test_handler_successful_not_plant(self):
@@ -278,6 +410,564 @@ class TestBotoFunctions(unittest.TestCase):
 
         handler(EVENT, None)
 
+    @mock.patch("boto3.client", client_stub)
+    @mock.patch.dict(os.environ, ENV_VARS)
+    def test_handler_knowledge_base_hit(self):
+        self.setup_class()
+
+        dynamodb_client_stubber.add_response(
+        method="scan",
+        service_response={"Items": [DYNAMODB["RESPONSE"]["Item"]]},
+        expected_params={"TableName": ENV_VARS["DYNAMODB_TABLE_NAME"]})
+
+        for _ in range(2):
+            # Makes both requests reach the knowledge base
+            PREDICTION_CACHE.clear()
+
+            rekognition_client_stubber.add_response(
+            method="detect_labels",
+            service_response=REKOGNITION["RESPONSE"],
+            expected_params=REKOGNITION["EXPECTED_PARAMS"])
+
+            sagemaker_client_stubber.add_response(
+            method="invoke_endpoint",
+            service_response={"Body": BytesIO(b"Test Healthy")},
+            expected_params=SAGEMAKER["EXPECTED_PARAMS"])
+
+            response = handler(EVENT, None)
+
+            assert response["statusCode"] == 200
+            assert json.loads(response["body"])["Name"] == "Test Healthy"
+
+        # Only the cold start Scan reached DynamoDB
+        dynamodb_client_stubber.assert_no_pending_responses()
+
+    @mock.patch("boto3.client", client_stub)
+    @mock.patch.dict(os.environ, ENV_VARS)
+    def test_handler_deadline_exceeded(self):
+        self.setup_class()
+
+        # Less time left than the reserve kept to return the response
+        context = mock.Mock(get_remaining_time_in_millis=lambda: index.DEADLINE.reserve_ms / 2)
+
+        response = handler(EVENT, context)
+
+        assert response["statusCode"] == 504
+        rekognition_client_stubber.assert_no_pending_responses()
+
+    @mock.patch("boto3.client", client_stub)
+    @mock.patch.dict(os.environ, ENV_VARS)
+    def test_handler_with_deadline(self):
+        self.setup_class()
+
+        rekognition_client_stubber.add_response(
+        method="detect_labels",
+        service_response=REKOGNITION["RESPONSE"],
+        expected_params=REKOGNITION["EXPECTED_PARAMS"])
+
+        sagemaker_client_stubber.add_response(
+        method="invoke_endpoint",
+        service_response={"Body": BytesIO(b"Test Healthy")},
+        expected_params=SAGEMAKER["EXPECTED_PARAMS"])
+
+        dynamodb_client_stubber.add_response(
+        method="scan",
+        service_response={"Items": [DYNAMODB["RESPONSE"]["Item"]]},
+        expected_params={"TableName": ENV_VARS["DYNAMODB_TABLE_NAME"]})
+
+        context = mock.Mock(get_remaining_time_in_millis=lambda: 10000)
+
+        with self.assertLogs(level="INFO") as logs:
+            response = handler(EVENT, context)
+
+        assert response["statusCode"] == 200
+        assert any("Deadline budget" in line and "\"Stage\": \"SageMaker\"" in line for line in logs.output)
+
+        self.setup_class()
+
+    @mock.patch("boto3.client", client_stub)
+    @mock.patch.dict(os.environ, ENV_VARS)
+    def test_handler_circuit_open(self):
+        self.setup_class()
+
+        breaker = index.SAGEMAKER_DEPENDENCY.breaker
+
+        for _ in range(breaker.min_calls):
+            breaker.record(10, True)
+
+        rekognition_client_stubber.add_response(
+        method="detect_labels",
+        service_response=REKOGNITION["RESPONSE"],
+        expected_params=REKOGNITION["EXPECTED_PARAMS"])
+
+        # Fails fast without calling SageMaker
+        response = handler(EVENT, None)
+
+        assert response["statusCode"] == 503
+        assert int(response["headers"]["Retry-After"]) >= 1
+        sagemaker_client_stubber.assert_no_pending_responses()
+
+        self.setup_class()
+
+    @mock.patch("boto3.client", client_stub)
+    @mock.patch.dict(os.environ, ENV_VARS)
+    @mock.patch.object(index.JOBS.build(), "worker", None)
+    def test_handler_async_job(self):
+        self.setup_class()
+
+        response = handler(dict(EVENT, httpMethod="POST", path="/jobs"), None)
+        job_id = json.loads(response["body"])["JobId"]
+
+        assert response["statusCode"] == 202
+        assert response["headers"]["Location"] == "jobs/{}".format(job_id)
+
+        poll = {"httpMethod": "GET", "path": "/jobs/{}".format(job_id), "body": None}
+
+        assert json.loads(handler(poll, None)["body"])["Status"] == "QUEUED"
+
+        dynamodb_client_stubber.add_response(
+        method="scan",
+        service_response={"Items": [DYNAMODB["RESPONSE"]["Item"]]},
+        expected_params={"TableName": ENV_VARS["DYNAMODB_TABLE_NAME"]})
+
+        rekognition_client_stubber.add_response(
+        method="detect_labels",
+        service_response=REKOGNITION["RESPONSE"],
+        expected_params=REKOGNITION["EXPECTED_PARAMS"])
+
+        sagemaker_client_stubber.add_response(
+        method="invoke_endpoint",
+        service_response={"Body": BytesIO(b"Test Healthy")},
+        expected_params=SAGEMAKER["EXPECTED_PARAMS"])
+
+        # Delivered twice, like SQS may do, the second delivery is skipped
+        record = {"eventSource": "aws:sqs", "messageId": "1", "body": json.dumps({"JobId": job_id})}
+
+        assert handler({"Records": [record, record]}, None) == {"batchItemFailures": []}
+
+        job = json.loads(handler(poll, None)["body"])
+
+        assert job["Status"] == "SUCCEEDED"
+        assert job["StatusCode"] == 200
+        assert job["Result"]["Name"] == "Test Healthy"
+
+        assert handler(dict(poll, path="/jobs/missing"), None)["statusCode"] == 404
+
+        self.setup_class()
+
+    @mock.patch.dict(os.environ, ENV_VARS)
+    @mock.patch.object(index.JOBS.build(), "worker", None)
+    def test_handler_async_job_rejected(self):
+        submit = {"httpMethod": "POST", "path": "/jobs"}
+
+        assert handler(dict(submit, body="abc"), None)["statusCode"] == 400
+        assert handler(dict(submit, body="[not json"), None)["statusCode"] == 400
+
+        with mock.patch.object(index.JOBS.store, "max_request_bytes", 16):
+            assert handler(dict(submit, body=EVENT["body"]), None)["statusCode"] == 413
+
+    @mock.patch.dict(os.environ, ENV_VARS)
+    @mock.patch.object(index.JOBS.build(), "worker", None)
+    def test_handler_async_job_failures(self):
+        # Queued directly, as the submission would reject the undecodable request
+        invalid, failing = new_job("abc"), new_job(EVENT["body"])
+        records = []
+
+        for message_id, job in enumerate((invalid, failing)):
+            index.JOBS.store.put(job)
+            records.append({"eventSource": "aws:sqs", "messageId": str(message_id),
+                            "body": json.dumps({"JobId": job["JobId"]})})
+
+        records.append({"eventSource": "aws:sqs", "messageId": "malformed", "body": "not json"})
+
+        def handle_request(event, context):
+            # The undecodable request is rejected before any remote call
+            if event["body"] == "abc":
+                return original_handle_request(event, context)
+
+            raise RuntimeError()
+
+        original_handle_request = index.handle_request
+
+        with mock.patch.object(index, "handle_request", side_effect=handle_request):
+            response = handler({"Records": records}, None)
+
+        # Only the job that may succeed on a redelivery is reported
+        assert response == {"batchItemFailures": [{"itemIdentifier": "1"}]}
+
+        invalid, failing = index.JOBS.store.get(invalid["JobId"]), index.JOBS.store.get(failing["JobId"])
+
+        assert (invalid["Status"], invalid["StatusCode"], "Request" in invalid) == ("FAILED", 400, False)
+        assert (failing["Status"], failing["StatusCode"], "Request" in failing) == ("FAILED", 500, True)
+
+    @mock.patch.dict(os.environ, ENV_VARS)
+    @mock.patch.object(jobs, "IN_LAMBDA", True)
+    @mock.patch.object(jobs, "JOB_QUEUE_URL", None)
+    @mock.patch.object(index, "JOBS", JobBackend(lambda: None, lambda: None, index.process_job))
+    def test_handler_async_job_not_configured(self):
+        assert handler(dict(EVENT, httpMethod="POST", path="/jobs"), None)["statusCode"] == 503
+        assert handler({"httpMethod": "GET", "path": "/jobs/1", "body": None}, None)["statusCode"] == 503
+
+        # The synchronous API does not depend on the job settings
+        assert handler({"body": "abc"}, None)["statusCode"] == 400
+
+    @mock.patch("boto3.client", client_stub)
+    @mock.patch.dict(os.environ, ENV_VARS)
+    def test_handler_compressed_and_not_modified(self):
+        self.setup_class()
+
+        dynamodb_client_stubber.add_response(
+        method="scan",
+        service_response={"Items": [DYNAMODB["RESPONSE"]["Item"]]},
+        expected_params={"TableName": ENV_VARS["DYNAMODB_TABLE_NAME"]})
+
+        rekognition_client_stubber.add_response(
+        method="detect_labels",
+        service_response=REKOGNITION["RESPONSE"],
+        expected_params=REKOGNITION["EXPECTED_PARAMS"])
+
+        sagemaker_client_stubber.add_response(
+        method="invoke_endpoint",
+        service_response={"Body": BytesIO(b"Test Healthy")},
+        expected_params=SAGEMAKER["EXPECTED_PARAMS"])
+
+        with mock.patch.object(responses, "COMPRESSION_MIN_BYTES", 0):
+            response = handler(dict(EVENT, headers={"Accept-Encoding": "gzip, deflate"}), None)
+
+        assert response["statusCode"] == 200
+        assert response["isBase64Encoded"] is True
+        assert response["headers"]["Content-Encoding"] == "gzip"
+        assert json.loads(gzip.decompress(base64.b64decode(response["body"])))["Name"] == "Test Healthy"
+
+        # Served from the prediction cache and the rendered bodies, without any AWS call
+        etag = response["headers"]["ETag"]
+        response = handler(dict(EVENT, httpMethod="GET", headers={"if-none-match": etag}), None)
+
+        assert response["statusCode"] == 304
+        assert response["body"] == ""
+
+        # Conditional requests with any other method fail their precondition
+        response = handler(dict(EVENT, httpMethod="POST", headers={"if-none-match": etag}), None)
+
+        assert response["statusCode"] == 412
+
+        self.setup_class()
+
+    @mock.patch("boto3.client", client_stub)
+    @mock.patch.dict(os.environ, ENV_VARS)
+    @mock.patch.object(index, "PIPELINE_MODE", "concurrent")
+    def test_handler_concurrent_healthy(self):
+        self.setup_class()
+
+        rekognition_client_stubber.add_response(
+        method="detect_labels",
+        service_response=REKOGNITION["RESPONSE"],
+        expected_params=REKOGNITION["EXPECTED_PARAMS"])
+
+        sagemaker_client_stubber.add_response(
+        method="invoke_endpoint",
+        service_response={"Body": BytesIO(b"Test Healthy")},
+        expected_params=SAGEMAKER["EXPECTED_PARAMS"])
+
+        dynamodb_client_stubber.add_response(
+        method="scan",
+        service_response={"Items": [DYNAMODB["RESPONSE"]["Item"]]},
+        expected_params={"TableName": ENV_VARS["DYNAMODB_TABLE_NAME"]})
+
+        response = handler(EVENT, None)
+
+        assert response["statusCode"] == 200
+        assert json.loads(response["body"])["Name"] == "Test Healthy"
+
+    @mock.patch("boto3.client", client_stub)
+    @mock.patch.dict(os.environ, ENV_VARS)
+    @mock.patch.object(index, "PIPELINE_MODE", "concurrent")
+    def test_handler_concurrent_not_plant(self):
+        self.setup_class()
+
+        rekognition_client_stubber.add_response(
+        method="detect_labels",
+        service_response=REKOGNITION["NOT_PLANT_RESPONSE"],
+        expected_params=REKOGNITION["EXPECTED_PARAMS"])
+
+        # Waits for the discarded inference, it has no stubbed response and fails
+        with ThreadPoolExecutor(max_workers=1) as executor, mock.patch.object(index, "EXECUTOR", executor):
+            response = handler(EVENT, None)
+
+        assert response["statusCode"] == 200
+        assert "not a plant" in json.loads(response["body"])
+
+    @mock.patch("boto3.client", client_stub)
+    @mock.patch.dict(os.environ, ENV_VARS)
+    @mock.patch.object(index, "PIPELINE_MODE", "concurrent")
+    def test_handler_concurrent_discarded_inference(self):
+        self.setup_class()
+
+        rekognition_client_stubber.add_response(
+        method="detect_labels",
+        service_response=REKOGNITION["NOT_PLANT_RESPONSE"],
+        expected_params=REKOGNITION["EXPECTED_PARAMS"])
+
+        body = BytesIO(b"Test Healthy")
+        sagemaker_client_stubber.add_response(
+        method="invoke_endpoint",
+        service_response={"Body": body},
+        expected_params=SAGEMAKER["EXPECTED_PARAMS"])
+
+        # Holds the inference until the request is answered and the next one began
+        release = threading.Event()
+        event_name = "before-parameter-build.sagemaker-runtime.InvokeEndpoint"
+        sagemaker_client.meta.events.register(event_name, lambda **kwargs: release.wait(5))
+        breaker_calls = len(index.SAGEMAKER_DEPENDENCY.breaker._calls)
+
+        try:
+            with ThreadPoolExecutor(max_workers=1) as executor, mock.patch.object(index, "EXECUTOR", executor):
+                response = handler(EVENT, None)
+
+                index.METRICS.begin()
+                index.DEADLINE.begin(None)
+                release.set()
+        finally:
+            sagemaker_client.meta.events.unregister(event_name)
+
+        assert response["statusCode"] == 200
+        sagemaker_client_stubber.assert_no_pending_responses()
+        assert body.closed
+
+        # The late inference records nothing into the next request
+        with mock.patch.object(index.METRICS, "write"):
+            assert "SageMakerMs" not in index.METRICS.emit()
+        assert index.DEADLINE.summary()["Stages"] == []
+        assert len(index.SAGEMAKER_DEPENDENCY.breaker._calls) == breaker_calls
+
+    @mock.patch("boto3.client", client_stub)
+    @mock.patch.dict(os.environ, ENV_VARS)
+    @mock.patch.object(index, "PIPELINE_MODE", "concurrent")
+    def test_handler_concurrent_sagemaker_error(self):
+        self.setup_class()
+
+        rekognition_client_stubber.add_response(
+        method="detect_labels",
+        service_response=REKOGNITION["RESPONSE"],
+        expected_params=REKOGNITION["EXPECTED_PARAMS"])
+
+        sagemaker_client_stubber.add_client_error(
+        method="invoke_endpoint",
+        service_error_code="TestError")
+
+        response = handler(EVENT, None)
+
+        assert response["statusCode"] == 502
+
+    @mock.patch("boto3.client", client_stub)
+    @mock.patch.dict(os.environ, ENV_VARS)
+    def test_handler_prediction_cache_hit(self):
+        self.setup_class()
+
+        rekognition_client_stubber.add_response(
+        method="detect_labels",
+        service_response=REKOGNITION["NOT_PLANT_RESPONSE"],
+        expected_params=REKOGNITION["EXPECTED_PARAMS"])
+
+        first_response = handler(EVENT, None)
+        second_response = handler(EVENT, None)
+
+        # The second upload of the same image is answered from the cache
+        assert first_response == second_response
+        assert PREDICTION_CACHE.stats()["Hits"]["memory"] == 1
+        rekognition_client_stubber.assert_no_pending_responses()
+
+    @mock.patch("boto3.client", client_stub)
+    @mock.patch.dict(os.environ, ENV_VARS)
+    def test_handler_batch(self):
+        self.setup_class()
+
+        # Plant, not a plant, a failed plant check and a file that is not an image, in that order
+        not_plant, rekognition_error = encoded_image((0, 128, 0)), encoded_image((128, 0, 0))
+        event = {"body": json.dumps([EVENT["body"],
+                                     base64.b64encode(not_plant).decode("utf-8"),
+                                     base64.b64encode(rekognition_error).decode("utf-8"),
+                                     base64.b64encode(b"not an image").decode("utf-8")])}
+
+        rekognition_client_stubber.add_response(
+        method="detect_labels",
+        service_response=REKOGNITION["RESPONSE"],
+        expected_params=REKOGNITION["EXPECTED_PARAMS"])
+
+        rekognition_client_stubber.add_response(
+        method="detect_labels",
+        service_response=REKOGNITION["NOT_PLANT_RESPONSE"],
+        expected_params={"Image": {"Bytes": not_plant}, "MaxLabels": 10})
+
+        rekognition_client_stubber.add_client_error(
+        method="detect_labels",
+        service_error_code="TestError")
+
+        sagemaker_client_stubber.add_response(
+        method="invoke_endpoint",
+        service_response={"Body": BytesIO(json.dumps(["Test Healthy"]).encode("utf-8"))},
+        expected_params={"EndpointName": ENV_VARS["SAGEMAKER_INFERENCE_ENDPOINT"], "Body": ANY,
+                         "ContentType": "application/json", "Accept": "application/json"})
+
+        dynamodb_client_stubber.add_response(
+        method="scan",
+        service_response={"Items": []},
+        expected_params={"TableName": ENV_VARS["DYNAMODB_TABLE_NAME"]})
+
+        dynamodb_client_stubber.add_response(
+        method="batch_get_item",
+        service_response={"Responses": {ENV_VARS["DYNAMODB_TABLE_NAME"]: [DYNAMODB["RESPONSE"]["Item"]]}},
+        expected_params={"RequestItems": {ENV_VARS["DYNAMODB_TABLE_NAME"]:
+                                          {"Keys": [DYNAMODB["EXPECTED_PARAMS"]["Key"]]}}})
+
+        # A single worker keeps the plant checks in request order
+        with ThreadPoolExecutor(max_workers=1) as executor, mock.patch.object(index, "EXECUTOR", executor):
+            response = handler(event, None)
+
+        assert response["statusCode"] == 200
+        assert json.loads(response["body"]) == [
+            parse_dynamodb_response(DYNAMODB["RESPONSE"]["Item"]),
+            {"Error": "Uploaded image is not a plant/leaf. Please use a different image."},
+            {"Error": "Request could not be processed"},
+            {"Error": "Uploaded file is not a readable image"}
+        ]
+
+    @mock.patch("boto3.client", client_stub)
+    @mock.patch.dict(os.environ, ENV_VARS)
+    def test_handler_rejects_invalid_image(self):
+        self.setup_class()
+
+        # No stubbed responses, any remote call would fail the test
+        unreadable = {"body": base64.b64encode(b"not an image").decode("utf-8")}
+        unsupported = {"body": base64.b64encode(encoded_image((0, 128, 0), "GIF")).decode("utf-8")}
+
+        # A 1 bit image of 81 megapixels compresses to a few kilobytes
+        buffer = BytesIO()
+        Image.new("1", (9000, 9000)).save(buffer, format="PNG")
+        bomb = {"body": base64.b64encode(buffer.getvalue()).decode("utf-8")}
+
+        with mock.patch.object(index.METRICS, "write") as write:
+            assert handler(unreadable, None)["statusCode"] == 400
+            assert handler(unsupported, None)["statusCode"] == 415
+            assert handler(bomb, None)["statusCode"] == 413
+
+        rejections = [{key for key in json.loads(call[0][0]) if key.startswith("ImageRejected")}
+                      for call in write.call_args_list]
+
+        assert rejections == [{"ImageRejectedUnreadable"}, {"ImageRejectedUnsupportedFormat"},
+                              {"ImageRejectedTooManyPixels"}]
+
+    @mock.patch("boto3.client", client_stub)
+    @mock.patch.dict(os.environ, ENV_VARS)
+    def test_handler_rejects_undecodable_body(self):
+        self.setup_class()
+
+        # No stubbed responses, any remote call would fail the test
+        not_base64 = {"body": "abc"}
+        missing = {"body": None}
+        # Raw binary uploads are not UTF-8 once API Gateway decodes them
+        binary = {"body": base64.b64encode(b"\xff\xd8\xff\xe0").decode("utf-8"), "isBase64Encoded": True}
+
+        with mock.patch.object(index.METRICS, "write") as write:
+            for event in (not_base64, missing, binary):
+                response = handler(event, None)
+
+                assert response["statusCode"] == 400
+                assert json.loads(response["body"]) == "Image must be base64 encoded"
+
+        assert [json.loads(call[0][0]).get("ImageRejectedNotBase64") for call in write.call_args_list] == [1, 1, 1]
+
+    @mock.patch("boto3.client", client_stub)
+    @mock.patch.dict(os.environ, ENV_VARS)
+    def test_handler_batch_malformed(self):
+        self.setup_class()
+
+        assert handler({"body": "[not json"}, None)["statusCode"] == 400
+
+        dynamodb_client_stubber.add_response(
+        method="scan",
+        service_response={"Items": []},
+        expected_params={"TableName": ENV_VARS["DYNAMODB_TABLE_NAME"]})
+
+        # Neither Rekognition nor SageMaker is stubbed, the undecodable items are answered alone
+        response = handler({"body": json.dumps(["abc", 1])}, None)
+
+        assert response["statusCode"] == 200
+        assert json.loads(response["body"]) == [{"Error": "Image must be base64 encoded"}] * 2
+
+        self.setup_class()
+
+    @mock.patch.dict(os.environ, ENV_VARS)
+    def test_handler_batch_too_large(self):
+        event = {"body": json.dumps([EVENT["body"]] * (index.BATCH_MAX_IMAGES + 1))}
+
+        assert handler(event, None)["statusCode"] == 400
+
+    @mock.patch("boto3.client", client_stub)
+    @mock.patch.dict(os.environ, ENV_VARS)
+    @mock.patch.object(index, "PIPELINE_MODE", "gated")
+    def test_handler_gated_skips_rekognition(self):
+        self.setup_class()
+        skipped = index.GATE_STATS["Skipped"]
+
+        sagemaker_client_stubber.add_response(
+        method="invoke_endpoint",
+        service_response={"Body": BytesIO(json.dumps(
+            {"label": "Test Healthy", "top_k": [{"label": "Test Healthy", "probability": 0.99}]}).encode("utf-8"))},
+        expected_params=dict(SAGEMAKER["EXPECTED_PARAMS"], Accept=index.TOP_K_CONTENT_TYPE))
+
+        dynamodb_client_stubber.add_response(
+        method="scan",
+        service_response={"Items": [DYNAMODB["RESPONSE"]["Item"]]},
+        expected_params={"TableName": ENV_VARS["DYNAMODB_TABLE_NAME"]})
+
+        with mock.patch.object(index.METRICS, "write") as write:
+            response = handler(EVENT, None)
+
+        assert response["statusCode"] == 200
+        assert json.loads(response["body"])["Name"] == "Test Healthy"
+        assert index.GATE_STATS["Skipped"] == skipped + 1
+        assert json.loads(write.call_args[0][0])["RekognitionSkipped"] == 1
+
+    @mock.patch("boto3.client", client_stub)
+    @mock.patch.dict(os.environ, ENV_VARS)
+    @mock.patch.object(index, "PIPELINE_MODE", "gated")
+    def test_handler_gated_checks_unsure_prediction(self):
+        self.setup_class()
+        checked = index.GATE_STATS["Checked"]
+
+        sagemaker_client_stubber.add_response(
+        method="invoke_endpoint",
+        service_response={"Body": BytesIO(json.dumps(
+            {"label": "Test Healthy", "top_k": [{"label": "Test Healthy", "probability": 0.4}]}).encode("utf-8"))},
+        expected_params=dict(SAGEMAKER["EXPECTED_PARAMS"], Accept=index.TOP_K_CONTENT_TYPE))
+
+        rekognition_client_stubber.add_response(
+        method="detect_labels",
+        service_response=REKOGNITION["NOT_PLANT_RESPONSE"],
+        expected_params=REKOGNITION["EXPECTED_PARAMS"])
+
+        with mock.patch.object(index.METRICS, "write") as write:
+            response = handler(EVENT, None)
+
+        assert "not a plant" in json.loads(response["body"])
+        assert index.GATE_STATS["Checked"] == checked + 1
+        assert json.loads(write.call_args[0][0])["RekognitionSkipped"] == 0
+
+    def test_detect_labels_injected_client(self):
+        self.setup_class()
+
+        rekognition_client_stubber.add_response(
+        method="detect_labels",
+        service_response=REKOGNITION["RESPONSE"],
+        expected_params=REKOGNITION["EXPECTED_PARAMS"])
+
+        with mock.patch("boto3.client") as boto3_client:
+            detected_labels = detect_labels(REKOGNITION["EXPECTED_PARAMS"]["Image"]["Bytes"], rekognition_client)
+
+        boto3_client.assert_not_called()
+        assert detected_labels == ["Plant", "Leaf", "Agriculture"]
+
 
 rekognition_client2 = boto3.client("rekognition", region_name="eu-central-1")
 rekognition_client_stubber2 = Stubber(rekognition_client)
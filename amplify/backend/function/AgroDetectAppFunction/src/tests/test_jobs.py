@@ -0,0 +1,153 @@
+import io
+import json
+import threading
+from unittest import mock
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+# pylint: disable=E0402
+from .. import jobs
+from ..jobs import (FAILED, QUEUED, SUCCEEDED, DynamoDBJobStore, JobBackend, LocalWorker,
+                    MemoryJobStore, MemoryQueue, SQLiteJobStore, SQLiteQueue,
+                    build_job_queue, build_job_store, complete_job, get_job_ids,
+                    is_queue_event, new_job)
+
+
+class TestJobs:
+    def test_new_and_complete_job(self):
+        job = new_job("VGVzdA==")
+
+        assert job["Status"] == QUEUED
+
+        completed = complete_job(job, {"statusCode": 200, "body": json.dumps({"Name": "Test Healthy"})})
+
+        assert completed["Status"] == SUCCEEDED
+        assert completed["Result"] == {"Name": "Test Healthy"}
+        assert "Request" not in completed
+        assert complete_job(job, {"statusCode": 502, "body": "\"Error\""})["Status"] == FAILED
+        assert complete_job(job, {"statusCode": 400, "body": "\"Error\""})["Status"] == FAILED
+        assert complete_job(job, {"statusCode": 500, "body": "\"Error\""}, keep_request=True)["Request"] == "VGVzdA=="
+
+    @mock.patch.object(jobs, "IN_LAMBDA", True)
+    @mock.patch.object(jobs, "JOB_QUEUE_URL", None)
+    @mock.patch.object(jobs, "JOB_TABLE_NAME", None)
+    def test_no_local_fallback_in_lambda(self):
+        # Every container would have its own jobs
+        with pytest.raises(RuntimeError):
+            build_job_queue(lambda: None)
+
+        with pytest.raises(RuntimeError):
+            build_job_store(lambda: None)
+
+    def test_backend_built_on_first_use(self):
+        backend = JobBackend(lambda: None, lambda: None, lambda job_id: None)
+
+        with mock.patch.object(jobs, "IN_LAMBDA", True), mock.patch.object(jobs, "JOB_QUEUE_URL", None):
+            with pytest.raises(RuntimeError):
+                backend.build()
+
+        assert backend.store is None
+        assert backend.build() is backend
+        assert isinstance(backend.queue, MemoryQueue) and isinstance(backend.worker, LocalWorker)
+
+        store = backend.store
+
+        assert backend.build().store is store
+
+    def test_stores(self, tmp_path):
+        for store in (MemoryJobStore(), SQLiteJobStore(str(tmp_path / "jobs.db"))):
+            job = new_job("VGVzdA==")
+            store.put(job)
+
+            assert store.get(job["JobId"]) == job
+            assert store.get("missing") is None
+
+            store.put(dict(job, ExpiresAt=0))
+
+            assert store.get(job["JobId"]) is None
+
+    def test_dynamodb_store(self):
+        dynamodb_client = boto3.client("dynamodb", region_name="eu-central-1")
+        store = DynamoDBJobStore("TEST_JOBS", dynamodb_client)
+        job = new_job("VGVzdA==")
+
+        item = {
+            "JobId": {"S": job["JobId"]},
+            "ExpiresAt": {"N": str(job["ExpiresAt"])},
+            "Record": {"S": json.dumps({key: value for key, value in job.items() if key != "Request"})},
+            "Request": {"S": "VGVzdA=="}
+        }
+
+        with Stubber(dynamodb_client) as stubber:
+            stubber.add_response("put_item", {}, {"TableName": "TEST_JOBS", "Item": item})
+            stubber.add_response("get_item", {"Item": item},
+                                 {"TableName": "TEST_JOBS", "Key": {"JobId": {"S": job["JobId"]}}, "ConsistentRead": True})
+
+            store.put(job)
+
+            assert store.get(job["JobId"]) == job
+
+    def test_dynamodb_store_large_request(self):
+        dynamodb_client = boto3.client("dynamodb", region_name="eu-central-1")
+        s3_client = boto3.client("s3", region_name="eu-central-1")
+        store = DynamoDBJobStore("TEST_JOBS", dynamodb_client, "test-jobs", s3_client)
+        # A phone photo, larger than a job item
+        job = new_job("A" * (store.max_item_request_bytes + 1))
+        request_key = "jobs/{}".format(job["JobId"])
+
+        item = {
+            "JobId": {"S": job["JobId"]},
+            "ExpiresAt": {"N": str(job["ExpiresAt"])},
+            "Record": {"S": json.dumps({key: value for key, value in job.items() if key != "Request"})},
+            "RequestKey": {"S": request_key}
+        }
+
+        assert store.max_request_bytes is None
+
+        with Stubber(dynamodb_client) as dynamodb_stubber, Stubber(s3_client) as s3_stubber:
+            s3_stubber.add_response("put_object", {},
+                                    {"Bucket": "test-jobs", "Key": request_key, "Body": job["Request"].encode("utf-8")})
+            dynamodb_stubber.add_response("put_item", {}, {"TableName": "TEST_JOBS", "Item": item})
+            dynamodb_stubber.add_response("get_item", {"Item": item}, {
+                "TableName": "TEST_JOBS", "Key": {"JobId": {"S": job["JobId"]}}, "ConsistentRead": True})
+            s3_stubber.add_response("get_object", {"Body": io.BytesIO(job["Request"].encode("utf-8"))},
+                                    {"Bucket": "test-jobs", "Key": request_key})
+
+            store.put(job)
+
+            assert store.get(job["JobId"]) == job
+
+    def test_queues(self, tmp_path):
+        for job_queue in (MemoryQueue(), SQLiteQueue(str(tmp_path / "jobs.db"), poll_interval=0.01)):
+            job_queue.send("a")
+            job_queue.send("b")
+
+            assert [job_queue.receive(0), job_queue.receive(0), job_queue.receive(0.01)] == ["a", "b", None]
+
+    def test_local_worker(self):
+        job_queue = MemoryQueue()
+        processed = []
+        done = threading.Event()
+
+        def process(job_id):
+            processed.append(job_id)
+            done.set()
+
+        worker = LocalWorker(job_queue, process, wait=0.01)
+        worker.start()
+        job_queue.send("a")
+
+        assert done.wait(5)
+
+        worker.stop()
+
+        assert processed == ["a"]
+
+    def test_queue_event(self):
+        event = {"Records": [{"eventSource": "aws:sqs", "messageId": "1", "body": json.dumps({"JobId": "a"})}]}
+
+        assert is_queue_event(event)
+        assert not is_queue_event({"body": "VGVzdA=="})
+        assert get_job_ids(event) == ["a"]
@@ -0,0 +1,105 @@
+import json
+
+import boto3
+from botocore.stub import Stubber
+
+# pylint: disable=E0402
+from ..index import parse_dynamodb_response
+from ..knowledge_base import KnowledgeBase, compute_version
+from .payload import DYNAMODB, ENV_VARS
+
+API_RESPONSE: dict = {
+    "Name": "Test Healthy",
+    "Description": "",
+    "isDisease": False,
+    "Treatments": [],
+    "Products": []
+}
+
+
+class TestKnowledgeBase:
+    def setup_method(self):
+        self.dynamodb_client = boto3.client("dynamodb", region_name="eu-central-1")
+        self.stubber = Stubber(self.dynamodb_client)
+        self.stubber.activate()
+
+    def teardown_method(self):
+        self.stubber.deactivate()
+
+    def test_load_from_scan(self):
+        self.stubber.add_response(
+        method="scan",
+        service_response={"Items": [DYNAMODB["RESPONSE"]["Item"]]},
+        expected_params={"TableName": ENV_VARS["DYNAMODB_TABLE_NAME"]})
+
+        knowledge_base = KnowledgeBase(parse_dynamodb_response, snapshot_path=None)
+        knowledge_base.refresh(ENV_VARS["DYNAMODB_TABLE_NAME"], self.dynamodb_client)
+
+        assert knowledge_base.get("Test Healthy") == API_RESPONSE
+        assert knowledge_base.get("Unknown") is None
+        assert knowledge_base.version == compute_version({"Test Healthy": API_RESPONSE})
+        self.stubber.assert_no_pending_responses()
+
+    def test_load_from_snapshot(self, tmp_path):
+        snapshot_path = tmp_path / "knowledge_base.json"
+        snapshot_path.write_text(json.dumps({"Version": "1", "Items": {"Test Healthy": API_RESPONSE}}))
+
+        knowledge_base = KnowledgeBase(parse_dynamodb_response, snapshot_path=str(snapshot_path))
+        knowledge_base.refresh(ENV_VARS["DYNAMODB_TABLE_NAME"], self.dynamodb_client)
+
+        assert knowledge_base.get("Test Healthy") == API_RESPONSE
+        assert knowledge_base.version == "1"
+
+    def test_refresh_after_snapshot_from_scan(self, tmp_path):
+        snapshot_path = tmp_path / "knowledge_base.json"
+        snapshot_path.write_text(json.dumps({"Version": "1", "Items": {}}))
+
+        self.stubber.add_response(
+        method="scan",
+        service_response={"Items": [DYNAMODB["RESPONSE"]["Item"]]},
+        expected_params={"TableName": ENV_VARS["DYNAMODB_TABLE_NAME"]})
+
+        # The snapshot is only read on cold start, the table may have changed since the deployment
+        knowledge_base = KnowledgeBase(parse_dynamodb_response, ttl=-1, snapshot_path=str(snapshot_path))
+        knowledge_base.refresh(ENV_VARS["DYNAMODB_TABLE_NAME"], self.dynamodb_client)
+        knowledge_base.refresh(ENV_VARS["DYNAMODB_TABLE_NAME"], self.dynamodb_client)
+
+        assert knowledge_base.get("Test Healthy") == API_RESPONSE
+        assert knowledge_base.version == compute_version({"Test Healthy": API_RESPONSE})
+        self.stubber.assert_no_pending_responses()
+
+    def test_refresh_only_when_stale(self):
+        self.stubber.add_response(
+        method="scan",
+        service_response={"Items": []},
+        expected_params={"TableName": ENV_VARS["DYNAMODB_TABLE_NAME"]})
+
+        knowledge_base = KnowledgeBase(parse_dynamodb_response, snapshot_path=None)
+        knowledge_base.refresh(ENV_VARS["DYNAMODB_TABLE_NAME"], self.dynamodb_client)
+        knowledge_base.refresh(ENV_VARS["DYNAMODB_TABLE_NAME"], self.dynamodb_client)
+
+        assert knowledge_base.is_stale() is False
+        self.stubber.assert_no_pending_responses()
+
+    def test_refresh_after_ttl(self):
+        knowledge_base = KnowledgeBase(parse_dynamodb_response, ttl=-1, snapshot_path=None)
+
+        for _ in range(2):
+            self.stubber.add_response(
+            method="scan",
+            service_response={"Items": []},
+            expected_params={"TableName": ENV_VARS["DYNAMODB_TABLE_NAME"]})
+
+            knowledge_base.refresh(ENV_VARS["DYNAMODB_TABLE_NAME"], self.dynamodb_client)
+
+        self.stubber.assert_no_pending_responses()
+
+    def test_refresh_error_keeps_items(self):
+        self.stubber.add_client_error(method="scan", service_error_code="TestError")
+
+        knowledge_base = KnowledgeBase(parse_dynamodb_response, snapshot_path=None)
+        knowledge_base.put("Test Healthy", API_RESPONSE)
+        knowledge_base.refresh(ENV_VARS["DYNAMODB_TABLE_NAME"], self.dynamodb_client)
+
+        assert knowledge_base.get("Test Healthy") == API_RESPONSE
+        assert knowledge_base.is_stale() is False
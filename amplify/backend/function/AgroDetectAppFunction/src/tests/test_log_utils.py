@@ -0,0 +1,47 @@
+import json
+import logging
+from unittest import mock
+
+# pylint: disable=E0402
+from ..log_utils import Fields, PayloadSampler, summarize_event
+from .payload import EVENT
+
+
+class TestLogUtils:
+    def test_fields_serialized_on_str(self):
+        fields = Fields(Name="Test", Count=2)
+
+        with mock.patch("json.dumps") as dumps:
+            logging.getLogger("disabled").debug("%s", fields)
+
+        dumps.assert_not_called()
+        assert json.loads(str(fields)) == {"Name": "Test", "Count": 2}
+
+    def test_summarize_event_has_no_body(self):
+        event = dict(EVENT, requestContext={"requestId": "test-id"}, httpMethod="POST", path="/inference")
+
+        summary = json.loads(str(summarize_event(event)))
+
+        assert summary == {"RequestId": "test-id", "Method": "POST", "Path": "/inference",
+                           "BodyBytes": len(EVENT["body"])}
+        assert EVENT["body"] not in str(summarize_event(event))
+
+    def test_sampler_disabled(self):
+        sampler = PayloadSampler(rate=0, draw=lambda: 0.0)
+        logger = mock.Mock()
+
+        assert sampler.next_request() is False
+        sampler.capture(logger, "event", EVENT)
+        logger.info.assert_not_called()
+
+    def test_sampler_one_in_n(self):
+        draws = iter([0.05, 0.5])
+        sampler = PayloadSampler(rate=10, draw=lambda: next(draws))
+        logger = mock.Mock()
+
+        assert sampler.next_request() is True
+        sampler.capture(logger, "event", EVENT)
+        assert sampler.next_request() is False
+        sampler.capture(logger, "event", EVENT)
+
+        logger.info.assert_called_once()
@@ -0,0 +1,66 @@
+import json
+from unittest import mock
+
+import pytest
+
+# pylint: disable=E0402
+from ..metrics import Metrics
+
+
+class TestMetrics:
+    def test_emit_embedded_metric_format(self):
+        write = mock.Mock()
+        metrics = Metrics(namespace="Test", function_name="test-function", write=write)
+
+        metrics.begin()
+        metrics.put_metric("ImageBytes", 1024, "Bytes")
+        metrics.put_property("StatusCode", 200)
+        document = metrics.emit()
+
+        assert json.loads(write.call_args[0][0]) == document
+        assert document["_aws"]["CloudWatchMetrics"] == [{
+            "Namespace": "Test",
+            "Dimensions": [["FunctionName", "ColdStart"]],
+            "Metrics": [{"Name": "ImageBytes", "Unit": "Bytes"}]
+        }]
+        assert document["FunctionName"] == "test-function"
+        assert document["ImageBytes"] == 1024
+        assert document["StatusCode"] == 200
+
+    def test_cold_start_only_first_invocation(self):
+        metrics = Metrics(write=mock.Mock())
+
+        assert metrics.emit()["ColdStart"] == "true"
+        assert metrics.emit()["ColdStart"] == "false"
+
+    def test_begin_drops_previous_values(self):
+        metrics = Metrics(write=mock.Mock())
+
+        metrics.put_metric("Stale", 1)
+        metrics.begin()
+
+        assert "Stale" not in metrics.emit()
+
+    def test_timed_keeps_every_call(self):
+        metrics = Metrics(write=mock.Mock())
+
+        @metrics.timed("Stage")
+        def stage(value):
+            return value
+
+        assert stage(1) == 1
+        assert stage(2) == 2
+
+        document = metrics.emit()
+
+        assert len(document["StageMs"]) == 2
+        assert {"Name": "StageMs", "Unit": "Milliseconds"} in document["_aws"]["CloudWatchMetrics"][0]["Metrics"]
+
+    def test_stage_recorded_on_error(self):
+        metrics = Metrics(write=mock.Mock())
+
+        with pytest.raises(ValueError):
+            with metrics.stage("Failing"):
+                raise ValueError()
+
+        assert metrics.emit()["FailingMs"] >= 0
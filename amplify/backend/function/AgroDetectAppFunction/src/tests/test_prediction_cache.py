@@ -0,0 +1,165 @@
+import time
+from unittest import mock
+
+import boto3
+import botocore
+from botocore.stub import ANY, Stubber
+
+# pylint: disable=E0402
+from ..prediction_cache import (DynamoDBBackend, LRUBackend, PredictionCache,
+                                image_key)
+
+PLANT: dict = {"IsPlant": True, "Label": "Test Healthy"}
+NOT_PLANT: dict = {"IsPlant": False, "Label": None}
+
+
+class TestLRUBackend:
+    def test_get_put(self):
+        backend = LRUBackend(max_size=2, ttl=60)
+        backend.put("a", PLANT)
+
+        assert backend.get("a") == PLANT
+        assert backend.get("b") is None
+
+    def test_evicts_least_recently_used(self):
+        backend = LRUBackend(max_size=2, ttl=60)
+        backend.put("a", PLANT)
+        backend.put("b", PLANT)
+        backend.get("a")
+        backend.put("c", PLANT)
+
+        assert backend.get("b") is None
+        assert backend.get("a") == PLANT
+        assert len(backend) == 2
+
+    def test_expired_entry(self):
+        backend = LRUBackend(max_size=2, ttl=60)
+        backend.put("a", PLANT)
+
+        with mock.patch("time.monotonic", return_value=time.monotonic() + 61):
+            assert backend.get("a") is None
+
+        assert len(backend) == 0
+
+
+class TestDynamoDBBackend:
+    def setup_method(self):
+        self.dynamodb_client = boto3.client("dynamodb", region_name="eu-central-1")
+        self.stubber = Stubber(self.dynamodb_client)
+        self.stubber.activate()
+        self.backend = DynamoDBBackend("TEST_CACHE", self.dynamodb_client, ttl=60)
+
+    def teardown_method(self):
+        self.stubber.deactivate()
+
+    def test_get_hit(self):
+        self.stubber.add_response(
+        method="get_item",
+        service_response={"Item": {"ImageHash": {"S": "a"},
+                                   "IsPlant": {"BOOL": True},
+                                   "Label": {"S": "Test Healthy"},
+                                   "ExpiresAt": {"N": str(int(time.time()) + 60)}}},
+        expected_params={"TableName": "TEST_CACHE", "Key": {"ImageHash": {"S": "a"}}})
+
+        assert self.backend.get("a") == PLANT
+
+    def test_get_expired(self):
+        self.stubber.add_response(
+        method="get_item",
+        service_response={"Item": {"ImageHash": {"S": "a"},
+                                   "IsPlant": {"BOOL": False},
+                                   "ExpiresAt": {"N": str(int(time.time()) - 1)}}},
+        expected_params={"TableName": "TEST_CACHE", "Key": {"ImageHash": {"S": "a"}}})
+
+        assert self.backend.get("a") is None
+
+    def test_get_error_is_miss(self):
+        self.stubber.add_client_error(method="get_item", service_error_code="TestError")
+
+        assert self.backend.get("a") is None
+
+    def test_timeout_is_ignored(self):
+        timeout = botocore.exceptions.ReadTimeoutError(endpoint_url="https://dynamodb")
+
+        with mock.patch.object(self.dynamodb_client, "get_item", side_effect=timeout), \
+                mock.patch.object(self.dynamodb_client, "put_item", side_effect=timeout):
+            assert self.backend.get("a") is None
+            self.backend.put("a", PLANT)
+
+    def test_get_many(self):
+        self.stubber.add_response(
+        method="batch_get_item",
+        service_response={"Responses": {"TEST_CACHE": [
+            {"ImageHash": {"S": "a"}, "IsPlant": {"BOOL": True}, "Label": {"S": "Test Healthy"},
+             "ExpiresAt": {"N": str(int(time.time()) + 60)}},
+            {"ImageHash": {"S": "b"}, "IsPlant": {"BOOL": False}, "ExpiresAt": {"N": str(int(time.time()) - 1)}}
+        ]}},
+        expected_params={"RequestItems": {"TEST_CACHE": {"Keys": [{"ImageHash": {"S": key}} for key in "abc"]}}})
+
+        # Expired and missing items are misses
+        assert self.backend.get_many(["a", "b", "c"]) == {"a": PLANT}
+        self.stubber.assert_no_pending_responses()
+
+    def test_get_many_error_is_miss(self):
+        self.stubber.add_client_error(method="batch_get_item", service_error_code="TestError")
+
+        assert self.backend.get_many(["a"]) == {}
+
+    def test_put_not_plant(self):
+        self.stubber.add_response(
+        method="put_item",
+        service_response={},
+        expected_params={"TableName": "TEST_CACHE",
+                         "Item": {"ImageHash": {"S": "a"}, "IsPlant": {"BOOL": False}, "ExpiresAt": ANY}})
+
+        self.backend.put("a", NOT_PLANT)
+        self.stubber.assert_no_pending_responses()
+
+
+class TestPredictionCache:
+    def test_counters(self):
+        cache = PredictionCache([LRUBackend()])
+        key = image_key(b"image")
+
+        assert cache.get(key) is None
+        cache.put(key, PLANT)
+        assert cache.get(key) == PLANT
+
+        assert cache.stats() == {"Hits": {"memory": 1}, "Misses": 1, "HitRatio": 0.5}
+
+    def test_promotes_shared_hit(self):
+        memory = LRUBackend()
+        shared = mock.Mock()
+        shared.name = "dynamodb"
+        shared.get.return_value = NOT_PLANT
+
+        cache = PredictionCache([memory, shared])
+
+        assert cache.get("a") == NOT_PLANT
+        assert memory.get("a") == NOT_PLANT
+        assert cache.stats()["Hits"] == {"memory": 0, "dynamodb": 1}
+
+    def test_get_many(self):
+        memory = LRUBackend()
+        memory.put("a", PLANT)
+        shared = mock.Mock()
+        shared.name = "dynamodb"
+        shared.get_many.return_value = {"b": NOT_PLANT}
+
+        cache = PredictionCache([memory, shared])
+
+        assert cache.get_many(["a", "b", "b", "c"]) == {"a": PLANT, "b": NOT_PLANT}
+        # Only the keys missing from memory reach the shared backend, once
+        shared.get_many.assert_called_once_with(["b", "c"])
+        assert memory.get("b") == NOT_PLANT
+        assert cache.stats()["Hits"] == {"memory": 1, "dynamodb": 1}
+        assert cache.stats()["Misses"] == 1
+
+    def test_clear(self):
+        cache = PredictionCache([LRUBackend()])
+        cache.put("a", PLANT)
+        cache.get("a")
+        cache.clear()
+
+        assert cache.get("a") is None
+        assert cache.stats()["Hits"] == {"memory": 0}
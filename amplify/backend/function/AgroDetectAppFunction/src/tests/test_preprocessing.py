@@ -0,0 +1,77 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+# pylint: disable=E0402
+from ..preprocessing import (INFERENCE_IMAGE_SIZE, MAX_IMAGE_BYTES, MIN_IMAGE_SIDE,
+                             REKOGNITION_MAX_SIDE, InvalidImage, prepare_image,
+                             validate_image)
+from .payload import image_bytes
+
+
+def make_image(size, image_format="JPEG"):
+    buffer = BytesIO()
+    Image.effect_noise(size, 64).convert("RGB").save(buffer, format=image_format)
+
+    return buffer.getvalue()
+
+
+class TestPrepareImage:
+    def test_small_image_unchanged(self):
+        prepared = prepare_image(image_bytes)
+
+        assert prepared.rekognition_bytes == image_bytes
+        assert prepared.inference_bytes == image_bytes
+        assert prepared.stats["BytesSaved"] == 0
+
+    def test_large_image_downscaled(self):
+        original = make_image((2 * REKOGNITION_MAX_SIDE, REKOGNITION_MAX_SIDE + 512))
+
+        prepared = prepare_image(original)
+
+        rekognition_image = Image.open(BytesIO(prepared.rekognition_bytes))
+        inference_image = Image.open(BytesIO(prepared.inference_bytes))
+
+        assert rekognition_image.format == "JPEG"
+        assert max(rekognition_image.size) == REKOGNITION_MAX_SIDE
+        assert inference_image.format == "PNG"
+        assert inference_image.size == INFERENCE_IMAGE_SIZE
+        assert prepared.stats["BytesSaved"] > 0
+
+    def test_inference_image_matches_resize(self):
+        original = make_image((600, 600), "PNG")
+
+        prepared = prepare_image(original)
+        expected = Image.open(BytesIO(original)).convert("RGB").resize(INFERENCE_IMAGE_SIZE)
+
+        assert Image.open(BytesIO(prepared.inference_bytes)).tobytes() == expected.tobytes()
+
+    @pytest.mark.parametrize("payload", [b"", b"not an image"])
+    def test_undecodable_image_unchanged(self, payload):
+        prepared = prepare_image(payload)
+
+        assert prepared.rekognition_bytes == payload
+        assert prepared.inference_bytes == payload
+
+
+class TestValidateImage:
+    def test_valid_image(self):
+        header = validate_image(image_bytes)
+
+        assert header.format == "JPEG"
+        assert (header.width, header.height) == Image.open(BytesIO(image_bytes)).size
+
+    @pytest.mark.parametrize("payload, reason, status_code", [
+        (b"", "Unreadable", 400),
+        (b"not an image", "Unreadable", 400),
+        (b"\0" * (MAX_IMAGE_BYTES + 1), "TooLarge", 413),
+        (make_image((64, 64), "BMP"), "UnsupportedFormat", 415),
+        (make_image((MIN_IMAGE_SIDE - 1, 64)), "BadDimensions", 400)
+    ])
+    def test_invalid_image(self, payload, reason, status_code):
+        with pytest.raises(InvalidImage) as error:
+            validate_image(payload)
+
+        assert error.value.reason == reason
+        assert error.value.status_code == status_code
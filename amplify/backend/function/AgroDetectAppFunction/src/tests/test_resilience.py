@@ -0,0 +1,147 @@
+import threading
+
+import botocore
+import pytest
+
+# pylint: disable=E0402
+from ..resilience import (CLOSED, HALF_OPEN, OPEN, CircuitBreaker, ConcurrencyLimiter,
+                          Dependency, DependencyUnavailable, is_failure, retry_after_header)
+
+
+def client_error(code: str, status_code: int) -> botocore.exceptions.ClientError:
+    return botocore.exceptions.ClientError(
+        {"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": status_code}}, "InvokeEndpoint")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestResilience:
+    def test_is_failure(self):
+        assert is_failure(client_error("ThrottlingException", 400))
+        assert is_failure(client_error("InternalFailure", 500))
+        assert is_failure(client_error("ModelError", 424))
+        assert not is_failure(client_error("ValidationError", 400))
+        assert is_failure(botocore.exceptions.ReadTimeoutError(endpoint_url="http://localhost"))
+        assert not is_failure(ValueError())
+
+    def test_circuit_opens_on_errors(self):
+        clock = Clock()
+        breaker = CircuitBreaker("SageMaker", 1000, min_calls=4, error_rate=0.5, open_seconds=10, clock=clock)
+
+        for failed in (False, True, False, True):
+            breaker.allow()
+            breaker.record(10, failed)
+
+        assert breaker.state == OPEN
+
+        clock.now = 4
+
+        with pytest.raises(DependencyUnavailable) as error:
+            breaker.allow()
+
+        assert retry_after_header(error.value) == "6"
+
+    def test_circuit_opens_on_slow_calls(self):
+        breaker = CircuitBreaker("SageMaker", 1000, min_calls=2, slow_call_rate=1.0, clock=Clock())
+
+        for _ in range(2):
+            breaker.record(5000, False)
+
+        assert breaker.state == OPEN
+
+    def test_old_calls_leave_the_window(self):
+        clock = Clock()
+        breaker = CircuitBreaker("SageMaker", 1000, window=30, min_calls=2, error_rate=1.0, clock=clock)
+
+        breaker.record(10, True)
+        clock.now = 31
+        breaker.record(10, True)
+
+        assert breaker.state == CLOSED
+
+    def test_window_keeps_latest_calls(self):
+        breaker = CircuitBreaker("SageMaker", 1000, min_calls=2, error_rate=0.6, window_calls=3, clock=Clock())
+
+        # The early failure leaves the window before the later one is recorded
+        for failed in (True, False, False, False, True):
+            breaker.record(10, failed)
+
+        assert breaker.state == CLOSED
+
+        breaker.record(10, True)
+
+        assert breaker.state == OPEN
+
+    def test_half_open_probe(self):
+        clock = Clock()
+        breaker = CircuitBreaker("SageMaker", 1000, min_calls=1, open_seconds=10, clock=clock)
+
+        breaker.record(10, True)
+        clock.now = 10
+
+        assert breaker.allow() is True
+        assert breaker.state == HALF_OPEN
+
+        # A single probe at a time
+        with pytest.raises(DependencyUnavailable):
+            breaker.allow()
+
+        breaker.record(10, True, probe=True)
+
+        assert breaker.state == OPEN
+
+        clock.now = 20
+        breaker.record(10, False, probe=breaker.allow())
+
+        assert breaker.state == CLOSED
+
+    def test_limiter_sheds(self):
+        limiter = ConcurrencyLimiter("SageMaker", 1)
+        limiter.acquire()
+
+        with pytest.raises(DependencyUnavailable) as error:
+            limiter.acquire()
+
+        assert error.value.reason == "Shed"
+
+        limiter.release()
+        limiter.acquire()
+
+    def test_dependency_guard(self):
+        rejections = []
+        dependency = Dependency(CircuitBreaker("SageMaker", 1000, min_calls=1, clock=Clock()),
+                                ConcurrencyLimiter("SageMaker", 1), rejections.append)
+        entered, release = threading.Event(), threading.Event()
+
+        def slow_call():
+            with dependency.guard():
+                entered.set()
+                release.wait(5)
+
+        thread = threading.Thread(target=slow_call)
+        thread.start()
+        entered.wait(5)
+
+        with pytest.raises(DependencyUnavailable):
+            with dependency.guard():
+                pass
+
+        release.set()
+        thread.join()
+
+        with pytest.raises(botocore.exceptions.ClientError):
+            with dependency.guard():
+                raise client_error("InternalFailure", 500)
+
+        with pytest.raises(DependencyUnavailable):
+            with dependency.guard():
+                pass
+
+        assert [rejection.reason for rejection in rejections] == ["Shed", "CircuitOpen"]
+        assert dependency.limiter.in_flight == 0
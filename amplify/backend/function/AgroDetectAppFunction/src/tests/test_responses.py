@@ -0,0 +1,57 @@
+import gzip
+import json
+
+# pylint: disable=E0402
+from ..responses import (RenderedBody, ResponseCache, choose_encoding, etag_matches,
+                         parse_accept_encoding, render_body)
+
+API_RESPONSE: dict = {
+    "Name": "Test Disease",
+    "Description": "Test Description " * 20,
+    "isDisease": True,
+    "Treatments": [],
+    "Products": []
+}
+
+
+class TestResponses:
+    def test_render_body(self):
+        rendered = render_body(API_RESPONSE)
+
+        assert json.loads(rendered.text) == API_RESPONSE
+        assert gzip.decompress(rendered.encodings["gzip"]).decode("utf-8") == rendered.text
+        assert rendered.etag == render_body(dict(API_RESPONSE)).etag
+        assert rendered.etag_for("gzip") != rendered.etag
+
+    def test_render_body_small(self):
+        assert render_body("Short message").encodings == {}
+
+    def test_parse_accept_encoding(self):
+        assert parse_accept_encoding("gzip, deflate;q=0.5, *;q=0") == {"gzip": 1.0, "deflate": 0.5, "*": 0.0}
+        assert parse_accept_encoding(None) == {}
+
+    def test_choose_encoding(self):
+        rendered = render_body(API_RESPONSE)
+
+        assert choose_encoding(rendered, "gzip, deflate") == "gzip"
+        assert choose_encoding(rendered, "*") == "gzip"
+        assert choose_encoding(rendered, "gzip;q=0, identity") is None
+        assert choose_encoding(rendered, None) is None
+        assert choose_encoding(RenderedBody("\"Short\"", "\"tag\"", {}), "gzip") is None
+
+    def test_etag_matches(self):
+        rendered = render_body(API_RESPONSE)
+
+        assert etag_matches(rendered.etag, rendered)
+        assert etag_matches("\"other\", W/" + rendered.etag_for("gzip"), rendered)
+        assert etag_matches("*", rendered)
+        assert not etag_matches("\"other\"", rendered)
+        assert not etag_matches(None, rendered)
+
+    def test_cache_renders_once_per_version(self):
+        cache = ResponseCache()
+
+        rendered = cache.get("Test Disease", API_RESPONSE, "v1")
+
+        assert cache.get("Test Disease", None, "v1") is rendered
+        assert cache.get("Test Disease", dict(API_RESPONSE, Products=[{"A": "B"}]), "v2") is not rendered
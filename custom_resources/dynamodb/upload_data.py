@@ -1,40 +1,309 @@
+import argparse
+import base64
+import hashlib
 import json
 import os
+import random
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 import boto3
 import botocore
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.config import Config
 
 TABLE_NAME = "DataTable"
 DATA_DIRECTORY = r'C:\Users\marin\Desktop\AgroDetectBachelorFrontend\data'
+SNAPSHOT_PATH = r'C:\Users\marin\Desktop\AgroDetectBachelorFrontend\amplify\backend\function\AgroDetectAppFunction\src\knowledge_base.json'
 
+# Maximum number of put requests in a BatchWriteItem call
+BATCH_SIZE = 25
 
-def upload_files(base_dir):
-  """ Helper function to upload API response objects to the DynamoDb Table.
+# Attempts made to write the unprocessed items of a batch
+MAX_ATTEMPTS = 5
+
+# Attribute holding the hash of the rest of the item, unchanged items are not written again
+HASH_ATTRIBUTE = "ContentHash"
+
+# Mtime and hash of the source files, kept next to the output of transform_raw_data
+MANIFEST_NAME = ".transform_manifest.json"
+
+# Item layout written by upload_files, "compact" or "legacy"
+ITEM_LAYOUT = "compact"
+
+# Version of the compact layout, must be supported by parse_dynamodb_response in the Lambda
+COMPACT_SCHEMA_VERSION = 2
+
+
+def upload_files(base_dir, table_name=TABLE_NAME, workers=4, dry_run=False, endpoint_url=None,
+                 layout=ITEM_LAYOUT):
+  """ Helper function to upload the new and changed API response objects to the DynamoDb Table.
+
+  Items are written with BatchWriteItem in chunks of BATCH_SIZE across a
+  thread pool. Every item carries the hash of its content, items whose hash
+  matches the live table are skipped.
 
   Args:
       base_dir (str): Path of the json objects.
+      table_name (str): Name of the DynamoDB table.
+      workers (int): Number of concurrent BatchWriteItem calls.
+      dry_run (bool): Only prints the difference with the live table.
+      endpoint_url (str): Optional endpoint of a local DynamoDB stand-in.
+      layout (str): "compact" for one compressed blob per item, "legacy" for typed attributes.
+
+  Returns:
+      dict: Names of the "added", "changed", "unchanged" and "removed" items.
   """
 
-  items_paths = [os.path.join(base_dir, item) for item in os.listdir(base_dir)]
-  # Creates the path for each json object in the base directory
+  dynamodb_client = boto3.client(
+      "dynamodb", endpoint_url=endpoint_url, config=Config(max_pool_connections=max(workers, 10)))
 
-  dynamodb_client = boto3.client("dynamodb")
+  items = load_items(base_dir, layout)
+  diff = diff_items(items, fetch_content_hashes(dynamodb_client, table_name))
 
-  try:
-      for path in items_paths:
-          print("Uploading: ", path)
+  for change in ("added", "changed", "removed"):
+      for name in diff[change]:
+          print("{}: {}".format(change.capitalize(), name))
+
+  print("{} added, {} changed, {} unchanged, {} only in the table".format(
+      len(diff["added"]), len(diff["changed"]), len(diff["unchanged"]), len(diff["removed"])))
+
+  if dry_run:
+      return diff
 
-          with open(path, 'r') as f:
-              data_item = json.load(f)
-          # Loads the json data to be uploaded
+  pending = [items[name] for name in diff["added"] + diff["changed"]]
+  chunks = [pending[i:i + BATCH_SIZE] for i in range(0, len(pending), BATCH_SIZE)]
+
+  start = time.perf_counter()
+  failed = 0
+
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+      futures = {executor.submit(write_batch, dynamodb_client, table_name, chunk): len(chunk) for chunk in chunks}
+
+      for future in as_completed(futures):
+          try:
+              failed += future.result()
+          except botocore.exceptions.ClientError as error:
+              # A failed chunk does not stop the others, its items are written on the next run
+              print(error)
+              failed += futures[future]
+
+  elapsed = time.perf_counter() - start
+  written = len(pending) - failed
+
+  print("Wrote {} items in {:.2f} s ({:.1f} items/s), {} failed".format(
+      written, elapsed, written / elapsed if elapsed else 0.0, failed))
+
+  return diff
+
+
+def load_items(base_dir, layout=ITEM_LAYOUT):
+  """ Function to load the API response objects in DynamoDB format, with their content hash.
+
+  Args:
+      base_dir (str): Path of the json objects.
+      layout (str): "compact" for one compressed blob per item, "legacy" for typed attributes.
 
-          dynamodb_item = transform_to_dynamodb_format(data_item)
-          # Transforms the json object into DynamoDB expected format
+  Returns:
+      dict: DynamoDB items keyed by name.
+  """
+
+  items = {}
+
+  for item in sorted(os.listdir(base_dir)):
+      if item == MANIFEST_NAME:
+          continue
+
+      with open(os.path.join(base_dir, item), 'r') as f:
+          object_ = json.load(f)
+
+      if layout == "compact":
+          dynamodb_item = to_compact_item(to_api_response(object_))
+      else:
+          # Typed items written by transform_raw_data are used as they are
+          dynamodb_item = transform_object(object_, "dynamodb")
+
+      dynamodb_item[HASH_ATTRIBUTE] = {"S": content_hash(dynamodb_item)}
+      items[dynamodb_item["Name"]["S"]] = dynamodb_item
+
+  return items
+
+
+def content_hash(dynamodb_item):
+  """ Function to hash a DynamoDB item, ignoring its hash attribute.
+
+  Args:
+      dynamodb_item (dict): DynamoDB item.
+
+  Returns:
+      str: SHA-256 hex digest of the canonical JSON of the item.
+  """
+
+  content = {key: value for key, value in dynamodb_item.items() if key != HASH_ATTRIBUTE}
+  # Binary attributes of the compact layout are hashed through their base64 form
+  content_json = json.dumps(content, sort_keys=True, default=lambda value: base64.b64encode(value).decode("utf-8"))
+
+  return hashlib.sha256(content_json.encode("utf-8")).hexdigest()
+
+
+def to_api_response(object_):
+  """ Function to bring an API response object of any schema to the shape returned by the Lambda.
+
+  Args:
+      object_ (dict): API response object, raw, transformed or typed.
 
-          resp = dynamodb_client.put_item(TableName=TABLE_NAME, Item=dynamodb_item)
+  Returns:
+      dict: API response object with a boolean "isDisease".
+  """
+
+  if detect_schema(object_) == "dynamodb":
+      deserializer = TypeDeserializer()
+      object_ = {key: deserializer.deserialize(value) for key, value in object_.items() if key != HASH_ATTRIBUTE}
+  else:
+      object_ = transform_object(object_)
+
+  # Same shape as parse_dynamodb_response in the Lambda
+  return {
+      "Name": object_["Name"],
+      "Description": object_["Description"],
+      "isDisease": object_["isDisease"] if isinstance(object_["isDisease"], bool) else to_bool(object_["isDisease"]),
+      "Treatments": object_["Treatments"],
+      "Products": object_["Products"]
+  }
+
+
+def to_compact_item(api_response):
+  """ Function to store an API response object as a single compressed JSON attribute.
+
+  Args:
+      api_response (dict): API response object.
+
+  Returns:
+      dict: DynamoDB item with the "Name" key, the "SchemaVersion" and the zlib compressed "Payload".
+  """
+
+  payload = json.dumps(api_response, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+  return {
+      "Name": {"S": api_response["Name"]},
+      "SchemaVersion": {"N": str(COMPACT_SCHEMA_VERSION)},
+      "Payload": {"B": zlib.compress(payload, 9)}
+  }
+
+
+def fetch_content_hashes(dynamodb_client, table_name):
+  """ Function to read the content hash of every item in the live table.
+
+  Args:
+      dynamodb_client (boto3.client): DynamoDB client.
+      table_name (str): Name of the DynamoDB table.
+
+  Returns:
+      dict: Content hash keyed by name, None for items written before hashes existed.
+  """
+
+  hashes = {}
+  paginator = dynamodb_client.get_paginator("scan")
+
+  pages = paginator.paginate(
+      TableName=table_name, ProjectionExpression="#name, #hash",
+      ExpressionAttributeNames={"#name": "Name", "#hash": HASH_ATTRIBUTE})
+
+  for page in pages:
+      for item in page["Items"]:
+          hashes[item["Name"]["S"]] = item.get(HASH_ATTRIBUTE, {}).get("S")
+
+  return hashes
+
+
+def diff_items(items, live_hashes):
+  """ Function to compare the local items with the live table.
+
+  Args:
+      items (dict): Local DynamoDB items keyed by name.
+      live_hashes (dict): Content hashes of the live table keyed by name.
+
+  Returns:
+      dict: Sorted names of the "added", "changed", "unchanged" and "removed" items.
+  """
+
+  diff = {"added": [], "changed": [], "unchanged": []}
+
+  for name, item in sorted(items.items()):
+      if name not in live_hashes:
+          diff["added"].append(name)
+      elif live_hashes[name] != item[HASH_ATTRIBUTE]["S"]:
+          diff["changed"].append(name)
+      else:
+          diff["unchanged"].append(name)
+
+  diff["removed"] = sorted(set(live_hashes) - set(items))
+
+  return diff
+
+
+def write_batch(dynamodb_client, table_name, items, max_attempts=MAX_ATTEMPTS):
+  """ Function to write up to BATCH_SIZE items, retrying the unprocessed ones with backoff.
+
+  Args:
+      dynamodb_client (boto3.client): DynamoDB client.
+      table_name (str): Name of the DynamoDB table.
+      items (list): DynamoDB items.
+      max_attempts (int): Number of BatchWriteItem calls made at most.
+
+  Returns:
+      int: Number of items still unprocessed after the last attempt.
+  """
 
-  except botocore.exceptions.ClientError as error:
-      print(error)
+  request_items = {table_name: [{"PutRequest": {"Item": item}} for item in items]}
+
+  for attempt in range(max_attempts):
+      if attempt:
+          # Exponential backoff with full jitter, unprocessed items mean the table is throttling
+          time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+
+      response = dynamodb_client.batch_write_item(RequestItems=request_items)
+      request_items = response.get("UnprocessedItems")
+
+      if not request_items:
+          return 0
+
+  return len(request_items.get(table_name, []))
+
+
+def build_snapshot(base_dir, snapshot_path):
+  """ Function to bundle the API response objects into a knowledge base snapshot for the Lambda.
+
+  Args:
+      base_dir (str): Path of the json objects.
+      snapshot_path (str): Path of the snapshot to be written.
+
+  Returns:
+      str: Version stamp of the snapshot.
+  """
+
+  items = {}
+
+  for item in sorted(os.listdir(base_dir)):
+      if item == MANIFEST_NAME:
+          continue
+
+      with open(os.path.join(base_dir, item), 'r') as f:
+          api_response = to_api_response(json.load(f))
+
+      items[api_response["Name"]] = api_response
+
+  # Matches knowledge_base.compute_version in the Lambda
+  version = hashlib.sha256(json.dumps(items, sort_keys=True).encode("utf-8")).hexdigest()
+
+  with open(snapshot_path, 'w') as f:
+      json.dump({"Version": version, "Items": items}, f)
+
+  print("Wrote snapshot version {} with {} items to {}".format(version, len(items), snapshot_path))
+
+  return version
 
 
 def transform_to_dynamodb_format(object_):
@@ -130,35 +399,210 @@ def to_list(dict_):
   return list_item
 
 
-def transform_raw_data(base_path):
-  """ Function to transform the API response data objects into a better json format.
+def detect_schema(object_):
+  """ Function to tell which stage of the pipeline an API response object is in.
+
+  Args:
+      object_ (dict): API response object.
+
+  Returns:
+      str: "raw" with the Treatment map, "json" with the Treatments list or "dynamodb" when typed.
+  """
+
+  if isinstance(object_.get("Name"), dict):
+      return "dynamodb"
+
+  if isinstance(object_.get("Treatments"), list):
+      return "json"
+
+  if isinstance(object_.get("Treatment"), dict):
+      return "raw"
+
+  raise ValueError("Unknown schema with keys {}".format(sorted(object_)))
+
+
+def transform_object(object_, output_format="json"):
+  """ Function to bring an API response object of any schema to the requested one.
 
   Args:
-      base_path (str): Base path of the response objects to be transformed
+      object_ (dict): API response object.
+      output_format (str): "json" or "dynamodb".
+
+  Returns:
+      dict: Transformed object, unchanged if it already has the requested schema.
   """
 
-  # Creates the path for each json object in the base directory
-  items_paths = [os.path.join(base_path, item) for item in os.listdir(base_path)]
+  schema = detect_schema(object_)
 
-  for path in items_paths:
-      print("Transforming: ", path)
+  if schema == "dynamodb":
+      if output_format != "dynamodb":
+          raise ValueError("Cannot transform a DynamoDB item back to {}".format(output_format))
 
-      # Reads the json object
-      with open(path, 'r') as f:
-          object_ = json.load(f)
+      return object_
+
+  if schema == "raw":
+      object_ = {
+          'Name': object_['Name'],
+          'isDisease': object_['isDisease'],
+          'Description': object_['Description'],
+          'Treatments': to_list(object_['Treatment']),
+          'Products': to_list(object_['Products'])
+      }
+
+  if output_format == "dynamodb":
+      return transform_to_dynamodb_format(object_)
+
+  return object_
+
+
+def file_sha256(path):
+  """ Function to hash a file.
+
+  Args:
+      path (str): Path of the file.
+
+  Returns:
+      str: SHA-256 hex digest of the file.
+  """
+
+  with open(path, 'rb') as f:
+      return hashlib.sha256(f.read()).hexdigest()
+
+
+def write_atomic(path, object_):
+  """ Function to write a json object so that readers never see a partial file.
+
+  Args:
+      path (str): Destination path.
+      object_ (dict): Json object.
+  """
+
+  fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+
+  try:
+      with os.fdopen(fd, 'w') as f:
+          json.dump(object_, f, indent=4)
+
+      os.replace(temp_path, path)
+  except BaseException:
+      os.remove(temp_path)
+      raise
+
+
+def transform_file(source_path, output_path, output_format):
+  """ Function to transform a single file, run in the worker processes.
+
+  Args:
+      source_path (str): Path of the object to be transformed.
+      output_path (str): Path of the transformed object, may be the source path.
+      output_format (str): "json" or "dynamodb".
+
+  Returns:
+      bool: True if the output was written, False if it already had the requested schema.
+  """
+
+  with open(source_path, 'r') as f:
+      object_ = json.load(f)
+
+  item = transform_object(object_, output_format)
+
+  if item is object_ and source_path == output_path:
+      return False
+
+  write_atomic(output_path, item)
+
+  return True
+
+
+def transform_raw_data(base_path, output_path=None, output_format="json", workers=None):
+  """ Function to transform the changed API response data objects across a process pool.
+
+  A manifest in the output directory keeps the mtime and the hash of every
+  source file, unchanged files are skipped. Objects that already have the
+  requested schema are left as they are, so running it again is a no-op.
+
+  Args:
+      base_path (str): Base path of the response objects to be transformed.
+      output_path (str): Directory of the transformed objects, the base path if not set.
+      output_format (str): "json" or "dynamodb", the typed items read by load_items.
+      workers (int): Number of worker processes, one per CPU if not set.
+
+  Returns:
+      list: Names of the files written.
+  """
+
+  output_path = output_path or base_path
+  os.makedirs(output_path, exist_ok=True)
+
+  manifest_path = os.path.join(output_path, MANIFEST_NAME)
+  manifest = {}
+
+  if os.path.isfile(manifest_path):
+      with open(manifest_path, 'r') as f:
+          manifest = json.load(f)
+
+  names = [name for name in sorted(os.listdir(base_path)) if name.endswith(".json") and name != MANIFEST_NAME]
+  pending = []
+
+  for name in names:
+      source_path = os.path.join(base_path, name)
+      entry = manifest.get(name, {})
+      mtime = os.stat(source_path).st_mtime
+      unchanged = (entry.get("format") == output_format and os.path.isfile(os.path.join(output_path, name))
+                   and (entry.get("mtime") == mtime or entry.get("sha256") == file_sha256(source_path)))
+
+      if not unchanged:
+          pending.append(name)
+
+  print("Transforming {} files, {} unchanged".format(len(pending), len(names) - len(pending)))
+
+  written = []
+
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+      futures = {executor.submit(transform_file, os.path.join(base_path, name),
+                                 os.path.join(output_path, name), output_format): name for name in pending}
+
+      for future in as_completed(futures):
+          name = futures[future]
+
+          try:
+              if future.result():
+                  written.append(name)
+          except (OSError, ValueError, KeyError) as error:
+              print("Could not transform {}: {}".format(name, error))
+              continue
+
+          # Recorded after the write, a transform in place then matches on the next run
+          source_path = os.path.join(base_path, name)
+          manifest[name] = {"mtime": os.stat(source_path).st_mtime, "sha256": file_sha256(source_path),
+                            "format": output_format}
 
-      # Transforms the json object into a better format
-      item = {}
-      item['Name'] = object_['Name']
-      item['isDisease'] = object_['isDisease']
-      item['Description'] = object_['Description']
-      item['Treatments'] = to_list(object_['Treatment'])
-      item['Products'] = to_list(object_['Products'])
+  write_atomic(manifest_path, manifest)
+  print("Wrote {} files to {}".format(len(written), output_path))
 
-      # Saves the transformed object
-      with open(path, 'w') as f:
-          json.dump(item, f,indent=4)
+  return sorted(written)
 
 
 if __name__ == '__main__':
-  upload_files(DATA_DIRECTORY)
+  parser = argparse.ArgumentParser(description="Uploads the API response objects to DynamoDB.")
+  subparsers = parser.add_subparsers(dest="command")
+  transform_parser = subparsers.add_parser("transform", help="transform the changed objects instead of uploading")
+  transform_parser.add_argument("--output-dir", help="directory of the transformed objects, in place if not set")
+  transform_parser.add_argument("--format", choices=("json", "dynamodb"), default="json", help="output schema")
+  transform_parser.add_argument("--processes", type=int, help="worker processes, one per CPU if not set")
+  parser.add_argument("--data-dir", default=DATA_DIRECTORY, help="directory of the json objects")
+  parser.add_argument("--table", default=TABLE_NAME, help="name of the DynamoDB table")
+  parser.add_argument("--workers", type=int, default=4, help="concurrent BatchWriteItem calls")
+  parser.add_argument("--dry-run", action="store_true", help="only print the difference with the table")
+  parser.add_argument("--endpoint-url", help="endpoint of a local DynamoDB stand-in")
+  parser.add_argument("--layout", choices=("compact", "legacy"), default=ITEM_LAYOUT, help="item layout written")
+  args = parser.parse_args()
+
+  if args.command == "transform":
+      transform_raw_data(args.data_dir, args.output_dir, args.format, args.processes)
+      raise SystemExit(0)
+
+  upload_files(args.data_dir, args.table, args.workers, args.dry_run, args.endpoint_url, args.layout)
+
+  if not args.dry_run:
+      build_snapshot(args.data_dir, SNAPSHOT_PATH)
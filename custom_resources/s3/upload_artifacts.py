@@ -1,7 +1,14 @@
-import os
+import argparse
+import hashlib
 import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
 import botocore
+from boto3.s3.transfer import TransferConfig
 
 ARTIFACTS_PATH = r'C:\Users\marin\Desktop\AgroDetectBachelorFrontend\model\model.tar.gz'
 
@@ -9,24 +16,203 @@ BUCKET_NAME = 'agro-detect-model-artifacts-bucket'
 
 OBJECT_KEY = 'model.tar.gz'
 
-def upload_object(object_path, bucket_name, object_key):
-  """ Function to upload SageMaker model artifacts to a S3 Bucket.
+# Object metadata key holding the SHA-256 of the uploaded artifact
+CHECKSUM_METADATA = 'sha256'
+
+# 16 MiB parts sent 8 at a time, files under the threshold go in a single request
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=64 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=8,
+    use_threads=True)
+
+
+class Progress:
+  """ Thread safe byte counter printing the progress of an upload. """
+
+  def __init__(self, total):
+      self.total = total
+      self.sent = 0
+      self.start = time.perf_counter()
+      self._lock = threading.Lock()
+
+  def __call__(self, sent):
+      with self._lock:
+          self.sent += sent
+          print("\rUploaded {:.1f} / {:.1f} MiB".format(self.sent / 2 ** 20, self.total / 2 ** 20), end="")
+
+  def report(self):
+      """ Prints the throughput of the whole upload. """
+
+      elapsed = time.perf_counter() - self.start
+      print("\nUploaded {:.1f} MiB in {:.1f} s ({:.1f} MiB/s)".format(
+          self.sent / 2 ** 20, elapsed, self.sent / 2 ** 20 / elapsed if elapsed else 0.0))
+
+
+def file_sha256(object_path, chunk_size=8 * 1024 * 1024):
+  """ Function to hash the artifact without loading it in memory.
+
+  Args:
+      object_path (str): Path of the model artifacts.
+      chunk_size (int): Bytes read at a time.
+
+  Returns:
+      str: SHA-256 hex digest.
+  """
+
+  digest = hashlib.sha256()
+
+  with open(object_path, 'rb') as f:
+      for chunk in iter(lambda: f.read(chunk_size), b''):
+          digest.update(chunk)
+
+  return digest.hexdigest()
+
+
+def remote_sha256(s3_client, bucket_name, object_key):
+  """ Function to read the checksum stored with the uploaded artifact.
+
+  Args:
+      s3_client (boto3.client): S3 client.
+      bucket_name (str): Bucket name.
+      object_key (str): Object name.
+
+  Returns:
+      str: SHA-256 hex digest, None if the object or its checksum is missing.
+  """
+
+  try:
+      response = s3_client.head_object(Bucket=bucket_name, Key=object_key)
+  except botocore.exceptions.ClientError as error:
+      if error.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+          return None
+      raise
+
+  return response.get("Metadata", {}).get(CHECKSUM_METADATA)
+
+
+def upload_multipart(s3_client, object_path, bucket_name, object_key, checksum, config=TRANSFER_CONFIG):
+  """ Function to upload the artifact in parallel parts, resuming an interrupted upload.
+
+  The upload id is kept in a state file next to the artifact until the
+  upload completes. On the next run, the parts S3 already has are kept when
+  their MD5 still matches the local file, only the others are sent.
+
+  Args:
+      s3_client (boto3.client): S3 client.
+      object_path (str): Path of the model artifacts.
+      bucket_name (str): Bucket name.
+      object_key (str): Object name.
+      checksum (str): SHA-256 of the artifact, stored as object metadata.
+      config (TransferConfig): Part size and number of parallel parts.
+  """
+
+  state_path = object_path + ".upload"
+  part_size = config.multipart_chunksize
+  size = os.path.getsize(object_path)
+  part_count = max((size + part_size - 1) // part_size, 1)
+
+  uploaded = {}
+  upload_id = None
+
+  if os.path.isfile(state_path):
+      with open(state_path, 'r') as f:
+          state = json.load(f)
+
+      if (state["Bucket"], state["Key"], state["Checksum"], state["PartSize"]) == \
+              (bucket_name, object_key, checksum, part_size):
+          upload_id = state["UploadId"]
+
+          try:
+              for page in s3_client.get_paginator("list_parts").paginate(
+                      Bucket=bucket_name, Key=object_key, UploadId=upload_id):
+                  for part in page.get("Parts", []):
+                      uploaded[part["PartNumber"]] = part["ETag"]
+          except botocore.exceptions.ClientError as error:
+              print("Could not resume upload {}: {}".format(upload_id, error))
+              upload_id, uploaded = None, {}
+
+  if upload_id is None:
+      upload_id = s3_client.create_multipart_upload(
+          Bucket=bucket_name, Key=object_key, Metadata={CHECKSUM_METADATA: checksum})["UploadId"]
+
+      with open(state_path, 'w') as f:
+          json.dump({"Bucket": bucket_name, "Key": object_key, "Checksum": checksum,
+                     "PartSize": part_size, "UploadId": upload_id}, f)
+  else:
+      print("Resuming upload {} with {} of {} parts".format(upload_id, len(uploaded), part_count))
+
+  progress = Progress(size)
+
+  def upload_part(part_number):
+      with open(object_path, 'rb') as f:
+          f.seek((part_number - 1) * part_size)
+          body = f.read(part_size)
+
+      etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+
+      # Parts kept from an interrupted upload do not count towards the throughput
+      if uploaded.get(part_number) != etag:
+          etag = s3_client.upload_part(
+              Bucket=bucket_name, Key=object_key, UploadId=upload_id, PartNumber=part_number, Body=body)["ETag"]
+          progress(len(body))
+
+      return {"PartNumber": part_number, "ETag": etag}
+
+  with ThreadPoolExecutor(max_workers=config.max_concurrency) as executor:
+      parts = list(executor.map(upload_part, range(1, part_count + 1)))
+
+  s3_client.complete_multipart_upload(
+      Bucket=bucket_name, Key=object_key, UploadId=upload_id, MultipartUpload={"Parts": parts})
+  os.remove(state_path)
+  progress.report()
+
+
+def upload_object(object_path, bucket_name, object_key, endpoint_url=None, force=False):
+  """ Function to upload SageMaker model artifacts to a S3 Bucket, unless they are unchanged.
 
   Args:
       object_path (str): Path of the model artifacts.
       bucket_name (str): Bucket name.
       object_key (str):  Object name.
+      endpoint_url (str): Optional endpoint of a local S3 stand-in.
+      force (bool): Uploads even if the remote checksum matches.
+
+  Returns:
+      bool: True if the artifact was uploaded.
   """
 
-  s3_client = boto3.client("s3")
+  s3_client = boto3.client("s3", endpoint_url=endpoint_url)
 
   try:
-      with open(object_path, 'rb') as f:
-          response = s3_client.upload_fileobj(f, bucket_name, object_key)
+      checksum = file_sha256(object_path)
+
+      if not force and remote_sha256(s3_client, bucket_name, object_key) == checksum:
+          print("s3://{}/{} is up to date ({})".format(bucket_name, object_key, checksum))
+          return False
+
+      if os.path.getsize(object_path) < TRANSFER_CONFIG.multipart_threshold:
+          progress = Progress(os.path.getsize(object_path))
+          s3_client.upload_file(object_path, bucket_name, object_key, Config=TRANSFER_CONFIG,
+                                ExtraArgs={"Metadata": {CHECKSUM_METADATA: checksum}}, Callback=progress)
+          progress.report()
+      else:
+          upload_multipart(s3_client, object_path, bucket_name, object_key, checksum)
 
   except botocore.exceptions.ClientError as error:
       print("Error ocured: ", error)
+      return False
+
+  return True
 
 
 if __name__ == '__main__':
-    upload_object(ARTIFACTS_PATH, BUCKET_NAME, OBJECT_KEY)
+    parser = argparse.ArgumentParser(description="Uploads the model artifacts to S3.")
+    parser.add_argument("--path", default=ARTIFACTS_PATH, help="path of model.tar.gz")
+    parser.add_argument("--bucket", default=BUCKET_NAME, help="name of the bucket")
+    parser.add_argument("--key", default=OBJECT_KEY, help="key of the object")
+    parser.add_argument("--endpoint-url", help="endpoint of a local S3 stand-in")
+    parser.add_argument("--force", action="store_true", help="upload even if the artifact is unchanged")
+    args = parser.parse_args()
+
+    upload_object(args.path, args.bucket, args.key, args.endpoint_url, args.force)
@@ -1,11 +1,10 @@
-from io import BytesIO
 import json
 import numpy as np
 from collections import namedtuple
-from PIL import Image
 import logging
 import base64
 from consts import IMAGE_SIZE, CLASSES
+from preprocessing import decode_image, to_instances
 
 Context = namedtuple('Context',
                      'model_name, model_version, method, rest_uri, grpc_uri, '
@@ -30,37 +29,23 @@ def input_handler(data, context):
         (dict): a JSON-serializable dict that contains request body and headers
     """
     
-    logging.info("Using Context: {}".format(context))
-    logging.info("Got data object: {}".format(data))
+    logging.info("Using Context: %s", context)
     if context.request_content_type == 'application/x-image':
         json_data = json.loads(data.read())
-        logging.info("JSON Data: {}".format(json_data))
+        logging.info("JSON Data keys: %s", list(json_data))
         
         b64_image = json_data['body-json']
-        logging.info("Base64 encoded image: {}".format(b64_image))
+        logging.info("Base64 encoded image of %d bytes", len(b64_image))
         
-        image = Image.open(BytesIO(base64.b64decode(b64_image)))
-        logging.info("Opened image for inference")
+        resized_image = decode_image(base64.b64decode(b64_image), IMAGE_SIZE)
+        logging.info("Resized image to: %s", resized_image.size)
 
-        rgb_image = image.convert('RGB')
-        logging.info("Image mode set to: {}".format(rgb_image.mode))
-
-        resized_image = rgb_image.resize(IMAGE_SIZE)
-        logging.info("Resized image to: {}".format(resized_image.mode))
-
-        np_image = np.array(resized_image, dtype='f')
-        logging.info("Converted image to type {}".format(np_image.dtype))
-
-        scaled_image = np_image / 255
-        logging.info("Scaled np array")
-
-        instance = np.expand_dims(scaled_image, axis=0)
-        logging.info("Expanded to: {}".format(instance.shape))
+        instance = to_instances([resized_image], IMAGE_SIZE)
         
-        logging.info("Payload for TFS: {}".format(instance))
+        logging.info("Payload for TFS of shape %s", instance.shape)
 
         payload = json.dumps({"instances": instance.tolist()})
-        logging.info("Sending payload: {}".format(payload))
+        logging.info("Sending payload of %d bytes", len(payload))
         return payload
 
     else:
@@ -76,7 +61,7 @@ def output_handler(data, context):
         (bytes, string): data to return to client, response content type
     """
     
-    logging.info("Got output data: {} with status: ".format(data.content, data))
+    logging.info("Got output data of %d bytes with status: %s", len(data.content), data.status_code)
     
     if data.status_code != 200:
         raise Exception(data.content.decode('utf-8'))
@@ -85,7 +70,7 @@ def output_handler(data, context):
     prediction = data.content
     
     prediction_label = get_prediction_label(prediction)
-    logging.info("Prediction: {}".format(prediction_label))
+    logging.info("Prediction: %s", prediction_label)
     
     return prediction_label, response_content_type
 
@@ -0,0 +1,255 @@
+""" Packages the SavedModel and the inference code into a reproducible model.tar.gz.
+
+Entries are sorted and stripped of their mtimes, owners and permissions, so
+the same inputs always give the same bytes and the skip-if-unchanged upload of
+custom_resources/s3/upload_artifacts.py works. The tar stream is compressed in
+parallel as independent gzip members, which gzip, tar and SageMaker read as
+one file. Run from the repository root:
+
+    python custom_resources/sagemaker/package_model.py --output model/model.tar.gz
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sys
+import tarfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODEL_DIR = os.path.join(BASE_DIR, 'model')
+
+# Files of the code directory that never go into the archive
+EXCLUDED_NAMES = ('__pycache__', '.ipynb_checkpoints')
+
+# Uncompressed bytes per gzip member, compressed by separate threads
+BLOCK_SIZE = 1024 * 1024
+
+
+class ParallelGzipWriter:
+    """ File-like sink compressing fixed size blocks on a thread pool, written in order. """
+
+    def __init__(self, output, workers, level=9):
+        """
+        Args:
+            output (file): Binary file receiving the gzip members.
+            workers (int): Number of compressing threads.
+            level (int): Compression level.
+        """
+
+        self.output = output
+        self.level = level
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.pending = deque()
+        self.max_pending = 2 * workers
+        self.buffer = bytearray()
+        self.digest = hashlib.sha256()
+
+    def write(self, data):
+        self.buffer.extend(data)
+
+        while len(self.buffer) >= BLOCK_SIZE:
+            self._submit(bytes(self.buffer[:BLOCK_SIZE]))
+            del self.buffer[:BLOCK_SIZE]
+
+        return len(data)
+
+    def close(self):
+        if self.buffer:
+            self._submit(bytes(self.buffer))
+            self.buffer.clear()
+
+        while self.pending:
+            self._drain()
+
+        self.executor.shutdown()
+
+    def _submit(self, block):
+        # mtime=0 keeps the member headers identical between runs, zlib releases the GIL
+        self.pending.append(self.executor.submit(gzip.compress, block, self.level, mtime=0))
+
+        while len(self.pending) >= self.max_pending:
+            self._drain()
+
+    def _drain(self):
+        member = self.pending.popleft().result()
+        self.digest.update(member)
+        self.output.write(member)
+
+
+def list_entries(model_dir):
+    """ Lists the archived files in a stable order.
+
+    Args:
+        model_dir (str): Directory holding the '1' SavedModel and the 'code' directory.
+
+    Returns:
+        list: (path, arcname) pairs sorted by arcname.
+    """
+
+    entries = []
+
+    for top in ('1', 'code'):
+        for root, dirs, files in os.walk(os.path.join(model_dir, top)):
+            dirs[:] = [name for name in dirs if name not in EXCLUDED_NAMES]
+
+            for name in files:
+                path = os.path.join(root, name)
+                entries.append((path, os.path.relpath(path, model_dir).replace(os.sep, '/')))
+
+    return sorted(entries, key=lambda entry: entry[1])
+
+
+def normalize(tarinfo):
+    """ Drops everything that changes between checkouts from a tar entry. """
+
+    tarinfo.mtime = 0
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = ''
+    tarinfo.mode = 0o755 if tarinfo.isdir() else 0o644
+
+    return tarinfo
+
+
+def read_output_units(metadata_path):
+    """ Reads the output dimension of the model from keras_metadata.pb.
+
+    The file is a SavedMetadata protobuf whose nodes carry JSON metadata, the
+    'root' node describes the whole network. Only the few wire format rules
+    needed here are decoded, so protobuf is not required.
+
+    Args:
+        metadata_path (str): Path of keras_metadata.pb.
+
+    Returns:
+        int: Units of the output layer.
+    """
+
+    with open(metadata_path, 'rb') as f:
+        data = f.read()
+
+    for number, node in _fields(data):
+        if number != 1:
+            continue
+
+        node_fields = dict(_fields(node))
+
+        # SavedObject: node_path = 3, metadata = 5
+        if node_fields.get(3) == b'root':
+            config = json.loads(node_fields[5])['config']
+            layers = {layer['config']['name']: layer for layer in config['layers']}
+            output_name = config.get('output_layers', [[config['layers'][-1]['config']['name']]])[0][0]
+
+            return layers[output_name]['config']['units']
+
+    raise ValueError('No root node in {}'.format(metadata_path))
+
+
+def _fields(data):
+    """ Yields the (field number, value) pairs of a serialized protobuf message. """
+
+    index = 0
+
+    while index < len(data):
+        key, index = _varint(data, index)
+        number, wire_type = key >> 3, key & 7
+
+        if wire_type == 0:
+            value, index = _varint(data, index)
+        elif wire_type == 1:
+            value, index = data[index:index + 8], index + 8
+        elif wire_type == 2:
+            length, index = _varint(data, index)
+            value, index = data[index:index + length], index + length
+        elif wire_type == 5:
+            value, index = data[index:index + 4], index + 4
+        else:
+            raise ValueError('Unsupported wire type {}'.format(wire_type))
+
+        yield number, value
+
+
+def _varint(data, index):
+    result = shift = 0
+
+    while True:
+        byte = data[index]
+        index += 1
+        result |= (byte & 0x7f) << shift
+        shift += 7
+
+        if byte < 0x80:
+            return result, index
+
+
+def check_classes(model_dir):
+    """ Checks that consts.CLASSES has one label per model output.
+
+    Args:
+        model_dir (str): Directory holding the '1' SavedModel and the 'code' directory.
+
+    Returns:
+        int: Number of classes.
+    """
+
+    sys.path.insert(0, os.path.join(model_dir, 'code'))
+
+    # pylint: disable=C0415
+    from consts import CLASSES
+
+    units = read_output_units(os.path.join(model_dir, '1', 'keras_metadata.pb'))
+
+    if units != len(CLASSES):
+        raise ValueError('consts.CLASSES has {} labels but the model outputs {} classes'.format(len(CLASSES), units))
+
+    return units
+
+
+def package(model_dir, output_path, workers):
+    """ Writes the reproducible archive.
+
+    Args:
+        model_dir (str): Directory holding the '1' SavedModel and the 'code' directory.
+        output_path (str): Path of model.tar.gz.
+        workers (int): Number of compressing threads.
+
+    Returns:
+        str: SHA-256 of the archive.
+    """
+
+    temp_path = output_path + '.tmp'
+
+    with open(temp_path, 'wb') as output:
+        writer = ParallelGzipWriter(output, workers)
+
+        # GNU format without PAX headers, which would carry the current time
+        with tarfile.open(fileobj=writer, mode='w|', format=tarfile.GNU_FORMAT) as archive:
+            for path, arcname in list_entries(model_dir):
+                archive.add(path, arcname=arcname, recursive=False, filter=normalize)
+
+        writer.close()
+
+    os.replace(temp_path, output_path)
+
+    return writer.digest.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model-dir', default=MODEL_DIR, help='directory with the 1 and code directories')
+    parser.add_argument('--output', default=os.path.join(MODEL_DIR, 'model.tar.gz'), help='archive path')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='compressing threads')
+    args = parser.parse_args()
+
+    classes = check_classes(args.model_dir)
+    print('consts.CLASSES matches the {} model outputs'.format(classes))
+
+    checksum = package(args.model_dir, args.output, args.workers)
+    print('Wrote {} ({} bytes), sha256 {}'.format(args.output, os.path.getsize(args.output), checksum))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,36 @@
+import base64
 import json
 import logging
+import os
+import random
+import threading
+import time
 from collections import namedtuple
 from io import BytesIO
 
 import numpy as np
 from consts import CLASSES, IMAGE_SIZE
-from PIL import Image
+from preprocessing import decode_image, to_instances
 
 Context = namedtuple('Context',
                      'model_name, model_version, method, rest_uri, grpc_uri, '
                      'custom_attributes, request_content_type, accept_header')
 
+# Full payloads are logged for one in this many requests, 0 never logs them
+DEBUG_SAMPLE_RATE = int(os.environ.get('DEBUG_SAMPLE_RATE', '0'))
+
+# Number of most probable classes returned to clients accepting TOP_K_CONTENT_TYPE
+TOP_K = int(os.environ.get('TOP_K', '3'))
+
+# The container defaults the Accept header to application/json, so top-k needs its own type
+TOP_K_CONTENT_TYPE = 'application/x-top-k+json'
+
+# CloudWatch namespace of the embedded metrics written once per request
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'AgroDetect/Inference')
+
+# Timings of the request being handled, the input and output handlers run on the same thread
+_request = threading.local()
+
 def get_prediction_label(prediction):
     """ Function to parse the model prediction.
 
@@ -21,13 +41,49 @@ def get_prediction_label(prediction):
         str: Prediction label.
     """
 
+    return get_prediction_labels(prediction)[0]
+
+
+def get_prediction_labels(prediction):
+    """ Function to parse the model predictions of a batch.
+
+    Args:
+        prediction (dict): Dictionary containing the prediction arrays.
+
+    Returns:
+        list: Prediction label of every instance, in order.
+    """
+
     json_predictions = json.loads(prediction)
 
-    probabilites = json_predictions['predictions'][0]
+    probabilites = np.asarray(json_predictions['predictions'])
+
+    prediction_indexes = np.argmax(probabilites, axis=1)
 
-    prediction_index = np.argmax(probabilites)
+    return [CLASSES[prediction_index] for prediction_index in prediction_indexes]
 
-    return CLASSES[prediction_index]
+
+def get_top_predictions(prediction, k=TOP_K):
+    """ Function to parse the k most probable classes of every instance.
+
+    Args:
+        prediction (dict): Dictionary containing the prediction arrays.
+        k (int): Number of classes to keep per instance.
+
+    Returns:
+        list: Per instance dict with the "label" and the "top_k" classes with their "probability".
+    """
+
+    json_predictions = json.loads(prediction)
+
+    probabilites = np.asarray(json_predictions['predictions'])
+
+    # Sorts every row at once, most probable class first
+    top_indexes = np.argsort(-probabilites, axis=1)[:, :k]
+
+    return [{"label": CLASSES[indexes[0]],
+             "top_k": [{"label": CLASSES[index], "probability": float(row[index])} for index in indexes]}
+            for row, indexes in zip(probabilites, top_indexes)]
 
 
 def input_handler(data, context):
@@ -39,36 +95,67 @@ def input_handler(data, context):
         (dict): a JSON-serializable dict that contains request body and headers
     """
 
+    timings = _request.timings = {}
+
     if context.request_content_type == 'application/x-image':
         image_bytes = data.read()
+        timings['RequestBytes'] = len(image_bytes)
 
-        image = Image.open(BytesIO(image_bytes))
-        logging.info("Opened image for inference")
-
-        rgb_image = image.convert('RGB')
-        logging.info("Image mode set to: {}".format(rgb_image.mode))
-
-        resized_image = rgb_image.resize(IMAGE_SIZE)
-        logging.info("Resized image to: {}".format(resized_image.mode))
+        resized_image = decode_image(image_bytes, IMAGE_SIZE, timings)
+        logging.info("Resized image to: %s", resized_image.size)
 
-        np_image = np.array(resized_image, dtype='f')
-        logging.info("Converted image to type {}".format(np_image.dtype))
+        payload = _timed_serialize([resized_image], timings)
+        logging.info("Sending payload of %d bytes", len(payload))
+        _log_sampled_payload(payload)
 
-        scaled_image = np_image / 255
-        logging.info("Scaled np array")
+        return payload
 
-        instance = np.expand_dims(scaled_image, axis=0)
-        logging.info("Expanded to: {}".format(instance.shape))
+    elif context.request_content_type == 'application/json':
+        # Batch request, {"images": [<base64 encoded image>, ...]}
+        body = data.read()
+        timings['RequestBytes'] = len(body)
+        b64_images = json.loads(body)['images']
 
-        payload = json.dumps({"instances": instance.tolist()})
-        logging.info("Sending payload: {}".format(payload))
+        resized_images = [decode_image(base64.b64decode(b64_image), IMAGE_SIZE, timings) for b64_image in b64_images]
+        logging.info("Resized %d images", len(resized_images))
 
-        return payload
+        return _timed_serialize(resized_images, timings)
 
     else:
         _return_error(415, 'Unsupported content type "{}"'.format(context.request_content_type or 'Unknown'))
 
 
+def _timed_serialize(images, timings):
+    """ Serializes the images, recording the time and the size of the TensorFlow Serving request. """
+
+    start = time.perf_counter()
+    payload = serialize_instances(images)
+
+    timings['SerializeMs'] = (time.perf_counter() - start) * 1000
+    timings['PayloadBytes'] = len(payload)
+    timings['Instances'] = len(images)
+    # The TensorFlow Serving round trip starts once the input handler returns
+    timings['_sent'] = time.perf_counter()
+
+    return payload
+
+
+def serialize_instances(images):
+    """ Serializes the resized images into a TensorFlow Serving REST request body.
+
+    The exported model expects the pixels scaled to [0, 1], sent as JSON numbers.
+
+    Args:
+        images (list): RGB images already resized to IMAGE_SIZE.
+    Returns:
+        (str): JSON request body with one instance per image
+    """
+
+    instances = to_instances(images, IMAGE_SIZE)
+
+    return json.dumps({"instances": instances.tolist()})
+
+
 def output_handler(data, context):
     """Post-process TensorFlow Serving output before it is returned to the client.
     Args:
@@ -78,7 +165,16 @@ def output_handler(data, context):
         (bytes, string): data to return to client, response content type
     """
 
-    logging.info("Got output data: {} with status: ".format(data.content, data))
+    logging.info("Got output data of %d bytes with status: %s", len(data.content), data.status_code)
+
+    timings = getattr(_request, 'timings', {})
+    _request.timings = {}
+
+    if '_sent' in timings:
+        timings['TFServingMs'] = (time.perf_counter() - timings.pop('_sent')) * 1000
+
+    timings['ResponseBytes'] = len(data.content)
+    _emit_metrics(timings, data.status_code)
 
     if data.status_code != 200:
         raise Exception(data.content.decode('utf-8'))
@@ -86,11 +182,57 @@ def output_handler(data, context):
     response_content_type = context.accept_header
     prediction = data.content
 
+    if context.request_content_type == 'application/json':
+        prediction_labels = get_prediction_labels(prediction)
+        logging.info("Predictions: %s", prediction_labels)
+
+        return json.dumps(prediction_labels), 'application/json'
+
+    if response_content_type == TOP_K_CONTENT_TYPE:
+        top_prediction = get_top_predictions(prediction)[0]
+        logging.info("Prediction: %s", top_prediction)
+
+        return json.dumps(top_prediction), response_content_type
+
     prediction_label = get_prediction_label(prediction)
-    logging.info("Prediction: {}".format(prediction_label))
+    logging.info("Prediction: %s", prediction_label)
 
     return prediction_label, response_content_type
 
 
+def _emit_metrics(timings, status_code):
+    """ Prints the request timings and sizes as one CloudWatch Embedded Metric Format line.
+
+    Args:
+        timings (dict): Values recorded by the input and output handlers.
+        status_code (int): Status code returned by TensorFlow Serving.
+    """
+
+    units = {name: 'Milliseconds' if name.endswith('Ms') else 'Bytes' if name.endswith('Bytes') else 'Count'
+             for name in timings}
+
+    document = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": [[]],
+                "Metrics": [{"Name": name, "Unit": unit} for name, unit in units.items()]
+            }]
+        },
+        "StatusCode": status_code
+    }
+    document.update({name: round(value, 3) for name, value in timings.items()})
+
+    print(json.dumps(document), flush=True)
+
+
+def _log_sampled_payload(payload):
+    """ Logs a full request payload for one in DEBUG_SAMPLE_RATE requests. """
+
+    if DEBUG_SAMPLE_RATE > 0 and random.random() < 1 / DEBUG_SAMPLE_RATE:
+        logging.info("Sampled payload: %s", payload)
+
+
 def _return_error(code, message):
     raise ValueError('Error: {}, {}'.format(str(code), message))
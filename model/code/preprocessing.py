@@ -0,0 +1,64 @@
+import logging
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+
+def decode_image(image_bytes, size, timings=None):
+    """ Decodes an image and resizes it to the model input.
+
+    JPEGs are decoded in draft mode, libjpeg then scales the DCT blocks by a
+    power of two while decoding, never going below the requested size. Images
+    smaller than twice the target decode exactly as before.
+
+    Args:
+        image_bytes (bytes): Encoded image.
+        size (tuple): Model input (width, height).
+        timings (dict): Optional, the decode and resize milliseconds are added to 'DecodeMs' and 'ResizeMs'.
+    Returns:
+        (PIL.Image.Image): RGB image of the given size
+    """
+
+    start = time.perf_counter()
+
+    image = Image.open(BytesIO(image_bytes))
+    image.draft('RGB', size)
+
+    rgb_image = image.convert('RGB')
+    decoded = time.perf_counter()
+
+    if rgb_image.size != size:
+        rgb_image = rgb_image.resize(size)
+
+    if timings is not None:
+        timings['DecodeMs'] = timings.get('DecodeMs', 0) + (decoded - start) * 1000
+        timings['ResizeMs'] = timings.get('ResizeMs', 0) + (time.perf_counter() - decoded) * 1000
+
+    return rgb_image
+
+
+def to_instances(images, size):
+    """ Converts resized RGB images into a float32 batch scaled to [0, 1].
+
+    The batch is allocated once and every image is cast straight into its slot,
+    without the intermediate float copies of np.array(dtype='f') / 255.
+
+    Args:
+        images (list): RGB images of the given size.
+        size (tuple): Model input (width, height).
+    Returns:
+        (np.ndarray): Array of shape (N, height, width, 3)
+    """
+
+    width, height = size
+    instances = np.empty((len(images), height, width, 3), dtype=np.float32)
+
+    for index, image in enumerate(images):
+        np.copyto(instances[index], np.asarray(image), casting='unsafe')
+
+    np.divide(instances, 255, out=instances)
+    logging.info("Built instances of shape %s", instances.shape)
+
+    return instances
@@ -0,0 +1,318 @@
+""" Offline micro-benchmarks of the inference handlers and the Lambda pipeline.
+
+Every AWS call is answered by a botocore Stubber, so no network or credentials
+are needed. Run from the repository root:
+
+    python test/benchmark/micro_benchmark.py --save-baseline
+    python test/benchmark/micro_benchmark.py --threshold 0.2
+
+The first command stores the results as the baseline, the second one exits
+with status 1 if a benchmark got slower than the baseline by more than the
+threshold. Without a baseline it exits with status 1 as well, unless
+--allow-missing-baseline is given. Baselines are machine specific, compare
+runs on the same host.
+"""
+import argparse
+import base64
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import time
+from collections import namedtuple
+from unittest import mock
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FUNCTION_DIR = os.path.join(BASE_DIR, 'amplify', 'backend', 'function', 'AgroDetectAppFunction')
+
+TEST_CASES_DIR = os.path.join(BASE_DIR, 'test', 'stress_test', 'test_cases')
+
+DATA_DIR = os.path.join(BASE_DIR, 'data')
+
+BASELINE_PATH = os.path.join(BASE_DIR, 'test', 'benchmark', 'baseline.json')
+
+TABLE_NAME = 'BENCHMARK_TABLE'
+
+ENDPOINT_NAME = 'BENCHMARK_ENDPOINT'
+
+# The Lambda is imported as the "src" package, its preprocessing module would clash with the model one
+sys.path.insert(0, os.path.join(BASE_DIR, 'model', 'code'))
+sys.path.insert(0, FUNCTION_DIR)
+sys.path.insert(0, os.path.join(BASE_DIR, 'custom_resources', 'dynamodb'))
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-central-1')
+os.environ.setdefault('AWS_XRAY_SDK_ENABLED', 'false')
+os.environ.update({'DYNAMODB_TABLE_NAME': TABLE_NAME, 'SAGEMAKER_INFERENCE_ENDPOINT': ENDPOINT_NAME})
+
+# pylint: disable=C0413
+import boto3
+from botocore.stub import Stubber
+from consts import CLASSES
+from inference import Context, get_prediction_label, input_handler, output_handler
+from src import index
+from src.clients import reset_clients
+from upload_data import MANIFEST_NAME, to_api_response, to_compact_item, transform_to_dynamodb_format
+
+Response = namedtuple('Response', 'content, status_code')
+
+Benchmark = namedtuple('Benchmark', 'name, run, before')
+
+
+def load_corpus():
+    """ Loads the stress test images and the knowledge base items.
+
+    Returns:
+        (list, list): Image bytes and DynamoDB items.
+    """
+
+    images = []
+
+    for name in sorted(os.listdir(TEST_CASES_DIR)):
+        with open(os.path.join(TEST_CASES_DIR, name), 'rb') as f:
+            images.append(f.read())
+
+    items = []
+
+    for name in sorted(os.listdir(DATA_DIR)):
+        if name == MANIFEST_NAME:
+            continue
+
+        with open(os.path.join(DATA_DIR, name), 'r') as f:
+            items.append(transform_to_dynamodb_format(json.load(f)))
+
+    return images, items
+
+
+def cycle(values):
+    """ Endless iterator over the values, used to rotate the inputs between calls. """
+
+    while True:
+        yield from values
+
+
+def build_benchmarks(images, items):
+    """ Builds the benchmarked calls with their inputs.
+
+    Args:
+        images (list): Image bytes.
+        items (list): DynamoDB items of the knowledge base.
+
+    Returns:
+        list: Benchmarks, each with an untimed hook run before every call.
+    """
+
+    context = Context('model', 1, 'predict', None, None, None, 'application/x-image', 'application/json')
+
+    probabilities = np.random.default_rng(0).dirichlet(np.ones(len(CLASSES)))
+    prediction = json.dumps({'predictions': [probabilities.tolist()]})
+    tfs_response = Response(prediction.encode('utf-8'), 200)
+
+    next_image = cycle(images)
+    next_item = cycle(items)
+    next_compact_item = cycle([to_compact_item(to_api_response(item)) for item in items])
+
+    benchmarks = [
+        Benchmark('input_handler', lambda: input_handler(io.BytesIO(next(next_image)), context), None),
+        Benchmark('output_handler', lambda: output_handler(tfs_response, context), None),
+        Benchmark('get_prediction_label', lambda: get_prediction_label(prediction), None),
+        Benchmark('parse_dynamodb_response', lambda: index.parse_dynamodb_response(next(next_item)), None),
+        # The compact layout trades CPU for size: zlib makes the parse about 3x slower than the legacy
+        # layout (~38 us against ~13 us p50), for items of ~0.5 KB instead of ~1.2 KB read from DynamoDB
+        Benchmark('parse_dynamodb_response_compact',
+                  lambda: index.parse_dynamodb_response(next(next_compact_item)), None),
+        Benchmark('beautify', lambda: index.beautify(next(next_item)['Treatments']), None)
+    ]
+
+    return benchmarks + [build_handler_benchmark(images, items)]
+
+
+def build_handler_benchmark(images, items):
+    """ Builds the warm Lambda handler benchmark, every image misses the prediction cache.
+
+    Args:
+        images (list): Image bytes.
+        items (list): DynamoDB items of the knowledge base.
+
+    Returns:
+        Benchmark: Full handler call, the stubbed responses are queued before each call.
+    """
+
+    clients = {service_name: boto3.client(service_name) for service_name in
+               ('rekognition', 'sagemaker-runtime', 'dynamodb')}
+    stubbers = {service_name: Stubber(client) for service_name, client in clients.items()}
+
+    for stubber in stubbers.values():
+        stubber.activate()
+
+    mock.patch('boto3.client', lambda service_name, **kwargs: clients[service_name]).start()
+    mock.patch.object(index.METRICS, 'write', lambda line: None).start()
+    reset_clients()
+
+    # Loads the knowledge base once, the benchmark measures warm invocations
+    index.KNOWLEDGE_BASE.clear()
+    index.KNOWLEDGE_BASE.snapshot_path = None
+    stubbers['dynamodb'].add_response('scan', {'Items': items})
+    index.KNOWLEDGE_BASE.refresh(TABLE_NAME, clients['dynamodb'])
+
+    events = cycle([{'body': base64.b64encode(image).decode('utf-8')} for image in images])
+    labels = cycle([item['Name']['S'] for item in items])
+    current = {}
+
+    def before():
+        index.PREDICTION_CACHE.clear()
+        current['event'] = next(events)
+
+        stubbers['rekognition'].add_response('detect_labels', {'Labels': [{'Name': 'Plant'}, {'Name': 'Leaf'}]})
+        stubbers['sagemaker-runtime'].add_response(
+            'invoke_endpoint', {'Body': io.BytesIO(next(labels).encode('utf-8'))})
+
+    def run():
+        response = index.handler(current['event'], None)
+
+        if response['statusCode'] != 200:
+            raise RuntimeError('Handler failed: {}'.format(response['body']))
+
+    return Benchmark('handler', run, before)
+
+
+def percentile(sorted_values, q):
+    """ Nearest-rank percentile.
+
+    Args:
+        sorted_values (list): Values in ascending order.
+        q (float): Percentile in [0, 100].
+
+    Returns:
+        float: Percentile value.
+    """
+
+    rank = max(int(np.ceil(q / 100 * len(sorted_values))), 1)
+
+    return sorted_values[rank - 1]
+
+
+def measure(benchmark, iterations, warmup):
+    """ Times a benchmark.
+
+    Args:
+        benchmark (Benchmark): Benchmarked call.
+        iterations (int): Number of timed calls.
+        warmup (int): Number of untimed calls made first.
+
+    Returns:
+        dict: Latency percentiles in milliseconds and calls per second.
+    """
+
+    timings = []
+
+    for iteration in range(warmup + iterations):
+        if benchmark.before is not None:
+            benchmark.before()
+
+        start = time.perf_counter()
+        benchmark.run()
+        elapsed = time.perf_counter() - start
+
+        if iteration >= warmup:
+            timings.append(elapsed * 1000)
+
+    timings.sort()
+
+    return {
+        'iterations': iterations,
+        'p50_ms': percentile(timings, 50),
+        'p95_ms': percentile(timings, 95),
+        'p99_ms': percentile(timings, 99),
+        'throughput_per_s': iterations / (sum(timings) / 1000)
+    }
+
+
+def find_regressions(results, baseline, metric, threshold):
+    """ Compares the results with a baseline.
+
+    Args:
+        results (dict): Current results per benchmark.
+        baseline (dict): Baseline results per benchmark.
+        metric (str): Compared latency percentile.
+        threshold (float): Allowed relative slowdown, 0.2 allows 20%.
+
+    Returns:
+        list: Names of the benchmarks slower than the baseline by more than the threshold.
+    """
+
+    return [name for name, result in results.items()
+            if name in baseline and result[metric] > baseline[name][metric] * (1 + threshold)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200, help='timed calls per benchmark')
+    parser.add_argument('--warmup', type=int, default=20, help='untimed calls made first')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--metric', default='p50_ms', choices=('p50_ms', 'p95_ms', 'p99_ms'),
+                        help='percentile compared with the baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative slowdown')
+    parser.add_argument('--only', nargs='*', help='names of the benchmarks to run')
+    parser.add_argument('--allow-missing-baseline', action='store_true',
+                        help='exit with status 0 when there is no baseline to compare with')
+    args = parser.parse_args()
+
+    # Per request logging would dominate the timings of the small functions
+    logging.disable(logging.INFO)
+
+    images, items = load_corpus()
+    results = {}
+
+    for benchmark in build_benchmarks(images, items):
+        if args.only and benchmark.name not in args.only:
+            continue
+
+        # The handlers print their EMF metric lines, which would flood the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            results[benchmark.name] = measure(benchmark, args.iterations, args.warmup)
+
+    print('{:<34}{:>10}{:>10}{:>10}{:>14}'.format('benchmark', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'calls/s'))
+
+    for name, result in results.items():
+        print('{:<34}{:>10.3f}{:>10.3f}{:>10.3f}{:>14.1f}'.format(
+            name, result['p50_ms'], result['p95_ms'], result['p99_ms'], result['throughput_per_s']))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=4)
+
+        print('Saved baseline to {}'.format(args.baseline))
+        return
+
+    if not os.path.isfile(args.baseline):
+        print('No baseline at {}, run with --save-baseline first'.format(args.baseline))
+
+        # A gate without a baseline would pass every run
+        if not args.allow_missing_baseline:
+            sys.exit(1)
+
+        return
+
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+
+    regressions = find_regressions(results, baseline, args.metric, args.threshold)
+
+    for name in regressions:
+        print('Regression in {}: {} {:.3f} ms, baseline {:.3f} ms'.format(
+            name, args.metric, results[name][args.metric], baseline[name][args.metric]))
+
+    if regressions:
+        sys.exit(1)
+
+    print('No regression above {:.0%} on {}'.format(args.threshold, args.metric))
+
+
+if __name__ == '__main__':
+    main()
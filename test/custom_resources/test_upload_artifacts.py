@@ -0,0 +1,133 @@
+""" Checksum skip and multipart resume of upload_artifacts.
+
+Run from the repository root:
+
+    python -m pytest test/custom_resources
+"""
+import hashlib
+import json
+import os
+import sys
+
+import boto3
+import pytest
+from boto3.s3.transfer import TransferConfig
+from botocore.stub import Stubber
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+sys.path.insert(0, os.path.join(BASE_DIR, 'custom_resources', 's3'))
+
+# pylint: disable=C0413
+import upload_artifacts
+
+BUCKET_NAME = 'artifacts'
+
+OBJECT_KEY = 'model.tar.gz'
+
+# Three parts of 4, 4 and 2 bytes, sent one at a time so the stubbed calls keep their order
+CONFIG = TransferConfig(multipart_chunksize=4, max_concurrency=1)
+
+CONTENT = b'0123456789'
+
+
+@pytest.fixture
+def artifact(tmp_path):
+    path = str(tmp_path / OBJECT_KEY)
+
+    with open(path, 'wb') as f:
+        f.write(CONTENT)
+
+    return path
+
+
+@pytest.fixture
+def stubbed_client(monkeypatch):
+    client = boto3.client('s3', region_name='eu-central-1', aws_access_key_id='local',
+                          aws_secret_access_key='local')
+    monkeypatch.setattr(upload_artifacts.boto3, 'client', lambda *args, **kwargs: client)
+
+    with Stubber(client) as stubber:
+        yield client, stubber
+        stubber.assert_no_pending_responses()
+
+
+def etag(body):
+    return '"{}"'.format(hashlib.md5(body).hexdigest())
+
+
+def write_state(artifact, checksum, upload_id='upload-1'):
+    with open(artifact + '.upload', 'w') as f:
+        json.dump({'Bucket': BUCKET_NAME, 'Key': OBJECT_KEY, 'Checksum': checksum,
+                   'PartSize': CONFIG.multipart_chunksize, 'UploadId': upload_id}, f)
+
+
+def expect_part(stubber, part_number, body, upload_id='upload-1'):
+    stubber.add_response('upload_part', {'ETag': etag(body)}, {
+        'Bucket': BUCKET_NAME, 'Key': OBJECT_KEY, 'UploadId': upload_id, 'PartNumber': part_number, 'Body': body})
+
+
+def expect_complete(stubber, upload_id='upload-1'):
+    parts = [{'PartNumber': number, 'ETag': etag(CONTENT[(number - 1) * 4:number * 4])} for number in (1, 2, 3)]
+    stubber.add_response('complete_multipart_upload', {}, {
+        'Bucket': BUCKET_NAME, 'Key': OBJECT_KEY, 'UploadId': upload_id, 'MultipartUpload': {'Parts': parts}})
+
+
+def test_unchanged_artifact_is_skipped(stubbed_client, artifact):
+    _, stubber = stubbed_client
+    checksum = upload_artifacts.file_sha256(artifact)
+    stubber.add_response('head_object', {'Metadata': {upload_artifacts.CHECKSUM_METADATA: checksum}},
+                         {'Bucket': BUCKET_NAME, 'Key': OBJECT_KEY})
+
+    # No upload is stubbed, sending the artifact would fail the test
+    assert upload_artifacts.upload_object(artifact, BUCKET_NAME, OBJECT_KEY) is False
+
+
+def test_changed_artifact_is_uploaded(stubbed_client, artifact):
+    client, stubber = stubbed_client
+    metadata = []
+    client.meta.events.register('before-parameter-build.s3.PutObject',
+                                lambda params, **kwargs: metadata.append(params['Metadata']))
+    stubber.add_client_error('head_object', '404', expected_params={'Bucket': BUCKET_NAME, 'Key': OBJECT_KEY})
+    # The transfer manager adds a checksum algorithm that depends on the botocore version
+    stubber.add_response('put_object', {})
+
+    assert upload_artifacts.upload_object(artifact, BUCKET_NAME, OBJECT_KEY) is True
+    assert metadata == [{upload_artifacts.CHECKSUM_METADATA: upload_artifacts.file_sha256(artifact)}]
+
+
+def test_multipart_resumes_from_state_file(stubbed_client, artifact):
+    client, stubber = stubbed_client
+    checksum = upload_artifacts.file_sha256(artifact)
+    write_state(artifact, checksum)
+
+    # Part 1 matches the local file, part 2 was interrupted and has another MD5
+    stubber.add_response('list_parts', {'Parts': [{'PartNumber': 1, 'ETag': etag(CONTENT[:4])},
+                                                  {'PartNumber': 2, 'ETag': etag(b'xxxx')}]},
+                         {'Bucket': BUCKET_NAME, 'Key': OBJECT_KEY, 'UploadId': 'upload-1'})
+    expect_part(stubber, 2, CONTENT[4:8])
+    expect_part(stubber, 3, CONTENT[8:])
+    expect_complete(stubber)
+
+    upload_artifacts.upload_multipart(client, artifact, BUCKET_NAME, OBJECT_KEY, checksum, CONFIG)
+
+    assert not os.path.exists(artifact + '.upload')
+
+
+def test_multipart_restarts_on_stale_state_file(stubbed_client, artifact):
+    client, stubber = stubbed_client
+    checksum = upload_artifacts.file_sha256(artifact)
+    # The state of an upload of another version of the artifact is not resumed
+    write_state(artifact, 'other')
+
+    stubber.add_response('create_multipart_upload', {'UploadId': 'upload-2'}, {
+        'Bucket': BUCKET_NAME, 'Key': OBJECT_KEY, 'Metadata': {upload_artifacts.CHECKSUM_METADATA: checksum}})
+
+    for part_number in (1, 2, 3):
+        expect_part(stubber, part_number, CONTENT[(part_number - 1) * 4:part_number * 4], 'upload-2')
+
+    expect_complete(stubber, 'upload-2')
+
+    upload_artifacts.upload_multipart(client, artifact, BUCKET_NAME, OBJECT_KEY, checksum, CONFIG)
+
+    assert not os.path.exists(artifact + '.upload')
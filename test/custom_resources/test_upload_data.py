@@ -0,0 +1,192 @@
+""" BatchWriteItem retries, the dry-run diff and the ContentHash skip of upload_data.
+
+Run from the repository root:
+
+    python -m pytest test/custom_resources
+"""
+import json
+import os
+import sys
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+sys.path.insert(0, os.path.join(BASE_DIR, 'custom_resources', 'dynamodb'))
+
+# pylint: disable=C0413
+import upload_data
+
+TABLE_NAME = 'DataTable'
+
+SCAN_PARAMS = {'TableName': TABLE_NAME, 'ProjectionExpression': '#name, #hash',
+               'ExpressionAttributeNames': {'#name': 'Name', '#hash': upload_data.HASH_ATTRIBUTE}}
+
+
+def raw_object(name, description='Description'):
+    return {'Name': name, 'isDisease': 'true', 'Description': description,
+            'Treatment': {'Prune': 'Remove the infected leaves'}, 'Products': {'Fungicide': 'Copper spray'}}
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    for name in ('Apple Scab', 'Corn Rust', 'Grape Rot'):
+        with open(os.path.join(str(tmp_path), name.replace(' ', '') + '.json'), 'w') as f:
+            json.dump(raw_object(name), f)
+
+    return str(tmp_path)
+
+
+@pytest.fixture
+def stubbed_client(monkeypatch):
+    client = boto3.client('dynamodb', region_name='eu-central-1', aws_access_key_id='local',
+                          aws_secret_access_key='local')
+    monkeypatch.setattr(upload_data.boto3, 'client', lambda *args, **kwargs: client)
+
+    with Stubber(client) as stubber:
+        yield client, stubber
+        stubber.assert_no_pending_responses()
+
+
+def put_requests(items):
+    return [{'PutRequest': {'Item': item}} for item in items]
+
+
+def live_items(items, changed=(), removed=()):
+    """ Scan page of the live table, with a stale hash for the changed names. """
+
+    page = [{'Name': {'S': name}, upload_data.HASH_ATTRIBUTE: {'S': 'stale' if name in changed else item[
+        upload_data.HASH_ATTRIBUTE]['S']}} for name, item in items.items()]
+
+    return page + [{'Name': {'S': name}, upload_data.HASH_ATTRIBUTE: {'S': 'old'}} for name in removed]
+
+
+def test_write_batch_retries_unprocessed_items(stubbed_client, data_dir, monkeypatch):
+    client, stubber = stubbed_client
+    items = list(upload_data.load_items(data_dir).values())
+    sleeps = []
+    monkeypatch.setattr(upload_data.time, 'sleep', sleeps.append)
+
+    unprocessed = {TABLE_NAME: put_requests(items[1:])}
+    stubber.add_response('batch_write_item', {'UnprocessedItems': unprocessed},
+                         {'RequestItems': {TABLE_NAME: put_requests(items)}})
+    stubber.add_response('batch_write_item', {'UnprocessedItems': {TABLE_NAME: put_requests(items[2:])}},
+                         {'RequestItems': unprocessed})
+    stubber.add_response('batch_write_item', {'UnprocessedItems': {}},
+                         {'RequestItems': {TABLE_NAME: put_requests(items[2:])}})
+
+    assert upload_data.write_batch(client, TABLE_NAME, items) == 0
+    assert len(sleeps) == 2
+    # Full jitter stays under the exponential cap of each attempt
+    assert 0 <= sleeps[0] <= 0.1 and 0 <= sleeps[1] <= 0.2
+
+
+def test_write_batch_gives_up_after_max_attempts(stubbed_client, data_dir, monkeypatch):
+    client, stubber = stubbed_client
+    items = list(upload_data.load_items(data_dir).values())[:2]
+    monkeypatch.setattr(upload_data.time, 'sleep', lambda _: None)
+
+    for _ in range(2):
+        stubber.add_response('batch_write_item', {'UnprocessedItems': {TABLE_NAME: put_requests(items)}},
+                             {'RequestItems': {TABLE_NAME: put_requests(items)}})
+
+    assert upload_data.write_batch(client, TABLE_NAME, items, max_attempts=2) == 2
+
+
+def test_dry_run_prints_diff(stubbed_client, data_dir, capsys):
+    _, stubber = stubbed_client
+    items = upload_data.load_items(data_dir)
+    del items['Grape Rot']
+    stubber.add_response('scan', {'Items': live_items(items, changed=('Corn Rust',), removed=('Peach Spot',))},
+                         SCAN_PARAMS)
+
+    # No batch_write_item response is stubbed, a write would fail the test
+    diff = upload_data.upload_files(data_dir, TABLE_NAME, workers=1, dry_run=True)
+
+    assert diff == {'added': ['Grape Rot'], 'changed': ['Corn Rust'], 'unchanged': ['Apple Scab'],
+                    'removed': ['Peach Spot']}
+    assert capsys.readouterr().out.splitlines() == [
+        'Added: Grape Rot', 'Changed: Corn Rust', 'Removed: Peach Spot',
+        '1 added, 1 changed, 1 unchanged, 1 only in the table']
+
+
+def test_unchanged_items_are_skipped(stubbed_client, data_dir):
+    _, stubber = stubbed_client
+    items = upload_data.load_items(data_dir)
+    stubber.add_response('scan', {'Items': live_items(items, changed=('Corn Rust',))}, SCAN_PARAMS)
+    stubber.add_response('batch_write_item', {'UnprocessedItems': {}},
+                         {'RequestItems': {TABLE_NAME: put_requests([items['Corn Rust']])}})
+
+    diff = upload_data.upload_files(data_dir, TABLE_NAME, workers=1)
+
+    assert diff['unchanged'] == ['Apple Scab', 'Grape Rot']
+
+    # Running again against a table holding the new hashes writes nothing
+    stubber.add_response('scan', {'Items': live_items(items)}, SCAN_PARAMS)
+
+    assert upload_data.upload_files(data_dir, TABLE_NAME, workers=1)['unchanged'] == sorted(items)
+
+
+def test_content_hash_ignores_hash_attribute():
+    item = upload_data.to_compact_item(upload_data.to_api_response(raw_object('Apple Scab')))
+    hash_ = upload_data.content_hash(item)
+
+    assert upload_data.content_hash(dict(item, **{upload_data.HASH_ATTRIBUTE: {'S': hash_}})) == hash_
+    assert upload_data.content_hash(upload_data.to_compact_item(
+        upload_data.to_api_response(raw_object('Apple Scab', 'Changed')))) != hash_
+
+
+def test_transform_is_idempotent(data_dir, tmp_path):
+    output_dir = str(tmp_path / 'transformed')
+    os.makedirs(output_dir)
+
+    assert upload_data.transform_raw_data(data_dir, output_dir, workers=1) == ['AppleScab.json', 'CornRust.json',
+                                                                               'GrapeRot.json']
+    # The manifest matches every file on the next run
+    assert upload_data.transform_raw_data(data_dir, output_dir, workers=1) == []
+
+    # A new mtime with the same content is matched by the hash
+    source_path = os.path.join(data_dir, 'CornRust.json')
+    os.utime(source_path, (0, 0))
+
+    assert upload_data.transform_raw_data(data_dir, output_dir, workers=1) == []
+
+    with open(source_path, 'w') as f:
+        json.dump(raw_object('Corn Rust', 'Changed'), f)
+
+    assert upload_data.transform_raw_data(data_dir, output_dir, workers=1) == ['CornRust.json']
+
+    with open(os.path.join(output_dir, 'CornRust.json'), 'r') as f:
+        assert upload_data.detect_schema(json.load(f)) == 'json'
+
+
+def test_transform_in_place_is_idempotent(data_dir):
+    assert len(upload_data.transform_raw_data(data_dir, output_format='dynamodb', workers=1)) == 3
+    assert upload_data.transform_raw_data(data_dir, output_format='dynamodb', workers=1) == []
+
+    # Without the manifest the typed objects are recognised and left as they are
+    os.remove(os.path.join(data_dir, upload_data.MANIFEST_NAME))
+
+    assert upload_data.transform_raw_data(data_dir, output_format='dynamodb', workers=1) == []
+    assert sorted(upload_data.load_items(data_dir, 'legacy')) == ['Apple Scab', 'Corn Rust', 'Grape Rot']
+
+
+def test_compact_and_legacy_layouts_parse_alike():
+    sys.path.insert(0, os.path.join(BASE_DIR, 'amplify', 'backend', 'function', 'AgroDetectAppFunction'))
+
+    # pylint: disable=C0415
+    from src import index
+
+    data_dir = os.path.join(BASE_DIR, 'data')
+    compact_items = upload_data.load_items(data_dir, 'compact')
+    legacy_items = upload_data.load_items(data_dir, 'legacy')
+
+    assert sorted(compact_items) == sorted(legacy_items)
+
+    for name, compact_item in compact_items.items():
+        api_response = index.parse_dynamodb_response(compact_item)
+
+        assert api_response == index.parse_dynamodb_response(legacy_items[name])
+        assert api_response == upload_data.to_api_response(legacy_items[name])
@@ -0,0 +1,271 @@
+""" Local stand-in for the SageMaker endpoint, with latency and error injection.
+
+Serves the SageMaker Runtime InvokeEndpoint API and runs the request through
+the input_handler and output_handler of model/code/inference.py. Between the
+two handlers, a predictor stands in for TensorFlow Serving. It is either the
+SavedModel of model/1 on CPU or a deterministic fake. Run from the
+repository root:
+
+    python test/local_endpoint/local_endpoint.py --latency lognormal:800,0.6 --error-rate 0.08
+
+Then point the Lambda at it, with any credentials:
+
+    SAGEMAKER_ENDPOINT_URL=http://localhost:8080 python test/stress_test/load_generator.py --in-process
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODEL_DIR = os.path.join(BASE_DIR, 'model', '1')
+
+sys.path.insert(0, os.path.join(BASE_DIR, 'model', 'code'))
+
+# pylint: disable=C0413
+from consts import CLASSES
+from inference import Context, input_handler, output_handler
+
+# TensorFlow Serving response handed to output_handler
+TFSResponse = namedtuple('TFSResponse', 'content, status_code')
+
+
+class FakePredictor:
+    """ Deterministic stand-in for TensorFlow Serving, the same instance always gets the same scores. """
+
+    def predict(self, body):
+        """
+        Args:
+            body (str): TensorFlow Serving REST request body.
+        Returns:
+            (bytes): TensorFlow Serving REST response body
+        """
+
+        predictions = []
+
+        for instance in json.loads(body)['instances']:
+            digest = hashlib.sha256(json.dumps(instance).encode('utf-8')).digest()
+            logits = np.random.default_rng(int.from_bytes(digest[:8], 'little')).normal(size=len(CLASSES))
+            # A clear winner, like the real model on the test cases
+            logits[digest[8] % len(CLASSES)] += 6
+            probabilities = np.exp(logits) / np.exp(logits).sum()
+            predictions.append(probabilities.tolist())
+
+        return json.dumps({'predictions': predictions}).encode('utf-8')
+
+
+class SavedModelPredictor:
+    """ Runs the exported model on CPU, for the 'float' serialization mode only. """
+
+    def __init__(self, model_dir):
+        # pylint: disable=C0415
+        import tensorflow as tf
+
+        self.model = tf.keras.models.load_model(model_dir)
+        self.lock = threading.Lock()
+
+    def predict(self, body):
+        instances = np.asarray(json.loads(body)['instances'], dtype=np.float32)
+
+        with self.lock:
+            predictions = self.model.predict(instances, verbose=0)
+
+        return json.dumps({'predictions': predictions.tolist()}).encode('utf-8')
+
+
+def parse_latency(spec):
+    """ Parses a latency distribution, in milliseconds.
+
+    Args:
+        spec (str): 'fixed:<ms>', 'uniform:<low>,<high>' or 'lognormal:<median>,<sigma>'.
+    Returns:
+        (callable): Draws a latency in milliseconds
+    """
+
+    kind, _, params = spec.partition(':')
+    values = [float(value) for value in params.split(',')] if params else []
+
+    if kind == 'fixed':
+        return lambda: values[0]
+
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+
+    if kind == 'lognormal':
+        return lambda: random.lognormvariate(math.log(values[0]), values[1])
+
+    raise ValueError('Unsupported latency "{}", expected fixed, uniform or lognormal'.format(spec))
+
+
+class Faults:
+    """ Latency and errors added to every invocation. """
+
+    def __init__(self, latency, throttle_rate=0.0, error_rate=0.0, cold_start_ms=0.0):
+        """
+        Args:
+            latency (callable): Draws the added latency in milliseconds.
+            throttle_rate (float): Share of the invocations answered with a ThrottlingException.
+            error_rate (float): Share of the invocations answered with a 500.
+            cold_start_ms (float): Extra latency of the first invocation.
+        """
+
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.cold_start_ms = cold_start_ms
+        self.lock = threading.Lock()
+
+    def draw(self):
+        """
+        Returns:
+            (float, int): Latency in milliseconds and the injected status code, None to serve the request
+        """
+
+        with self.lock:
+            latency = self.latency() + self.cold_start_ms
+            self.cold_start_ms = 0.0
+
+        outcome = random.random()
+
+        if outcome < self.throttle_rate:
+            return latency, 400
+
+        if outcome < self.throttle_rate + self.error_rate:
+            return latency, 500
+
+        return latency, None
+
+
+def invoke(body, content_type, accept, predictor):
+    """ Runs a request through the inference handlers and the predictor.
+
+    Args:
+        body (bytes): Request body.
+        content_type (str): Request content type.
+        accept (str): Requested response type.
+        predictor (obj): Predictor exposing predict(body).
+    Returns:
+        (bytes, str): Response body and content type
+    """
+
+    context = Context('model', 1, 'predict', None, None, None, content_type, accept or 'application/json')
+
+    tfs_request = input_handler(BytesIO(body), context)
+    response, response_content_type = output_handler(TFSResponse(predictor.predict(tfs_request), 200), context)
+
+    return response.encode('utf-8') if isinstance(response, str) else response, response_content_type
+
+
+def make_handler(predictor, faults):
+    """ Builds the request handler class serving the SageMaker Runtime API. """
+
+    class EndpointHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        # pylint: disable=C0103
+        def do_GET(self):
+            if self.path == '/ping':
+                self._send(200, b'', 'text/plain')
+            else:
+                self._send_error(404, 'ValidationError', 'Unknown path {}'.format(self.path))
+
+        # pylint: disable=C0103
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+            if not self.path.startswith('/endpoints/') or not self.path.endswith('/invocations'):
+                self._send_error(404, 'ValidationError', 'Unknown path {}'.format(self.path))
+                return
+
+            latency, status_code = faults.draw()
+            time.sleep(latency / 1000)
+
+            if status_code == 400:
+                self._send_error(400, 'ThrottlingException', 'Rate exceeded')
+                return
+
+            if status_code == 500:
+                self._send_error(500, 'InternalFailure', 'Injected failure')
+                return
+
+            try:
+                response, content_type = invoke(
+                    body, self.headers.get('Content-Type'), self.headers.get('Accept'), predictor)
+            # pylint: disable=W0703
+            except Exception as error:
+                # Handler errors reach the client as a ModelError, like in the container
+                self._send_error(424, 'ModelError', str(error))
+                return
+
+            self._send(200, response, content_type)
+
+        def _send(self, status_code, body, content_type):
+            self.send_response(status_code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('x-Amzn-Invoked-Production-Variant', 'Local')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_error(self, status_code, error_type, message):
+            body = json.dumps({'message': message}).encode('utf-8')
+
+            self.send_response(status_code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('x-amzn-ErrorType', error_type)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # pylint: disable=W0622
+            pass
+
+    return EndpointHandler
+
+
+def serve(port, predictor, faults):
+    """ Creates the HTTP server, port 0 picks a free port.
+
+    Returns:
+        (ThreadingHTTPServer): Server, not yet serving
+    """
+
+    return ThreadingHTTPServer(('127.0.0.1', port), make_handler(predictor, faults))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8080, help='port to listen on')
+    parser.add_argument('--model', action='store_true', help='run the SavedModel of model/1 instead of the fake')
+    parser.add_argument('--latency', default='fixed:0', help='fixed:<ms>, uniform:<low>,<high> or lognormal:<median>,<sigma>')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of ThrottlingException responses')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of 500 responses')
+    parser.add_argument('--cold-start-ms', type=float, default=0.0, help='extra latency of the first invocation')
+    args = parser.parse_args()
+
+    predictor = SavedModelPredictor(MODEL_DIR) if args.model else FakePredictor()
+    faults = Faults(parse_latency(args.latency), args.throttle_rate, args.error_rate, args.cold_start_ms)
+
+    server = serve(args.port, predictor, faults)
+    print('Serving the SageMaker Runtime API on http://127.0.0.1:{}'.format(server.server_address[1]))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+""" SageMaker Runtime clients against the local endpoint stand-in.
+
+Run from the repository root:
+
+    python -m pytest test/model
+"""
+import os
+import sys
+import threading
+
+import boto3
+import botocore
+import pytest
+from botocore.config import Config
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+sys.path.insert(0, os.path.join(BASE_DIR, 'test', 'local_endpoint'))
+
+# pylint: disable=C0413
+from local_endpoint import CLASSES, FakePredictor, Faults, parse_latency, serve
+
+TEST_CASE = os.path.join(BASE_DIR, 'test', 'stress_test', 'test_cases', 'apple_healthy.jpg')
+
+
+@pytest.fixture
+def endpoint():
+    servers = []
+
+    def start(**faults):
+        server = serve(0, FakePredictor(), Faults(parse_latency('fixed:0'), **faults))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+
+        return boto3.client(
+            'sagemaker-runtime', region_name='eu-central-1', aws_access_key_id='local',
+            aws_secret_access_key='local', endpoint_url='http://127.0.0.1:{}'.format(server.server_address[1]),
+            config=Config(retries={'max_attempts': 1, 'mode': 'standard'}))
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def invoke(client):
+    with open(TEST_CASE, 'rb') as f:
+        return client.invoke_endpoint(EndpointName='local', Body=f.read(), ContentType='application/x-image')
+
+
+def test_invoke_returns_label(endpoint):
+    client = endpoint()
+
+    first = invoke(client)['Body'].read().decode('utf-8')
+
+    assert first in CLASSES
+    # The fake predictor is deterministic
+    assert invoke(client)['Body'].read().decode('utf-8') == first
+
+
+@pytest.mark.parametrize('faults, code', [({'throttle_rate': 1.0}, 'ThrottlingException'),
+                                          ({'error_rate': 1.0}, 'InternalFailure')])
+def test_injected_errors(endpoint, faults, code):
+    client = endpoint(**faults)
+
+    with pytest.raises(botocore.exceptions.ClientError) as error:
+        invoke(client)
+
+    assert error.value.response['Error']['Code'] == code
+
+
+def test_parse_latency():
+    assert parse_latency('fixed:25')() == 25
+    assert 10 <= parse_latency('uniform:10,20')() <= 20
+
+    with pytest.raises(ValueError):
+        parse_latency('gamma:1')
@@ -0,0 +1,95 @@
+""" Parity of the fast decode path with the original input_handler preprocessing.
+
+Run from the repository root:
+
+    python -m pytest test/model
+"""
+import os
+import sys
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+sys.path.insert(0, os.path.join(BASE_DIR, 'model', 'code'))
+
+# pylint: disable=C0413
+from consts import IMAGE_SIZE
+from preprocessing import decode_image, to_instances
+
+TEST_CASES_DIR = os.path.join(BASE_DIR, 'test', 'stress_test', 'test_cases')
+
+MODEL_DIR = os.path.join(BASE_DIR, 'model', '1')
+
+TEST_CASES = sorted(os.listdir(TEST_CASES_DIR))
+
+
+def original_instance(image_bytes):
+    """ Preprocessing of input_handler before the fast path. """
+
+    image = Image.open(BytesIO(image_bytes))
+    np_image = np.array(image.convert('RGB').resize(IMAGE_SIZE), dtype='f')
+
+    return np.expand_dims(np_image / 255, axis=0)
+
+
+def fast_instance(image_bytes):
+    return to_instances([decode_image(image_bytes, IMAGE_SIZE)], IMAGE_SIZE)
+
+
+def read_test_case(name):
+    with open(os.path.join(TEST_CASES_DIR, name), 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('name', TEST_CASES)
+def test_instances_match(name):
+    image_bytes = read_test_case(name)
+
+    fast = fast_instance(image_bytes)
+
+    assert fast.dtype == np.float32
+    np.testing.assert_array_equal(fast, original_instance(image_bytes))
+
+
+def test_large_jpeg_close():
+    # Big enough for draft mode to decode at a reduced scale
+    buffer = BytesIO()
+    Image.open(BytesIO(read_test_case(TEST_CASES[0]))).resize((1200, 1200)).save(buffer, format='JPEG', quality=95)
+
+    difference = np.abs(fast_instance(buffer.getvalue()) - original_instance(buffer.getvalue()))
+
+    assert difference.mean() < 0.01
+
+
+def test_batch_shape():
+    images = [decode_image(read_test_case(name), IMAGE_SIZE) for name in TEST_CASES[:3]]
+
+    assert to_instances(images, IMAGE_SIZE).shape == (3, IMAGE_SIZE[1], IMAGE_SIZE[0], 3)
+
+
+@pytest.mark.skipif(not os.path.isfile(os.path.join(MODEL_DIR, 'saved_model.pb')),
+                    reason='SavedModel graph not checked out')
+def test_predictions_match():
+    tf = pytest.importorskip('tensorflow')
+    model = tf.keras.models.load_model(MODEL_DIR)
+
+    images_bytes = [read_test_case(name) for name in TEST_CASES]
+
+    original = np.concatenate([original_instance(image_bytes) for image_bytes in images_bytes])
+    fast = np.concatenate([fast_instance(image_bytes) for image_bytes in images_bytes])
+
+    np.testing.assert_array_equal(np.argmax(model.predict(fast), axis=1), np.argmax(model.predict(original), axis=1))
+
+
+def test_decode_timings_accumulate():
+    timings = {}
+
+    for name in TEST_CASES[:2]:
+        decode_image(read_test_case(name), IMAGE_SIZE, timings)
+
+    assert set(timings) == {'DecodeMs', 'ResizeMs'}
+    assert all(value >= 0 for value in timings.values())
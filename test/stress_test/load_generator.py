@@ -0,0 +1,402 @@
+""" Open-loop load generator reading the artillery phases of stress_test.yaml.
+
+The test cases are read and base64 encoded once, then every phase fires
+arrivalRate requests per second for duration seconds, on schedule whatever
+the response times. Requests go to the configured HTTP target or straight to
+the Lambda handler in local worker processes. Run from this directory:
+
+    python load_generator.py --output results.json
+    python load_generator.py --in-process --processes 4 --output results.json
+
+Like a Lambda container, every worker process runs one request at a time,
+requests beyond --processes wait for a free worker.
+
+The output has the "aggregate" and "intermediate" sections of an artillery
+report, so `artillery report results.json` keeps working.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import math
+import os
+import random
+import socket
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import yaml
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STRESS_TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+FUNCTION_DIR = os.path.join(BASE_DIR, 'amplify', 'backend', 'function', 'AgroDetectAppFunction')
+
+# Width of the intermediate report periods, as in artillery
+PERIOD_MS = 10000
+
+Phase = namedtuple('Phase', 'name, duration, arrival_rate')
+
+Result = namedtuple('Result', 'started_at, response_time, status_code, error')
+
+# Lambda handler of a worker process of InProcessTarget
+HANDLER = None
+
+
+def load_config(path):
+    """ Reads the target, the phases and the request of an artillery config.
+
+    Args:
+        path (str): Path of the artillery YAML file.
+
+    Returns:
+        dict: "url", "headers" and "phases" of the test.
+    """
+
+    with open(path, 'r') as f:
+        # The body template {{b64string}} is not valid YAML, it is filled in by this tool anyway
+        config = yaml.safe_load(f.read().replace('{{b64string}}', "''"))
+
+    post = next(step['post'] for step in config['scenarios'][0]['flow'] if 'post' in step)
+
+    return {
+        'url': config['config']['target'].rstrip('/') + post['url'],
+        'headers': config['config'].get('defaults', {}).get('headers', {}),
+        'phases': [Phase(phase.get('name', str(index)), phase['duration'], phase['arrivalRate'])
+                   for index, phase in enumerate(config['config']['phases'])]
+    }
+
+
+def encode_corpus(directory):
+    """ Reads and base64 encodes every test case once.
+
+    Args:
+        directory (str): Directory of the test images.
+
+    Returns:
+        list: Base64 encoded images.
+    """
+
+    corpus = []
+
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), 'rb') as f:
+            corpus.append(base64.b64encode(f.read()).decode('utf-8'))
+
+    return corpus
+
+
+class HTTPTarget:
+    """ Posts the image to the API, like the artillery scenario. """
+
+    def __init__(self, url, headers, timeout):
+        """
+        Args:
+            url (str): Inference URL.
+            headers (dict): Request headers.
+            timeout (float): Seconds before a request fails with ETIMEDOUT.
+        """
+
+        self.url = url
+        self.headers = headers
+        self.timeout = timeout
+
+    def send(self, body):
+        """ Sends one request.
+
+        Args:
+            body (str): Base64 encoded image.
+
+        Returns:
+            int: HTTP status code.
+        """
+
+        request = urllib.request.Request(self.url, data=body.encode('utf-8'), headers=self.headers, method='POST')
+
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+        except (socket.timeout, TimeoutError) as error:
+            raise ConnectionError('ETIMEDOUT') from error
+        except urllib.error.URLError as error:
+            if isinstance(error.reason, socket.timeout):
+                raise ConnectionError('ETIMEDOUT') from error
+
+            raise ConnectionError(type(error.reason).__name__) from error
+
+
+def init_worker():
+    """ Imports the Lambda handler once per worker process. """
+
+    # pylint: disable=W0603
+    global HANDLER
+
+    # The Lambda is imported as the "src" package, like its tests do
+    sys.path.insert(0, FUNCTION_DIR)
+
+    # pylint: disable=C0415
+    from src import index
+
+    HANDLER = index.handler
+
+
+def invoke_handler(body):
+    """ Runs one request in a worker process.
+
+    Args:
+        body (str): Base64 encoded image.
+
+    Returns:
+        int: Status code of the handler response.
+    """
+
+    return HANDLER({'body': body, 'httpMethod': 'POST', 'path': '/inference'}, None)['statusCode']
+
+
+class InProcessTarget:
+    """ Calls the Lambda handler directly, with the environment of this process.
+
+    The handler keeps per container state in module globals, such as its
+    metrics, deadline and concurrency limiter, and expects one request at a
+    time. Each worker process stands for one warm container.
+    """
+
+    def __init__(self, processes):
+        """
+        Args:
+            processes (int): Number of worker processes, the concurrency of the simulated function.
+        """
+
+        self.executor = ProcessPoolExecutor(max_workers=processes, initializer=init_worker)
+
+    def send(self, body):
+        """ Sends one request.
+
+        Args:
+            body (str): Base64 encoded image.
+
+        Returns:
+            int: Status code of the handler response.
+        """
+
+        return self.executor.submit(invoke_handler, body).result()
+
+    def close(self):
+        """ Stops the worker processes. """
+
+        self.executor.shutdown()
+
+
+async def fire(target, body, results):
+    """ Sends one request on the default executor and records its outcome. """
+
+    started_at = time.time()
+    start = time.perf_counter()
+
+    try:
+        status_code = await asyncio.get_running_loop().run_in_executor(None, target.send, body)
+        error = None
+    except ConnectionError as connection_error:
+        status_code, error = None, str(connection_error)
+    # pylint: disable=W0703
+    except Exception as exception:
+        status_code, error = None, type(exception).__name__
+
+    results.append(Result(started_at, (time.perf_counter() - start) * 1000, status_code, error))
+
+
+async def run(phases, corpus, target):
+    """ Runs the phases one after the other with open-loop arrivals.
+
+    Args:
+        phases (list): Phases of the test.
+        corpus (list): Base64 encoded images, sampled uniformly.
+        target (obj): Target exposing send(body).
+
+    Returns:
+        list: Outcome of every request.
+    """
+
+    results = []
+    tasks = []
+    start = time.perf_counter()
+    offset = 0.0
+
+    for phase in phases:
+        print('Phase "{}": {} requests/s for {} s'.format(phase.name, phase.arrival_rate, phase.duration))
+
+        for arrival in range(int(phase.duration * phase.arrival_rate)):
+            # Arrivals are scheduled from the start of the test, a slow response never delays the next one
+            delay = start + offset + arrival / phase.arrival_rate - time.perf_counter()
+
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            tasks.append(asyncio.ensure_future(fire(target, random.choice(corpus), results)))
+
+        offset += phase.duration
+
+    await asyncio.gather(*tasks)
+
+    return results
+
+
+def summarize(values):
+    """ Artillery style summary of response times.
+
+    Args:
+        values (list): Response times in milliseconds.
+
+    Returns:
+        dict: Count, extremes and percentiles.
+    """
+
+    values = sorted(values)
+
+    if not values:
+        return {'min': 0, 'max': 0, 'count': 0, 'p50': 0, 'median': 0,
+                'p75': 0, 'p90': 0, 'p95': 0, 'p99': 0, 'p999': 0}
+
+    def percentile(q):
+        return round(values[max(math.ceil(q / 100 * len(values)), 1) - 1], 1)
+
+    return {
+        'min': round(values[0], 1),
+        'max': round(values[-1], 1),
+        'count': len(values),
+        'p50': percentile(50),
+        'median': percentile(50),
+        'p75': percentile(75),
+        'p90': percentile(90),
+        'p95': percentile(95),
+        'p99': percentile(99),
+        'p999': percentile(99.9)
+    }
+
+
+def aggregate(results, period=None):
+    """ Builds an artillery report section from request outcomes.
+
+    Args:
+        results (list): Outcomes of the requests.
+        period (int, optional): Start of the intermediate period in milliseconds.
+
+    Returns:
+        dict: Counters, rates, timestamps, summaries and histograms.
+    """
+
+    counters = {
+        'vusers.created_by_name.0': len(results),
+        'vusers.created': len(results),
+        'http.requests': len(results)
+    }
+
+    for result in results:
+        if result.error is None:
+            counters['http.codes.{}'.format(result.status_code)] = \
+                counters.get('http.codes.{}'.format(result.status_code), 0) + 1
+        else:
+            counters['errors.{}'.format(result.error)] = counters.get('errors.{}'.format(result.error), 0) + 1
+
+    responded = [result for result in results if result.error is None]
+    counters['http.responses'] = len(responded)
+    counters['vusers.failed'] = len(results) - len(responded)
+    counters['vusers.completed'] = len(responded)
+
+    started = [int(result.started_at * 1000) for result in results]
+    finished = [int(result.started_at * 1000 + result.response_time) for result in responded]
+    duration = (max(started) - min(started)) / 1000 if len(started) > 1 else 1
+
+    response_times = summarize([result.response_time for result in responded])
+
+    return {
+        'counters': counters,
+        'rates': {'http.request_rate': round(len(results) / max(duration, 1))},
+        'firstCounterAt': min(started, default=None),
+        'firstHistogramAt': min(finished, default=None),
+        'lastCounterAt': max(started + finished, default=None),
+        'lastHistogramAt': max(finished, default=None),
+        'firstMetricAt': min(started, default=None),
+        'lastMetricAt': max(started + finished, default=None),
+        'period': period if period is not None else (min(started, default=0) // PERIOD_MS) * PERIOD_MS,
+        'summaries': {'http.response_time': response_times, 'vusers.session_length': response_times},
+        'histograms': {'http.response_time': response_times, 'vusers.session_length': response_times}
+    }
+
+
+def build_report(results):
+    """ Builds the artillery compatible report.
+
+    Args:
+        results (list): Outcomes of the requests.
+
+    Returns:
+        dict: "aggregate" of the whole test and "intermediate" sections per period.
+    """
+
+    periods = {}
+
+    for result in results:
+        periods.setdefault(int(result.started_at * 1000) // PERIOD_MS * PERIOD_MS, []).append(result)
+
+    return {
+        'aggregate': aggregate(results),
+        'intermediate': [aggregate(periods[period], str(period)) for period in sorted(periods)]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--config', default=os.path.join(STRESS_TEST_DIR, 'stress_test.yaml'),
+                        help='artillery config with the target and the phases')
+    parser.add_argument('--test-cases', default=os.path.join(STRESS_TEST_DIR, 'test_cases'),
+                        help='directory of the test images')
+    parser.add_argument('--target', help='inference URL, overrides the config')
+    parser.add_argument('--in-process', action='store_true', help='call the Lambda handler instead of HTTP')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                        help='worker processes running the handler with --in-process, one request each')
+    parser.add_argument('--timeout', type=float, default=10, help='seconds before a request times out')
+    parser.add_argument('--max-in-flight', type=int, default=256, help='threads sending the requests')
+    parser.add_argument('--output', default='results.json', help='path of the report')
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    corpus = encode_corpus(args.test_cases)
+
+    if args.in_process:
+        target = InProcessTarget(args.processes)
+    else:
+        target = HTTPTarget(args.target or config['url'], config['headers'], args.timeout)
+
+    loop = asyncio.new_event_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=args.max_in_flight))
+
+    try:
+        results = loop.run_until_complete(run(config['phases'], corpus, target))
+    finally:
+        loop.close()
+
+        if args.in_process:
+            target.close()
+
+    report = build_report(results)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    summary = report['aggregate']['summaries']['http.response_time']
+    print('Requests: {}, p50: {} ms, p95: {} ms, p99: {} ms'.format(
+        report['aggregate']['counters']['http.requests'], summary['p50'], summary['p95'], summary['p99']))
+    print('Report written to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,8 +9,8 @@ def sample_test_case():
     # Get the number of items in the test_case_list
     count = len(images_paths)
 
-    # Get a random int between 0 and the length of test_case_list_length
-    random_sample_idx = random.randint(0, count)
+    # Get a random index between 0 and the last item of test_case_list, randint includes both bounds
+    random_sample_idx = random.randint(0, count - 1)
 
     sample_path = os.path.join('test_cases', images_paths[random_sample_idx])
 